@@ -28,12 +28,124 @@ class Settings(BaseModel):
     secret_key: str = os.getenv("SECRET_KEY", "CHANGE_ME_IN_PRODUCTION_MIN_32_CHARS")
     # Chave secreta da Stripe para criar checkout no backend.
     stripe_api_key: str = os.getenv("STRIPE_API_KEY", "sk_test_placeholder")
+    # URL base da API Stripe; vazio usa a oficial (ex.: servidor local do bench).
+    stripe_api_base: str = os.getenv("STRIPE_API_BASE", "")
+    # Timeouts (conexao e leitura), novas tentativas e conexoes keep-alive do cliente Stripe.
+    stripe_connect_timeout_seconds: float = float(os.getenv("STRIPE_CONNECT_TIMEOUT_SECONDS", "3"))
+    stripe_timeout_seconds: float = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "15"))
+    stripe_max_network_retries: int = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+    stripe_max_connections: int = int(os.getenv("STRIPE_MAX_CONNECTIONS", "20"))
+    # Segredo de assinatura do endpoint de webhook (whsec_...); vazio desliga /pagamento/webhook.
+    stripe_webhook_secret: str = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    # Eventos de webhook aplicados por lote e espera maxima (ms) para juntar um lote.
+    stripe_webhook_batch_size: int = int(os.getenv("STRIPE_WEBHOOK_BATCH_SIZE", "200"))
+    stripe_webhook_flush_interval_ms: float = float(os.getenv("STRIPE_WEBHOOK_FLUSH_INTERVAL_MS", "10"))
     # Algoritmo de assinatura do token.
     algorithm: str = "HS256"
     # Tempo de expiracao dos tokens de acesso.
     access_token_expire_minutes: int = 30
+    # Validade dos refresh tokens (renovacao sem reenviar a senha).
+    refresh_token_expire_days: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+    # Backend de armazenamento: "tinydb" (arquivo JSON) ou "sqlite".
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "tinydb").lower()
+    # Threads do executor de I/O do banco.
+    db_io_workers: int = int(os.getenv("DB_IO_WORKERS", "4"))
     # Caminho do arquivo JSON usado pelo TinyDB.
-    database_path: str = str(BACK_ROOT / "data" / "database.json")
+    database_path: str = os.getenv("DATABASE_PATH", str(BACK_ROOT / "data" / "database.json"))
+    # Write-ahead log do TinyDB (opt-in): escritas vao para database.json.wal com fsync em lote.
+    tinydb_wal: bool = os.getenv("TINYDB_WAL", "false").lower() == "true"
+    # Intervalo maximo (ms) e tamanho de lote do group commit.
+    wal_flush_interval_ms: float = float(os.getenv("WAL_FLUSH_INTERVAL_MS", "5"))
+    wal_batch_size: int = int(os.getenv("WAL_BATCH_SIZE", "256"))
+    # Compacta o log no database.json a cada N registros.
+    wal_compact_every: int = int(os.getenv("WAL_COMPACT_EVERY", "1000"))
+    # Se true, a escrita so retorna depois do fsync do lote.
+    wal_wait_fsync: bool = os.getenv("WAL_WAIT_FSYNC", "true").lower() == "true"
+    # Caminho do arquivo SQLite quando storage_backend = "sqlite".
+    sqlite_path: str = os.getenv("SQLITE_PATH", str(BACK_ROOT / "data" / "database.sqlite3"))
+    # Quantidade maxima de produtos aceitos por importacao em lote.
+    bulk_import_max_itens: int = int(os.getenv("BULK_IMPORT_MAX_ITENS", "50000"))
+    # Cache de leitura de produtos: "memory" (LRU em processo) ou "none".
+    produtos_cache_backend: str = os.getenv("PRODUTOS_CACHE_BACKEND", "memory").lower()
+    produtos_cache_max_itens: int = int(os.getenv("PRODUTOS_CACHE_MAX_ITENS", "1024"))
+    produtos_cache_ttl_seconds: float = float(os.getenv("PRODUTOS_CACHE_TTL_SECONDS", "60"))
+    # Listagem de produtos: "storage" (filtros no backend) ou "colunar" (colunas tipadas em
+    # memoria, vetorizadas com numpy quando instalado; ver app/services/catalogo_colunar.py).
+    produtos_store: str = os.getenv("PRODUTOS_STORE", "storage").lower()
+    # Com SQLite, intervalo para trazer produtos gravados por outros workers para as colunas.
+    produtos_colunar_sync_segundos: float = float(os.getenv("PRODUTOS_COLUNAR_SYNC_SEGUNDOS", "5"))
+    # Com SQLite, intervalo para trazer produtos gravados por outros workers para o indice de busca.
+    produtos_busca_sync_segundos: float = float(os.getenv("PRODUTOS_BUSCA_SYNC_SEGUNDOS", "5"))
+    # Termos do vocabulario por prefixo na busca (os que aparecem em mais produtos).
+    produtos_busca_max_expansoes: int = int(os.getenv("PRODUTOS_BUSCA_MAX_EXPANSOES", "50"))
+    # Esquemas de hash de senha: o primeiro gera hashes novos; os demais so sao aceitos
+    # e trocados pelo primeiro no proximo login (ex.: "argon2,pbkdf2_sha256").
+    password_schemes: list[str] = [
+        scheme.strip() for scheme in os.getenv("PASSWORD_SCHEMES", "pbkdf2_sha256").split(",") if scheme.strip()
+    ]
+    # Iteracoes do PBKDF2; hashes com outro valor sao refeitos no proximo login.
+    pbkdf2_rounds: int = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+    # Argon2id (requer argon2-cffi): memoria em KiB, iteracoes e paralelismo.
+    argon2_memory_cost: int = int(os.getenv("ARGON2_MEMORY_COST", "19456"))
+    argon2_time_cost: int = int(os.getenv("ARGON2_TIME_COST", "2"))
+    argon2_parallelism: int = int(os.getenv("ARGON2_PARALLELISM", "1"))
+    # Processos dedicados ao hash de senha (0 = usa o threadpool do proprio processo).
+    password_hash_workers: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+    # Hashes em andamento + na fila por processo da API; acima disso responde 429.
+    password_hash_max_pending: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+    # Servidor: host, porta e quantidade de processos worker do uvicorn.
+    host: str = os.getenv("HOST", "127.0.0.1")
+    port: int = int(os.getenv("PORT", "8000"))
+    # Mais de um worker exige storage_backend = "sqlite".
+    workers: int = int(os.getenv("WORKERS", "1"))
+    # Recarrega ao salvar arquivos (so com um worker, uso em desenvolvimento).
+    reload: bool = os.getenv("RELOAD", "false").lower() == "true"
+    # Cache de JWT ja verificados (por hash do token, ate o exp).
+    jwt_cache_max_itens: int = int(os.getenv("JWT_CACHE_MAX_ITENS", "4096"))
+    # Cache de existencia/ativo dos usuarios autenticados; escritas no proprio processo invalidam.
+    usuarios_cache_max_itens: int = int(os.getenv("USUARIOS_CACHE_MAX_ITENS", "4096"))
+    usuarios_cache_ttl_seconds: float = float(os.getenv("USUARIOS_CACHE_TTL_SECONDS", "30"))
+    # Fila de tarefas em segundo plano: "memory" (perde o que estiver pendente ao reiniciar)
+    # ou "sqlite" (arquivo proprio, sobrevive a reinicios e e compartilhado entre workers).
+    tarefas_backend: str = os.getenv("TAREFAS_BACKEND", "memory").lower()
+    tarefas_sqlite_path: str = os.getenv("TAREFAS_SQLITE_PATH", str(BACK_ROOT / "data" / "tarefas.sqlite3"))
+    # Tarefas executadas ao mesmo tempo por processo e tentativas antes de desistir.
+    tarefas_workers: int = int(os.getenv("TAREFAS_WORKERS", "2"))
+    tarefas_max_tentativas: int = int(os.getenv("TAREFAS_MAX_TENTATIVAS", "5"))
+    # Intervalo das rotinas periodicas (reconciliacao e expiracao de pedidos); 0 desliga.
+    tarefas_intervalo_segundos: float = float(os.getenv("TAREFAS_INTERVALO_SEGUNDOS", "300"))
+    # Pedidos pendentes ha mais que isso sao conferidos na Stripe.
+    pedidos_reconciliar_apos_minutos: int = int(os.getenv("PEDIDOS_RECONCILIAR_APOS_MINUTOS", "15"))
+    # Pedidos ainda pendentes depois disso sao cancelados (a sessao da Stripe expira em 24h).
+    pedidos_pendentes_expiram_horas: int = int(os.getenv("PEDIDOS_PENDENTES_EXPIRAM_HORAS", "25"))
+    # Envio de emails (recuperacao de senha); sem SMTP_HOST o email so e registrado no log.
+    smtp_host: str = os.getenv("SMTP_HOST", "")
+    smtp_port: int = int(os.getenv("SMTP_PORT", "587"))
+    smtp_user: str = os.getenv("SMTP_USER", "")
+    smtp_password: str = os.getenv("SMTP_PASSWORD", "")
+    smtp_starttls: bool = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+    smtp_from: str = os.getenv("SMTP_FROM", "nao-responda@localhost")
+    smtp_timeout_seconds: float = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+    # Link enviado no email de recuperacao; {token} e substituido (vazio envia so o token).
+    password_reset_url: str = os.getenv("PASSWORD_RESET_URL", "")
+    # Metricas no formato Prometheus em GET /metrics (latencia por rota, banco, hash e JWT).
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Se definido, /metrics exige "Authorization: Bearer <token>".
+    metrics_token: str = os.getenv("METRICS_TOKEN", "")
+    # Rastreamento das consultas ao storage (documentos examinados x devolvidos, em /metrics).
+    query_trace_enabled: bool = os.getenv("QUERY_TRACE_ENABLED", "true").lower() == "true"
+    # Consultas mais lentas que isso (ms) vao para o log como aviso; 0 desliga o log.
+    slow_query_ms: float = float(os.getenv("SLOW_QUERY_MS", "100"))
+    # Perfil sob demanda de requisicoes (diagnostico em producao); desligado por padrao.
+    profiling_enabled: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    # Token do cabecalho X-Profile (perfila a requisicao) e do GET /admin/perfis.
+    profiling_token: str = os.getenv("PROFILING_TOKEN", "")
+    # Fracao das requisicoes perfiladas sem o cabecalho (0 a 1).
+    profiling_sample_rate: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    # Intervalo entre amostras de pilha, funcoes guardadas por perfil e perfis mantidos em memoria.
+    profiling_interval_ms: float = float(os.getenv("PROFILING_INTERVAL_MS", "2"))
+    profiling_top_n: int = int(os.getenv("PROFILING_TOP_N", "30"))
+    profiling_max_perfis: int = int(os.getenv("PROFILING_MAX_PERFIS", "50"))
     # Em desenvolvimento pode expor token de reset na resposta.
     debug_password_reset_token: bool = os.getenv("DEBUG_PASSWORD_RESET_TOKEN", "false").lower() == "true"
 
@@ -5,6 +5,7 @@ class ItemCarrinho(BaseModel):
     nome: str
     preco_unitario: float # Em reais (ex: 10.50)
     quantidade: int
+    produto_id: Optional[int] = None # Vincula o item ao produto (e ao fornecedor) para o historico de vendas
 
 class CheckoutRequest(BaseModel):
     itens: List[ItemCarrinho]
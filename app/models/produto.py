@@ -1,7 +1,7 @@
 
 from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import date
+from typing import List, Optional
+from datetime import date, datetime
 
 class ProdutoCreateSchema(BaseModel):
     # Informações Básicas
@@ -33,7 +33,17 @@ class ProdutoCreateSchema(BaseModel):
     
 class ProdutoSchema(ProdutoCreateSchema):
     id: int
+    atualizado_em: Optional[datetime] = None
 
     class Config:
         from_attributes = True
-        
\ No newline at end of file
+
+# Erro de validacao de uma linha da importacao em lote
+class BulkImportErro(BaseModel):
+    linha: int
+    erros: List[str]
+
+class BulkImportResponse(BaseModel):
+    inseridos: int
+    ids: List[int]
+    erros: List[BulkImportErro]
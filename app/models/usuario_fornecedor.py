@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import List, Optional
 
 class UserFornecedorCreateSchema(BaseModel):
     nome: str
@@ -61,14 +61,44 @@ class MetodoPagamentoSchema(MetodoPagamento):
 # Schemas para o histórico de vendas do fornecedor
 class HistoricoVenda(BaseModel):
     id: int
+    pedido_id: int
     produto_id: int
+    nome_produto: Optional[str] = None
     quantidade: int
+    preco_unitario: float
     valor_total: float
     data_venda: datetime
 
+# Schemas para o dashboard de vendas do fornecedor (lido dos agregados)
+class VendasPeriodo(BaseModel):
+    inicio: date
+    quantidade: int
+    receita: float
+
+class VendasProduto(BaseModel):
+    produto_id: int
+    nome_produto: Optional[str] = None
+    quantidade: int
+    receita: float
+
+class DashboardFornecedor(BaseModel):
+    data_inicio: date
+    data_fim: date
+    periodo: str
+    receita_total: float
+    quantidade_total: int
+    por_periodo: List[VendasPeriodo]
+    por_produto: List[VendasProduto]
+    mais_vendidos: List[VendasProduto]
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+# Schema para renovar a sessao ou encerrar (logout) com o refresh token
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class MensageResponse(BaseModel):
     mensagem: str
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 # Schemas para o modelo de usuário do restaurante
@@ -70,14 +70,19 @@ class MetodoPagamentoSchema(MetodoPagamento):
     data_criacao: datetime = Field(default_factory=datetime.now)
     data_atualizacao: Optional[datetime] = None
 
-# Schemas para o histórico de compras do restaurante
+# Schemas para o histórico de compras do restaurante (um item por pedido)
+class ItemCompra(BaseModel):
+    nome: str
+    preco_unitario: float
+    quantidade: int
+    produto_id: Optional[int] = None
+
 class HistoricoCompra(BaseModel):
     id: int
-    id_usuario: int
-    id_produto: int
-    quantidade: int
+    status: str
     preco_total: float
-    data_compra: datetime = Field(default_factory=datetime.now)
+    data_compra: datetime
+    itens: List[ItemCompra] = []
 
 # Schema para atualizar os dados do perfil (tudo opcional)
 class HistoricoCompraSchema(HistoricoCompra):
@@ -87,6 +92,11 @@ class HistoricoCompraSchema(HistoricoCompra):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+# Schema para renovar a sessao ou encerrar (logout) com o refresh token
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class MensageResponse(BaseModel):
     mensagem: str
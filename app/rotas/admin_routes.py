@@ -0,0 +1,39 @@
+import secrets
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from app.config import settings
+from app.services import perfilador
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+
+def require_profiling_token(request: Request) -> None:
+    # Sem PROFILING_TOKEN ninguem le os perfis (podem conter caminhos e dados das rotas).
+    esperado = f"Bearer {settings.profiling_token}"
+    if not settings.profiling_token or not secrets.compare_digest(
+        request.headers.get("Authorization", ""), esperado
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de perfil invalido.")
+
+
+@router.get("/perfis", response_model=List[dict], dependencies=[Depends(require_profiling_token)])
+async def listar_perfis(
+    rota: str | None = None,
+    limit: int = Query(20, ge=1, le=500),
+):
+    """Perfis guardados, do mais recente para o mais antigo (sem as amostras de pilha)."""
+    perfis = [perfil for perfil in perfilador.listar() if rota is None or perfil["rota"] == rota]
+    return [
+        {chave: valor for chave, valor in perfil.items() if chave != "top_frames"}
+        for perfil in perfis[:limit]
+    ]
+
+
+@router.get("/perfis/{perfil_id}", response_model=dict, dependencies=[Depends(require_profiling_token)])
+async def obter_perfil(perfil_id: int):
+    perfil = perfilador.obter(perfil_id)
+    if perfil is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Perfil nao encontrado.")
+    return perfil
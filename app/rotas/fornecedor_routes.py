@@ -1,9 +1,10 @@
 import secrets
-from datetime import datetime
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Response, status, Depends
 from app.config import settings
-from app.services.database import (
+from app.services.async_database import (
     find_fornecedor_by_email, 
     insert_fornecedor, 
     update_fornecedor, 
@@ -14,13 +15,18 @@ from app.services.database import (
     get_metodo_pagamento,
     update_metodo_pagamento_db,
     delete_metodo_pagamento_db,
-    list_vendas_by_fornecedor
+    list_vendas_by_fornecedor,
+    dashboard_fornecedor,
 )
-from app.services.security import get_password_hash, verify_password, create_access_token, require_role
+from app.services import tarefas
+from app.services.password_hashing import check_password_and_update, hash_password
+from app.services.security import create_token_pair, require_role, revoke_refresh, rotate_refresh_token
+from app.services.storage import DuplicateKeyError
 
 from app.models.usuario_fornecedor import (
     MensageResponse,
     TokenResponse,
+    RefreshTokenRequest,
     UserFornecedorCreateSchema,
     UserFornecedorLoginSchema,
     UserFornecedorUpdateSchema,
@@ -30,72 +36,97 @@ from app.models.usuario_fornecedor import (
     MetodoPagamento,
     MetodoPagamentoSchema,
     HistoricoVenda,
+    DashboardFornecedor,
 )
 
 router = APIRouter(prefix="/fornecedores", tags=["Fornecedores"])
 
 # Rota para registro de fornecedor
 @router.post("/register", response_model=MensageResponse)
-def register_fornecedor(data: UserFornecedorCreateSchema):
-    if find_fornecedor_by_email(data.email):
+async def register_fornecedor(data: UserFornecedorCreateSchema):
+    if await find_fornecedor_by_email(data.email):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email já cadastrado.")
     
     user_data = data.model_dump()
-    user_data['senha'] = get_password_hash(user_data['senha'])
+    try:
+        user_data['senha'] = await hash_password(user_data['senha'])
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc))
     user_data['email'] = user_data['email'].lower().strip()
     
-    insert_fornecedor(user_data)
+    try:
+        await insert_fornecedor(user_data)
+    except DuplicateKeyError:
+        # Cadastro concorrente com o mesmo email passou pela verificacao acima.
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email já cadastrado.")
     return {"mensagem": "Fornecedor cadastrado com sucesso."}
 
 # Rota para login de fornecedor
 @router.post("/login", response_model=TokenResponse)
-def login_fornecedor(data: UserFornecedorLoginSchema):
-    user = find_fornecedor_by_email(data.email)
+async def login_fornecedor(data: UserFornecedorLoginSchema):
+    user = await find_fornecedor_by_email(data.email)
     
-    if not user or not verify_password(data.senha, user['senha']):
+    valido, novo_hash = await check_password_and_update(data.senha, user['senha']) if user else (False, None)
+    if not valido:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas.")
+
+    # Hash com esquema/custo antigo: troca pelo da configuracao atual.
+    if novo_hash:
+        await update_fornecedor(user['email'], {'senha': novo_hash})
     
-    token = create_access_token({"sub": user['email'], "role": "fornecedor", "nome": user['nome']})
-    return {"access_token": token, "token_type": "bearer"}
+    return create_token_pair(user['email'], "fornecedor", user['nome'])
+
+# Rota para renovar a sessao com o refresh token (o token usado deixa de valer)
+@router.post("/refresh", response_model=TokenResponse)
+async def refresh_token_fornecedor(data: RefreshTokenRequest):
+    return await rotate_refresh_token(data.refresh_token, "fornecedor")
+
+# Rota para encerrar a sessao (revoga o refresh token)
+@router.post("/logout", response_model=MensageResponse)
+async def logout_fornecedor(data: RefreshTokenRequest):
+    await revoke_refresh(data.refresh_token, "fornecedor")
+    return {"mensagem": "Sessão encerrada com sucesso."}
 
 # Rota para solicitar recuperação de senha
 @router.post("/forgot-password", response_model=ForgotPasswordResponse)
-def forgot_password(data: ForgotPasswordRequest):
-    user = find_fornecedor_by_email(data.email)
+async def forgot_password(data: ForgotPasswordRequest):
+    user = await find_fornecedor_by_email(data.email)
     if not user:
         return ForgotPasswordResponse(mensagem="Se um usuário com este email existir, um email de recuperação será enviado.")
 
-    try:
-        token = secrets.token_urlsafe(20)
-        update_fornecedor(user["email"], {"reset_token": token})
-        response = {"mensagem": "Email de recuperação enviado."}
-        if settings.debug_password_reset_token:
-            response["token_debug"] = token
-        return ForgotPasswordResponse(**response)
-    except Exception as error:
-        # TODO: Adicionar log do erro para depuração
-        raise HTTPException(
-           status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-           detail="Ocorreu um erro ao processar a solicitação.", 
-        )
+    token = secrets.token_urlsafe(20)
+    await update_fornecedor(user["email"], {"reset_token": token})
+    # O email sai pela fila de tarefas, fora do tempo de resposta.
+    await tarefas.enqueue("enviar_email_reset", {"email": user["email"], "token": token})
+    response = {"mensagem": "Email de recuperação enviado."}
+    if settings.debug_password_reset_token:
+        response["token_debug"] = token
+    return ForgotPasswordResponse(**response)
 
 # Rota para resetar a senha usando o token de recuperação
 @router.post("/reset-password", response_model=MensageResponse)
-def update_password(data: ResetPasswordRequest):
+async def update_password(data: ResetPasswordRequest):
     if data.senha != data.confirma_senha:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Senha e Confirma senha não conferem.",
         )
 
-    user = find_fornecedor_reset_token(data.token)
+    user = await find_fornecedor_reset_token(data.token)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Token de recuperação de senha inválido ou expirado.",
         )
     try:
-        update_fornecedor(user["email"], {"senha": get_password_hash(data.senha), "reset_token": None})
+        new_hash = await hash_password(data.senha)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc))
+    try:
+        # Troca de senha derruba as sessoes abertas (refresh tokens emitidos antes).
+        await update_fornecedor(
+            user["email"], {"senha": new_hash, "reset_token": None, "tokens_revogados_em": time.time()}
+        )
         return MensageResponse(mensagem="Senha atualizada com sucesso.")
     except Exception as error:
         raise HTTPException(
@@ -105,39 +136,29 @@ def update_password(data: ResetPasswordRequest):
 
 # Rota para atualização de perfil
 @router.put("/perfil", response_model=MensageResponse)
-def update_perfil(data: UserFornecedorUpdateSchema, email: str = Depends(require_role("fornecedor"))):
-    # Verifica se o fornecedor existe
-    user = find_fornecedor_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fornecedor não encontrado.")
-    
+async def update_perfil(data: UserFornecedorUpdateSchema, email: str = Depends(require_role("fornecedor"))):
     # Atualiza apenas os campos fornecidos
     updates = data.model_dump(exclude_unset=True)
-    update_fornecedor(email, updates)
+    await update_fornecedor(email, updates)
     return {"mensagem": "Perfil atualizado com sucesso."}
 
 # Rota para deletar perfil
 @router.delete("/perfil", response_model=MensageResponse)
-def delete_perfil(email: str = Depends(require_role("fornecedor"))):
-    # Verifica se o fornecedor existe
-    user = find_fornecedor_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fornecedor não encontrado.")
-    
+async def delete_perfil(email: str = Depends(require_role("fornecedor"))):
     # Deleta o fornecedor do banco de dados
-    delete_fornecedor(email)
+    await delete_fornecedor(email)
     return {"mensagem": "Perfil deletado com sucesso."}
 
 # Rotas para métodos de pagamento do fornecedor
 @router.post("/metodos-pagamento", response_model=MetodoPagamentoSchema)
-def adicionar_metodo_pagamento(data: MetodoPagamento, current_email: str = Depends(require_role("fornecedor"))):
+async def adicionar_metodo_pagamento(data: MetodoPagamento, current_email: str = Depends(require_role("fornecedor"))):
     # Prepara os dados
     metodo_dict = data.model_dump()
     metodo_dict["fornecedor_email"] = current_email
     metodo_dict["data_criacao"] = datetime.now().isoformat()
     
     # Insere no banco
-    doc_id = insert_metodo_pagamento(metodo_dict)
+    doc_id = await insert_metodo_pagamento(metodo_dict)
     
     # Retorna com ID
     metodo_dict["id"] = doc_id
@@ -145,13 +166,13 @@ def adicionar_metodo_pagamento(data: MetodoPagamento, current_email: str = Depen
 
 # Rota para listar métodos de pagamento do fornecedor
 @router.get("/metodos-pagamento", response_model=List[MetodoPagamentoSchema])
-def listar_metodos_pagamento(current_email: str = Depends(require_role("fornecedor"))):
-    return list_metodos_pagamento_by_email(current_email)
+async def listar_metodos_pagamento(current_email: str = Depends(require_role("fornecedor"))):
+    return await list_metodos_pagamento_by_email(current_email)
 
 # Rota para atualizar método de pagamento
 @router.put("/metodos-pagamento/{id}", response_model=MetodoPagamentoSchema)
-def atualizar_metodo_pagamento(id: int, data: MetodoPagamento, current_email: str = Depends(require_role("fornecedor"))):
-    metodo_existente = get_metodo_pagamento(id)
+async def atualizar_metodo_pagamento(id: int, data: MetodoPagamento, current_email: str = Depends(require_role("fornecedor"))):
+    metodo_existente = await get_metodo_pagamento(id)
     
     if not metodo_existente or metodo_existente.get("fornecedor_email") != current_email:
         raise HTTPException(status_code=404, detail="Método de pagamento não encontrado.")
@@ -159,7 +180,7 @@ def atualizar_metodo_pagamento(id: int, data: MetodoPagamento, current_email: st
     updates = data.model_dump()
     updates["data_atualizacao"] = datetime.now().isoformat()
     
-    update_metodo_pagamento_db(id, updates)
+    await update_metodo_pagamento_db(id, updates)
     
     # Mescla os dados existentes com os novos para retorno
     metodo_existente.update(updates)
@@ -167,16 +188,48 @@ def atualizar_metodo_pagamento(id: int, data: MetodoPagamento, current_email: st
 
 # Rota para deletar método de pagamento
 @router.delete("/metodos-pagamento/{id}", response_model=MensageResponse)
-def remover_metodo_pagamento(id: int, current_email: str = Depends(require_role("fornecedor"))):
-    metodo_existente = get_metodo_pagamento(id)
+async def remover_metodo_pagamento(id: int, current_email: str = Depends(require_role("fornecedor"))):
+    metodo_existente = await get_metodo_pagamento(id)
     
     if not metodo_existente or metodo_existente.get("fornecedor_email") != current_email:
         raise HTTPException(status_code=404, detail="Método de pagamento não encontrado.")
         
-    delete_metodo_pagamento_db(id)
+    await delete_metodo_pagamento_db(id)
     return {"mensagem": "Método de pagamento removido com sucesso."}
 
 # Rota para listar histórico de vendas do fornecedor
 @router.get("/historico-vendas", response_model=List[HistoricoVenda])
-def listar_historico_vendas(current_email: str = Depends(require_role("fornecedor"))):
-    return list_vendas_by_fornecedor(current_email)
+async def listar_historico_vendas(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    after_id: Optional[int] = None,
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    current_email: str = Depends(require_role("fornecedor")),
+):
+    try:
+        vendas = await list_vendas_by_fornecedor(
+            current_email, limit=limit, after_id=after_id, data_inicio=data_inicio, data_fim=data_fim
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    # Pagina cheia: informa o cursor para buscar a proxima.
+    if len(vendas) == limit:
+        response.headers["X-Next-After-Id"] = str(vendas[-1]["id"])
+    return vendas
+
+
+@router.get("/dashboard", response_model=DashboardFornecedor)
+async def obter_dashboard(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    periodo: str = Query("dia", pattern="^(dia|semana)$"),
+    top: int = Query(10, ge=1, le=100),
+    current_email: str = Depends(require_role("fornecedor")),
+):
+    # Sem datas: ultimos 30 dias (UTC, como data_venda).
+    data_fim = data_fim or datetime.now(timezone.utc).date()
+    data_inicio = data_inicio or data_fim - timedelta(days=29)
+    if data_inicio > data_fim:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="data_inicio maior que data_fim.")
+    return await dashboard_fornecedor(current_email, data_inicio, data_fim, periodo=periodo, top=top)
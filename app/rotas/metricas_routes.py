@@ -0,0 +1,18 @@
+import secrets
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+from app.config import settings
+from app.services import metricas
+
+router = APIRouter(tags=["Metricas"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def exportar_metricas(request: Request):
+    if settings.metrics_token:
+        esperado = f"Bearer {settings.metrics_token}"
+        if not secrets.compare_digest(request.headers.get("Authorization", ""), esperado):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de metricas invalido.")
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
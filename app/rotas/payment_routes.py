@@ -1,17 +1,27 @@
+import logging
+import secrets
+
 import stripe
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 
 from app.config import settings
 from app.models.payment import CheckoutRequest, CheckoutResponse
-from app.services.database import insert_pedido, update_pedido_status
+from app.services import stripe_client, stripe_webhooks
+from app.services.async_database import (
+    get_pedido_by_session,
+    get_produtos_por_id,
+    insert_pedido,
+    update_pedido,
+    update_pedido_status,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/pagamento", tags=["Pagamento"])
 
 
 @router.post("/checkout", response_model=CheckoutResponse)
-def create_checkout_session(data: CheckoutRequest):
-    stripe.api_key = settings.stripe_api_key
-
+async def create_checkout_session(data: CheckoutRequest):
     if not settings.stripe_api_key or "placeholder" in settings.stripe_api_key:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -27,58 +37,107 @@ def create_checkout_session(data: CheckoutRequest):
     if not data.itens:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="O carrinho nao pode estar vazio.")
 
-    try:
-        line_items = []
-        total_amount = 0
-
-        for item in data.itens:
-            preco_centavos = int(item.preco_unitario * 100)
-            total_amount += preco_centavos * item.quantidade
-            line_items.append(
-                {
-                    "price_data": {
-                        "currency": "brl",
-                        "product_data": {"name": item.nome},
-                        "unit_amount": preco_centavos,
-                    },
-                    "quantity": item.quantidade,
-                }
-            )
-
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=line_items,
-            mode="payment",
-            success_url="http://127.0.0.1:8000/pagamento/sucesso?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="http://127.0.0.1:8000/pagamento/cancelado",
-            customer_email=data.email_cliente,
-        )
-
-        insert_pedido(
+    # Itens com produto_id levam o fornecedor do produto para o historico de vendas.
+    produto_ids = [item.produto_id for item in data.itens if item.produto_id is not None]
+    produtos = await get_produtos_por_id(produto_ids) if produto_ids else {}
+    faltando = sorted(set(produto_ids) - produtos.keys())
+    if faltando:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Produto(s) nao encontrado(s): {faltando}")
+    itens = []
+    for item in data.itens:
+        registro = item.model_dump()
+        if item.produto_id is not None:
+            registro["fornecedor_id"] = produtos[item.produto_id].get("fornecedor_id")
+        itens.append(registro)
+
+    line_items = []
+    total_amount = 0
+
+    for item in data.itens:
+        preco_centavos = int(item.preco_unitario * 100)
+        total_amount += preco_centavos * item.quantidade
+        line_items.append(
             {
-                "email": data.email_cliente,
-                "total": total_amount / 100,
-                "status": "pendente",
-                "session_id": checkout_session.id,
-                "itens": [item.model_dump() for item in data.itens],
+                "price_data": {
+                    "currency": "brl",
+                    "product_data": {"name": item.nome},
+                    "unit_amount": preco_centavos,
+                },
+                "quantity": item.quantidade,
             }
         )
 
-        return {"checkout_url": checkout_session.url, "session_id": checkout_session.id}
+    # O pedido e gravado antes da chamada: a chave de idempotencia dele garante
+    # que novas tentativas (do cliente Stripe) nao criem sessoes duplicadas.
+    idempotency_key = f"checkout-{secrets.token_urlsafe(16)}"
+    pedido_id = await insert_pedido(
+        {
+            "email": data.email_cliente,
+            "total": total_amount / 100,
+            "status": "pendente",
+            "session_id": None,
+            "idempotency_key": idempotency_key,
+            "itens": itens,
+        }
+    )
 
-    except Exception:
+    try:
+        checkout_session = await stripe_client.create_checkout_session(
+            {
+                "payment_method_types": ["card"],
+                "line_items": line_items,
+                "mode": "payment",
+                "success_url": "http://127.0.0.1:8000/pagamento/sucesso?session_id={CHECKOUT_SESSION_ID}",
+                "cancel_url": "http://127.0.0.1:8000/pagamento/cancelado",
+                "customer_email": data.email_cliente,
+                "metadata": {"pedido_id": str(pedido_id)},
+            },
+            idempotency_key=idempotency_key,
+        )
+    except stripe.StripeError:
+        logger.exception("Falha ao criar sessao de checkout do pedido %s", pedido_id)
+        await update_pedido(pedido_id, {"status": "erro"})
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Erro ao processar pagamento.",
         )
 
+    await update_pedido(pedido_id, {"session_id": checkout_session.id})
+    return {"checkout_url": checkout_session.url, "session_id": checkout_session.id}
+
 
 @router.get("/sucesso")
-def payment_success(session_id: str):
-    update_pedido_status(session_id, "pago")
+async def payment_success(session_id: str):
+    if settings.stripe_webhook_secret:
+        # Com webhook configurado o status vem so dos eventos assinados da Stripe.
+        pedido = await get_pedido_by_session(session_id)
+        return {
+            "mensagem": "Pagamento realizado com sucesso!",
+            "session_id": session_id,
+            "status": pedido.get("status") if pedido else None,
+        }
+    await update_pedido_status(session_id, "pago")
     return {"mensagem": "Pagamento realizado com sucesso!", "session_id": session_id}
 
 
+@router.post("/webhook")
+async def stripe_webhook(request: Request):
+    if not settings.stripe_webhook_secret:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Segredo do webhook Stripe nao configurado.",
+        )
+
+    payload = await request.body()
+    try:
+        event = stripe_webhooks.construct_event(payload, request.headers.get("stripe-signature"))
+    except (ValueError, stripe.SignatureVerificationError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Assinatura do webhook invalida.")
+
+    resultado = await stripe_webhooks.enqueue(event)
+    return {"recebido": True, "resultado": resultado}
+
+
 @router.get("/cancelado")
-def payment_cancel():
+async def payment_cancel():
     return {"mensagem": "O pagamento foi cancelado pelo usuario."}
@@ -1,45 +1,274 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
-from app.models.produto import ProdutoCreateSchema, ProdutoSchema
-from app.services.database import insert_produto, list_produtos, get_produto, update_produto, delete_produto
+import base64
+import binascii
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import List, Literal, Optional
+from app.config import settings
+from app.models.produto import BulkImportResponse, ProdutoCreateSchema, ProdutoSchema
+from app.services import cache
+from app.services.cache import produto_cache_key, produtos_lista_cache_key
+from app.services.async_database import (
+    insert_produto,
+    insert_produtos,
+    list_produtos,
+    buscar_produtos,
+    iter_produtos,
+    get_produto,
+    update_produto,
+    delete_produto,
+)
 
 router = APIRouter(prefix="/produtos", tags=["Produtos"])
 
 @router.post("/", response_model=ProdutoSchema)
-def create_produto(data: ProdutoCreateSchema):
+async def create_produto(data: ProdutoCreateSchema):
     # Converte para dict e serializa datas para JSON (mode='json')
     prod_data = data.model_dump(mode='json')
     
     # Insere e recupera o ID gerado pelo TinyDB
-    doc_id = insert_produto(prod_data)
+    doc_id = await insert_produto(prod_data)
     
     # Retorna o objeto com o ID injetado
     prod_data['id'] = doc_id
     return prod_data
 
+def _parse_bulk_body(body: bytes, content_type: str) -> list:
+    # Aceita array JSON, NDJSON (um produto por linha) ou CSV com cabecalho.
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        rows = csv.DictReader(io.StringIO(text))
+        # Celulas vazias viram "campo ausente" para valer o default do schema.
+        return [{key: value for key, value in row.items() if value not in ("", None)} for row in rows]
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("O corpo deve ser um array JSON de produtos.")
+    return items
+
+
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_create_produtos(request: Request, atomico: bool = False):
+    """
+    Importa produtos em lote (application/json, application/x-ndjson ou text/csv).
+
+    Linhas validas sao gravadas numa unica escrita; linhas invalidas voltam
+    em "erros". Com atomico=true nada e gravado se alguma linha falhar.
+    """
+    content_type = request.headers.get("content-type", "application/json")
+    body = await request.body()
+    try:
+        rows = await run_in_threadpool(_parse_bulk_body, body, content_type)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Arquivo invalido: {exc}")
+
+    if len(rows) > settings.bulk_import_max_itens:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Limite de {settings.bulk_import_max_itens} produtos por importacao.",
+        )
+
+    # Validacao de milhares de linhas e CPU pura: fica fora do event loop.
+    validos, erros = await run_in_threadpool(_validate_bulk_rows, rows)
+
+    if erros and atomico:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=erros)
+
+    ids = await insert_produtos(validos) if validos else []
+    return {"inseridos": len(ids), "ids": ids, "erros": erros}
+
+
+def _validate_bulk_rows(rows: list) -> tuple[list, list]:
+    validos, erros = [], []
+    for linha, row in enumerate(rows, start=1):
+        try:
+            validos.append(ProdutoCreateSchema.model_validate(row).model_dump(mode="json"))
+        except ValidationError as exc:
+            erros.append({"linha": linha, "erros": [_format_validation_error(e) for e in exc.errors()]})
+    return validos, erros
+
+
+def _format_validation_error(error: dict) -> str:
+    campo = ".".join(str(part) for part in error["loc"]) or "produto"
+    return f"{campo}: {error['msg']}"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def _cached_response(request: Request, key: str, build) -> Response:
+    """
+    Serve a resposta JSON a partir do cache (corpo ja serializado + ETag).
+
+    build() (assincrona) monta o conteudo na falta de cache e devolve (payload, headers).
+    Com If-None-Match igual ao ETag responde 304 sem corpo.
+    """
+    entry = cache.produtos_cache.get(key)
+    if entry is None:
+        payload, headers = await build()
+        body = json.dumps(jsonable_encoder(payload), ensure_ascii=False).encode("utf-8")
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        entry = (body, {**headers, "ETag": etag})
+        cache.produtos_cache.set(key, entry)
+
+    body, headers = entry
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _encode_cursor(order_by: str, item: dict) -> str:
+    # (campo, valor, id) do ultimo produto: a proxima pagina nao depende de ele ainda existir.
+    texto = json.dumps([order_by, item.get(order_by), item["id"]], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token: str, order_by: str) -> tuple:
+    try:
+        campo, valor, id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Cursor after invalido.")
+    if campo != order_by or not isinstance(id, int) or isinstance(valor, (list, dict)):
+        raise HTTPException(status_code=400, detail="Cursor after invalido para esta ordenacao.")
+    return valor, id
+
 @router.get("/", response_model=List[ProdutoSchema])
-def read_produtos():
-    return list_produtos()
+async def read_produtos(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None,
+    after_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    fornecedor_id: Optional[int] = None,
+    vende_varejo: Optional[bool] = None,
+    vende_atacado: Optional[bool] = None,
+    preco_min: Optional[float] = Query(None, ge=0),
+    preco_max: Optional[float] = Query(None, ge=0),
+    tipo_preco: Literal["varejo", "atacado"] = "varejo",
+    promocao_ativa: bool = False,
+    order_by: Literal["id", "nome_produto", "categoria", "preco_varejo", "preco_atacado"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+):
+    params = dict(
+        limit=limit,
+        after_id=after_id,
+        categoria=categoria,
+        fornecedor_id=fornecedor_id,
+        vende_varejo=vende_varejo,
+        vende_atacado=vende_atacado,
+        preco_min=preco_min,
+        preco_max=preco_max,
+        tipo_preco=tipo_preco,
+        promocao_ativa=promocao_ativa,
+        order_by=order_by,
+        descending=order == "desc",
+        cursor=_decode_cursor(after, order_by) if after else None,
+    )
+
+    async def build():
+        try:
+            items = await list_produtos(**params)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        headers = {}
+        # Pagina cheia: informa o cursor para buscar a proxima.
+        if len(items) == limit:
+            headers["X-Next-After-Id"] = str(items[-1]["id"])
+            headers["X-Next-After"] = _encode_cursor(order_by, items[-1])
+        return [ProdutoSchema.model_validate(item) for item in items], headers
+
+    return await _cached_response(request, produtos_lista_cache_key(tuple(params.items())), build)
+
+# Ordem das colunas no export CSV.
+EXPORT_CSV_FIELDS = ["id"] + [name for name in ProdutoSchema.model_fields if name != "id"]
+
+
+async def _export_ndjson(items):
+    async for item in items:
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+async def _export_csv(items):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    async for item in items:
+        writer.writerow(item)
+        # Entrega linha a linha e reaproveita o mesmo buffer.
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+@router.get("/export")
+async def export_produtos(
+    formato: Literal["ndjson", "csv"] = "ndjson",
+    updated_since: Optional[datetime] = None,
+):
+    """
+    Exporta o catalogo em streaming (NDJSON ou CSV).
+
+    Use o header X-Export-Timestamp da resposta como updated_since na
+    proxima sincronizacao para receber apenas produtos alterados.
+    """
+    exported_at = datetime.now(timezone.utc).isoformat()
+    items = iter_produtos(updated_since=updated_since)
+    if formato == "csv":
+        body, media_type = _export_csv(items), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _export_ndjson(items), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers={"X-Export-Timestamp": exported_at})
+
+@router.get("/search", response_model=List[ProdutoSchema])
+async def search_produtos(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Busca produtos por nome e categoria, do mais relevante para o menos.
+
+    Ignora acentos e maiusculas; cada palavra pode ser o inicio de um termo
+    ("tom ital" encontra "Tomate Italiano").
+    """
+    async def build():
+        items = await buscar_produtos(q, limit=limit)
+        return [ProdutoSchema.model_validate(item) for item in items], {}
+
+    return await _cached_response(request, produtos_lista_cache_key((("search", q), ("limit", limit))), build)
 
 @router.get("/{id}", response_model=ProdutoSchema)
-def read_produto(id: int):
-    prod = get_produto(id)
-    if not prod:
-        raise HTTPException(status_code=404, detail="Produto não encontrado")
-    return prod
+async def read_produto(id: int, request: Request):
+    async def build():
+        prod = await get_produto(id)
+        if not prod:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        return ProdutoSchema.model_validate(prod), {}
+
+    return await _cached_response(request, produto_cache_key(id), build)
 
 @router.put("/{id}", response_model=ProdutoSchema)
-def update_produto_route(id: int, data: ProdutoCreateSchema):
-    if not get_produto(id):
+async def update_produto_route(id: int, data: ProdutoCreateSchema):
+    if not await get_produto(id):
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
     prod_data = data.model_dump(mode='json')
-    update_produto(id, prod_data)
+    await update_produto(id, prod_data)
     prod_data['id'] = id
     return prod_data
 
 @router.delete("/{id}", status_code=204)
-def delete_produto_route(id: int):
-    if not get_produto(id):
+async def delete_produto_route(id: int):
+    if not await get_produto(id):
         raise HTTPException(status_code=404, detail="Produto não encontrado")
-    delete_produto(id)
\ No newline at end of file
+    await delete_produto(id)
\ No newline at end of file
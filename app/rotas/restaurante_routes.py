@@ -5,8 +5,11 @@ Inclui cadastro, login, recuperacao de senha e operacoes de perfil.
 """
 
 import secrets
+import time
+from datetime import datetime
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app.config import settings
@@ -16,6 +19,7 @@ from app.models.usuario_restaurante import (
     HistoricoCompraSchema,
     MetodoPagamento,
     MetodoPagamentoSchema,
+    RefreshTokenRequest,
     ResetPasswordRequest,
     UserRestauranteCreateSchema,
     UserRestauranteLoginSchema,
@@ -23,53 +27,65 @@ from app.models.usuario_restaurante import (
     TokenResponse,
     MensageResponse,
 )
-from app.services.database import (
+from app.services.async_database import (
     delete_restaurante,
     find_restaurante_by_email,
     find_restaurante_reset_token,
     insert_restaurante,
+    list_pedidos_by_email,
     update_restaurante,
 )
-from app.services.security import create_access_token, get_password_hash, require_role, verify_password
+from app.services import tarefas
+from app.services.password_hashing import check_password_and_update, hash_password
+from app.services.security import create_token_pair, require_role, revoke_refresh, rotate_refresh_token
+from app.services.storage import DuplicateKeyError
 
 router = APIRouter(prefix="/restaurantes", tags=["Restaurantes"])
 
 
 @router.post("/register", response_model=MensageResponse)
-def register_restaurante(data: UserRestauranteCreateSchema):
-    if find_restaurante_by_email(data.email):
+async def register_restaurante(data: UserRestauranteCreateSchema):
+    if await find_restaurante_by_email(data.email):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email ja cadastrado.")
 
     # Armazena senha com hash e dados normalizados.
     user_data = data.model_dump()
     try:
-        user_data["senha"] = get_password_hash(user_data["senha"])
+        user_data["senha"] = await hash_password(user_data["senha"])
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc))
     user_data["email"] = user_data["email"].lower().strip()
     user_data["ativo"] = True
     user_data["reset_token"] = None
 
-    insert_restaurante(user_data)
+    try:
+        await insert_restaurante(user_data)
+    except DuplicateKeyError:
+        # Cadastro concorrente com o mesmo email passou pela verificacao acima.
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email ja cadastrado.")
     return {"mensagem": "Restaurante cadastrado com sucesso."}
 
 
 @router.post("/login", response_model=TokenResponse)
-def login_restaurante(data: UserRestauranteLoginSchema):
-    user = find_restaurante_by_email(data.email)
+async def login_restaurante(data: UserRestauranteLoginSchema):
+    user = await find_restaurante_by_email(data.email)
 
-    if not user or not verify_password(data.senha, user["senha"]):
+    valido, novo_hash = await check_password_and_update(data.senha, user["senha"]) if user else (False, None)
+    if not valido:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais invalidas.")
 
     if not user.get("ativo", True):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario inativo.")
 
-    token = create_access_token({"sub": user["email"], "role": "restaurante", "nome": user["nome"]})
-    return {"access_token": token, "token_type": "bearer"}
+    # Hash com esquema/custo antigo: troca pelo da configuracao atual.
+    if novo_hash:
+        await update_restaurante(user["email"], {"senha": novo_hash})
+
+    return create_token_pair(user["email"], "restaurante", user["nome"])
 
 
 @router.post("/token", response_model=TokenResponse)
-def login_restaurante_oauth2(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_restaurante_oauth2(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Endpoint para fluxo OAuth2 do botao 'Authorize' do Swagger.
     username = email do restaurante
@@ -78,26 +94,44 @@ def login_restaurante_oauth2(form_data: OAuth2PasswordRequestForm = Depends()):
     email = form_data.username.strip().lower()
     senha = form_data.password
 
-    user = find_restaurante_by_email(email)
-    if not user or not verify_password(senha, user["senha"]):
+    user = await find_restaurante_by_email(email)
+    valido, novo_hash = await check_password_and_update(senha, user["senha"]) if user else (False, None)
+    if not valido:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais invalidas.")
 
     if not user.get("ativo", True):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario inativo.")
 
-    token = create_access_token({"sub": user["email"], "role": "restaurante", "nome": user["nome"]})
-    return {"access_token": token, "token_type": "bearer"}
+    # Hash com esquema/custo antigo: troca pelo da configuracao atual.
+    if novo_hash:
+        await update_restaurante(user["email"], {"senha": novo_hash})
+
+    return create_token_pair(user["email"], "restaurante", user["nome"])
+
+
+@router.post("/refresh", response_model=TokenResponse)
+async def refresh_token_restaurante(data: RefreshTokenRequest):
+    """Renova a sessao sem reenviar a senha; o refresh token usado deixa de valer."""
+    return await rotate_refresh_token(data.refresh_token, "restaurante")
+
+
+@router.post("/logout", response_model=MensageResponse)
+async def logout_restaurante(data: RefreshTokenRequest):
+    await revoke_refresh(data.refresh_token, "restaurante")
+    return {"mensagem": "Sessao encerrada com sucesso."}
 
 
 @router.post("/forgot-password", response_model=ForgotPasswordResponse)
-def forgot_password(data: ForgotPasswordRequest):
-    user = find_restaurante_by_email(data.email)
+async def forgot_password(data: ForgotPasswordRequest):
+    user = await find_restaurante_by_email(data.email)
     safe_msg = "Se um usuario com este email existir, um email de recuperacao sera enviado."
     if not user or not user.get("ativo", True):
         return ForgotPasswordResponse(mensagem=safe_msg)
 
     token = secrets.token_urlsafe(20)
-    update_restaurante(user["email"], {"reset_token": token})
+    await update_restaurante(user["email"], {"reset_token": token})
+    # O email sai pela fila de tarefas, fora do tempo de resposta.
+    await tarefas.enqueue("enviar_email_reset", {"email": user["email"], "token": token})
 
     response = {"mensagem": safe_msg}
     if settings.debug_password_reset_token:
@@ -106,11 +140,11 @@ def forgot_password(data: ForgotPasswordRequest):
 
 
 @router.post("/reset-password", response_model=MensageResponse)
-def update_password(data: ResetPasswordRequest):
+async def update_password(data: ResetPasswordRequest):
     if data.senha != data.confirma_senha:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="As senhas nao coincidem.")
 
-    user = find_restaurante_reset_token(data.token)
+    user = await find_restaurante_reset_token(data.token)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -118,50 +152,62 @@ def update_password(data: ResetPasswordRequest):
         )
 
     try:
-        new_hash = get_password_hash(data.senha)
+        new_hash = await hash_password(data.senha)
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc))
 
-    update_restaurante(user["email"], {"senha": new_hash, "reset_token": None})
+    # Troca de senha derruba as sessoes abertas (refresh tokens emitidos antes).
+    await update_restaurante(
+        user["email"], {"senha": new_hash, "reset_token": None, "tokens_revogados_em": time.time()}
+    )
     return {"mensagem": "Senha atualizada com sucesso."}
 
 
 @router.put("/perfil", response_model=MensageResponse)
-def update_perfil(data: userRestauranteUpdateSchema, email: str = Depends(require_role("restaurante"))):
-    user = find_restaurante_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurante nao encontrado.")
-
+async def update_perfil(data: userRestauranteUpdateSchema, email: str = Depends(require_role("restaurante"))):
     updates = data.model_dump(exclude_unset=True)
-    update_restaurante(email, updates)
+    await update_restaurante(email, updates)
     return {"mensagem": "Perfil atualizado com sucesso."}
 
 
 @router.delete("/perfil", response_model=MensageResponse)
-def delete_perfil(email: str = Depends(require_role("restaurante"))):
-    user = find_restaurante_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurante nao encontrado.")
-
-    delete_restaurante(email)
+async def delete_perfil(email: str = Depends(require_role("restaurante"))):
+    await delete_restaurante(email)
     return {"mensagem": "Perfil deletado com sucesso."}
 
 
 @router.post("/metodos-pagamento", response_model=MetodoPagamentoSchema)
-def adicionar_metodo_pagamento(data: MetodoPagamento, email: str = Depends(require_role("restaurante"))):
-    user = find_restaurante_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurante nao encontrado.")
-
+async def adicionar_metodo_pagamento(data: MetodoPagamento, email: str = Depends(require_role("restaurante"))):
     # Placeholder enquanto nao houver tabela especifica de metodos do restaurante.
     return MetodoPagamentoSchema(id=1, metodo=data.metodo, detalhes=data.detalhes)
 
 
 @router.get("/historico-compras", response_model=list[HistoricoCompraSchema])
-def obter_historico_compras(email: str = Depends(require_role("restaurante"))):
-    user = find_restaurante_by_email(email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurante nao encontrado.")
-
-    # Placeholder de historico ate existir relacao real com pedidos.
-    return [HistoricoCompraSchema(id=1, id_usuario=1, id_produto=1, quantidade=2, preco_total=100.0)]
+async def obter_historico_compras(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    after_id: Optional[int] = None,
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    status_pedido: Optional[str] = Query(None, alias="status"),
+    email: str = Depends(require_role("restaurante")),
+):
+    try:
+        pedidos = await list_pedidos_by_email(
+            email, limit=limit, after_id=after_id, data_inicio=data_inicio, data_fim=data_fim, status=status_pedido
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    # Pagina cheia: informa o cursor para buscar a proxima.
+    if len(pedidos) == limit:
+        response.headers["X-Next-After-Id"] = str(pedidos[-1]["id"])
+    return [
+        HistoricoCompraSchema(
+            id=pedido["id"],
+            status=pedido.get("status", "pendente"),
+            preco_total=pedido.get("total", 0),
+            data_compra=pedido["criado_em"],
+            itens=pedido.get("itens", []),
+        )
+        for pedido in pedidos
+    ]
@@ -0,0 +1,118 @@
+"""
+Agregados de vendas por fornecedor (tabela vendas_resumo).
+
+Cada linha de "vendas" soma quantidade, receita e itens em tres resumos:
+- ("dia", data da venda)
+- ("semana", segunda-feira da semana da venda)
+- ("total", "")
+sempre por fornecedor e produto. A chave
+"<periodo>:<fornecedor_id>:<produto_id>:<inicio>" e unica, entao o resumo
+e atualizado com upsert_increment no momento em que o pedido vira "pago"
+(database.registrar_vendas) e o dashboard so le poucas linhas prontas.
+
+Reconstrucao a partir do historico:
+
+    python -m app.services.agregados
+
+Com STORAGE_BACKEND=sqlite pode rodar com a API no ar. No TinyDB o
+database.json fica travado pelo processo da API: pare a API antes.
+
+Le "vendas" em lotes, reduz cada lote a um dicionario chave -> somas e
+junta os lotes. Depois, numa transacao so (storage.transaction), soma as
+vendas gravadas durante a leitura e troca a tabela inteira. Como
+registrar_vendas grava linhas e resumos tambem numa transacao, nenhuma
+venda fica de fora da troca nem e somada duas vezes.
+"""
+
+import logging
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+VENDAS_RESUMO = "vendas_resumo"
+PERIODOS = ("dia", "semana", "total")
+CAMPOS_SOMADOS = ("quantidade", "receita", "itens")
+
+
+def inicio_periodo(periodo: str, dia: date) -> str:
+    if periodo == "dia":
+        return dia.isoformat()
+    if periodo == "semana":
+        return (dia - timedelta(days=dia.weekday())).isoformat()
+    return ""
+
+
+def _chave(periodo: str, fornecedor_id: int, produto_id: int, inicio: str) -> str:
+    return f"{periodo}:{fornecedor_id}:{produto_id}:{inicio}"
+
+
+def resumos_da_linha(linha: dict) -> list[tuple[dict, dict]]:
+    """(base, incrementos) de cada resumo afetado por uma linha de venda."""
+    dia = date.fromisoformat(linha["data_venda"][:10])
+    incrementos = {"quantidade": linha["quantidade"], "receita": linha["valor_total"], "itens": 1}
+    resumos = []
+    for periodo in PERIODOS:
+        inicio = inicio_periodo(periodo, dia)
+        base = {
+            "chave": _chave(periodo, linha["fornecedor_id"], linha["produto_id"], inicio),
+            "fornecedor_id": linha["fornecedor_id"],
+            "periodo": periodo,
+            "inicio": inicio,
+            "produto_id": linha["produto_id"],
+            "nome_produto": linha.get("nome_produto"),
+        }
+        resumos.append((base, incrementos))
+    return resumos
+
+
+def reduzir_lote(linhas, acumulado: dict | None = None) -> dict:
+    """Soma um lote de linhas de venda em acumulado (chave -> documento do resumo)."""
+    acumulado = {} if acumulado is None else acumulado
+    for linha in linhas:
+        for base, incrementos in resumos_da_linha(linha):
+            doc = acumulado.get(base["chave"])
+            if doc is None:
+                acumulado[base["chave"]] = {**base, **incrementos}
+                continue
+            for campo, valor in incrementos.items():
+                doc[campo] += valor
+    return acumulado
+
+
+def reconstruir(storage, batch_size: int = 5000) -> int:
+    """Recalcula vendas_resumo a partir de "vendas". Devolve o numero de resumos gravados."""
+    acumulado: dict = {}
+    lote = []
+    ultimo_id = 0
+    for linha in storage.iter_select("vendas", batch_size=batch_size):
+        lote.append(linha)
+        ultimo_id = linha.doc_id
+        if len(lote) >= batch_size:
+            reduzir_lote(lote, acumulado)
+            lote = []
+    reduzir_lote(lote, acumulado)
+
+    # O grosso foi lido fora da transacao; dentro dela so entram as vendas novas
+    # (ids sempre crescentes), e as escritas dos outros esperam pouco.
+    with storage.transaction():
+        reduzir_lote(storage.select("vendas", after=(ultimo_id, ultimo_id)), acumulado)
+        for doc in acumulado.values():
+            doc["receita"] = round(doc["receita"], 2)
+        antigos = [doc.doc_id for doc in storage.all(VENDAS_RESUMO)]
+        for i in range(0, len(antigos), 500):
+            storage.remove(VENDAS_RESUMO, antigos[i : i + 500])
+        docs = list(acumulado.values())
+        for i in range(0, len(docs), batch_size):
+            storage.insert_multiple(VENDAS_RESUMO, docs[i : i + batch_size])
+    return len(docs)
+
+
+if __name__ == "__main__":
+    from app.services.database import storage
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        total = reconstruir(storage)
+    finally:
+        storage.close()
+    logger.info("vendas_resumo reconstruida: %s resumos.", total)
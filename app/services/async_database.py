@@ -0,0 +1,124 @@
+"""
+Versao assincrona da camada de acesso aos dados.
+
+Cada funcao de app/services/database.py e executada em um executor
+dedicado de I/O (threads "db-io"), fora do event loop e fora do threadpool
+do Starlette. Os dois backends sao thread-safe. Com o WAL do TinyDB a
+thread de I/O volta assim que a escrita entra no log; a espera pelo fsync
+acontece aqui, no event loop, entao todas as requisicoes que escreveram no
+mesmo intervalo dividem o mesmo fsync, sem ocupar as DB_IO_WORKERS threads.
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from app.config import settings
+from app.services import database, perfilador
+from app.services.wal import fsync_adiado
+
+
+_executor = ThreadPoolExecutor(max_workers=settings.db_io_workers, thread_name_prefix="db-io")
+
+
+async def run_io(func, *args, **kwargs):
+    """Executa func no executor de I/O preservando os contextvars da requisicao."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    adiados: list = []
+    context.run(fsync_adiado.set, adiados)
+    func = perfilador.na_thread(func)
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+    finally:
+        if adiados:
+            # Os seq de um log so crescem: o ultimo cobre as escritas anteriores.
+            wal, seq = adiados[-1]
+            await wal.aguardar(seq)
+
+
+def _async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_io(func, *args, **kwargs)
+
+    return wrapper
+
+
+# ---------- Usuarios gerais ----------
+find_user_by_email = _async(database.find_user_by_email)
+find_user_reset_token = _async(database.find_user_reset_token)
+insert_user = _async(database.insert_user)
+update_user = _async(database.update_user)
+
+# ---------- Restaurantes ----------
+find_restaurante_by_email = _async(database.find_restaurante_by_email)
+insert_restaurante = _async(database.insert_restaurante)
+update_restaurante = _async(database.update_restaurante)
+delete_restaurante = _async(database.delete_restaurante)
+find_restaurante_reset_token = _async(database.find_restaurante_reset_token)
+
+# ---------- Fornecedores ----------
+find_fornecedor_by_email = _async(database.find_fornecedor_by_email)
+insert_fornecedor = _async(database.insert_fornecedor)
+update_fornecedor = _async(database.update_fornecedor)
+delete_fornecedor = _async(database.delete_fornecedor)
+find_fornecedor_reset_token = _async(database.find_fornecedor_reset_token)
+
+# ---------- Estado dos usuarios autenticados ----------
+async def get_usuario_estado(table: str, email: str) -> dict:
+    # Acerto no cache nao precisa passar pelo executor de I/O.
+    estado = database.get_usuario_estado_em_cache(table, email)
+    if estado is None:
+        estado = await run_io(database.get_usuario_estado, table, email)
+    return estado
+
+
+# ---------- Refresh tokens revogados ----------
+revoke_refresh_token = _async(database.revoke_refresh_token)
+
+# ---------- Produtos ----------
+insert_produto = _async(database.insert_produto)
+insert_produtos = _async(database.insert_produtos)
+list_produtos = _async(database.list_produtos)
+buscar_produtos = _async(database.buscar_produtos)
+get_produto = _async(database.get_produto)
+get_produtos_por_id = _async(database.get_produtos_por_id)
+carregar_catalogo = _async(database.carregar_catalogo)
+update_produto = _async(database.update_produto)
+delete_produto = _async(database.delete_produto)
+
+
+async def iter_produtos(updated_since=None, batch_size: int = 500):
+    """Gera produtos em lotes buscados no executor de I/O."""
+    items = database.iter_produtos(updated_since=updated_since)
+    while True:
+        batch = await run_io(lambda: list(islice(items, batch_size)))
+        for item in batch:
+            yield item
+        if len(batch) < batch_size:
+            return
+
+
+# ---------- Pedidos ----------
+insert_pedido = _async(database.insert_pedido)
+update_pedido = _async(database.update_pedido)
+update_pedido_status = _async(database.update_pedido_status)
+get_pedido_by_session = _async(database.get_pedido_by_session)
+list_pedidos_pendentes = _async(database.list_pedidos_pendentes)
+list_pedidos_by_email = _async(database.list_pedidos_by_email)
+transicionar_pedidos = _async(database.transicionar_pedidos)
+aplicar_eventos_pagamento = _async(database.aplicar_eventos_pagamento)
+
+# ---------- Metodos de pagamento (fornecedor) ----------
+insert_metodo_pagamento = _async(database.insert_metodo_pagamento)
+list_metodos_pagamento_by_email = _async(database.list_metodos_pagamento_by_email)
+get_metodo_pagamento = _async(database.get_metodo_pagamento)
+update_metodo_pagamento_db = _async(database.update_metodo_pagamento_db)
+delete_metodo_pagamento_db = _async(database.delete_metodo_pagamento_db)
+
+# ---------- Historico de vendas ----------
+list_vendas_by_fornecedor = _async(database.list_vendas_by_fornecedor)
+dashboard_fornecedor = _async(database.dashboard_fornecedor)
@@ -0,0 +1,251 @@
+"""
+Busca textual de produtos (GET /produtos/search?q=).
+
+Indice invertido em memoria sobre nome_produto e categoria:
+- o texto e normalizado (minusculas, sem acentos: "Feijão" == "feijao") e
+  quebrado em termos
+- cada termo aponta para os produtos que o contem, com um peso por campo
+  (nome vale mais que categoria)
+- os termos ficam tambem numa lista ordenada: o prefixo "tom" encontra
+  "tomate" e "tomilho" com bisect, sem percorrer o vocabulario. Um prefixo
+  vale por ate PRODUTOS_BUSCA_MAX_EXPANSOES termos: o proprio termo e os
+  que aparecem em mais produtos. Produtos que so tem termos mais raros do
+  prefixo (ex.: q=a) ficam de fora.
+
+Todos os termos da busca precisam aparecer no produto (como termo inteiro ou
+prefixo). A nota soma, por termo da busca, peso do campo x raridade do termo
+(idf); o termo inteiro vale mais que o prefixo e a primeira palavra do nome
+vale mais que as outras. Empates saem por id. Os candidatos saem de
+operacoes de conjunto e so os grupos de maior nota sao ordenados, entao a
+busca nao calcula a nota de todos os produtos que casam.
+
+As escritas de database.py (insert_produto(s), update_produto,
+delete_produto) atualizam o indice na hora. Com varios workers (SQLite),
+produtos gravados por outros processos entram depois de
+PRODUTOS_BUSCA_SYNC_SEGUNDOS (busca por atualizado_em); um produto removido
+por outro processo sai quando a busca nao o encontra no storage.
+"""
+
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+
+from app.config import settings
+
+# Peso de cada campo indexado.
+CAMPOS = {"nome_produto": 2.0, "categoria": 1.0}
+# Peso extra da primeira palavra do nome ("Tomate Italiano" antes de "Molho de Tomate").
+_PESO_INICIO_NOME = 1.0
+# Fator do termo encontrado so por prefixo.
+_PESO_PREFIXO = 0.6
+_FIM_PREFIXO = "\U0010ffff"
+_TERMO = re.compile(r"\w+")
+
+
+def normalizar(texto) -> str:
+    """Minusculas e sem acentos ("Pão Francês" -> "pao frances")."""
+    decomposto = unicodedata.normalize("NFKD", str(texto).casefold())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def termos(texto) -> list[str]:
+    if not texto:
+        return []
+    return _TERMO.findall(normalizar(texto))
+
+
+class IndiceBusca:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._carregado = False
+        # termo -> {peso: ids dos produtos}; conjuntos permitem uniao/intersecao sem laco em Python
+        self._postings: dict[str, dict[float, set[int]]] = {}
+        # id do produto -> {termo: peso}
+        self._docs: dict[int, dict[str, float]] = {}
+        self._vocabulario: list[str] = []
+        self._sincronizado_em = ""
+        self._ultima_sync = 0.0
+
+    # ---------- Carga e escrita ----------
+    def _pesos(self, doc: dict) -> dict[str, float]:
+        pesos: dict[str, float] = {}
+        for campo, peso in CAMPOS.items():
+            for termo in termos(doc.get(campo)):
+                pesos[termo] = pesos.get(termo, 0.0) + peso
+        nome = termos(doc.get("nome_produto"))
+        if nome:
+            pesos[nome[0]] += _PESO_INICIO_NOME
+        return pesos
+
+    def _indexar(self, doc_id: int, pesos: dict[str, float]) -> list[str]:
+        """Grava os pesos do produto; devolve os termos que ainda nao existiam."""
+        self._docs[doc_id] = pesos
+        novos = []
+        for termo, peso in pesos.items():
+            grupos = self._postings.get(termo)
+            if grupos is None:
+                grupos = self._postings[termo] = {}
+                novos.append(termo)
+            grupos.setdefault(peso, set()).add(doc_id)
+        return novos
+
+    def _remover(self, doc_id: int) -> None:
+        pesos = self._docs.pop(doc_id, None)
+        if pesos is None:
+            return
+        for termo, peso in pesos.items():
+            grupos = self._postings[termo]
+            grupos[peso].discard(doc_id)
+            if not grupos[peso]:
+                del grupos[peso]
+            if not grupos:
+                del self._postings[termo]
+                del self._vocabulario[bisect_left(self._vocabulario, termo)]
+
+    def _gravar(self, doc_id: int, doc: dict) -> None:
+        self._remover(doc_id)
+        for termo in self._indexar(doc_id, self._pesos(doc)):
+            insort(self._vocabulario, termo)
+
+    def carregar(self, storage) -> None:
+        """Le a tabela produtos inteira para o indice (primeira busca ou recarga)."""
+        with self._lock:
+            inicio_carga = _agora_iso()
+            self._postings = {}
+            self._docs = {}
+            for doc in storage.iter_select("produtos", batch_size=5000):
+                self._indexar(doc.doc_id, self._pesos(doc))
+            # Ordena o vocabulario uma vez, em vez de um insort por termo novo.
+            self._vocabulario = sorted(self._postings)
+            self._sincronizado_em = inicio_carga
+            self._ultima_sync = time.monotonic()
+            self._carregado = True
+
+    def gravar(self, docs: list) -> None:
+        """Insere ou atualiza produtos (documentos com doc_id)."""
+        with self._lock:
+            if not self._carregado:
+                return
+            for doc in docs:
+                self._gravar(doc.doc_id, doc)
+
+    def remover(self, ids: list[int]) -> None:
+        with self._lock:
+            if not self._carregado:
+                return
+            for doc_id in ids:
+                self._remover(doc_id)
+
+    def _sincronizar(self, storage) -> None:
+        # Com SQLite outros workers tambem gravam: traz o que mudou desde a ultima busca.
+        if settings.storage_backend != "sqlite":
+            return
+        if time.monotonic() - self._ultima_sync < settings.produtos_busca_sync_segundos:
+            return
+        desde = self._sincronizado_em
+        self._sincronizado_em = _agora_iso()
+        self._ultima_sync = time.monotonic()
+        for doc in storage.iter_select("produtos", [("atualizado_em", ">=", desde)], batch_size=5000):
+            self._gravar(doc.doc_id, doc)
+
+    def preparar(self, storage) -> None:
+        with self._lock:
+            if not self._carregado:
+                self.carregar(storage)
+            else:
+                self._sincronizar(storage)
+
+    # ---------- Consulta ----------
+    def _frequencia(self, termo: str) -> int:
+        return sum(len(ids) for ids in self._postings[termo].values())
+
+    def _expandir(self, termo: str) -> list[str]:
+        """Termos do vocabulario que comecam com termo: ele mesmo e os mais frequentes, ate o limite."""
+        limite = max(settings.produtos_busca_max_expansoes, 1)
+        inicio = bisect_left(self._vocabulario, termo)
+        fim = bisect_left(self._vocabulario, termo + _FIM_PREFIXO, inicio)
+        if fim - inicio <= limite:
+            return self._vocabulario[inicio:fim]
+        # O proprio termo (se existir) vem primeiro na faixa e fica sempre.
+        proprio = self._vocabulario[inicio : inicio + 1] if self._vocabulario[inicio] == termo else []
+        resto = self._vocabulario[inicio + len(proprio) : fim]
+        return proprio + heapq.nlargest(limite - len(proprio), resto, key=self._frequencia)
+
+    def _fatores(self, termo: str) -> dict[str, float]:
+        """Termo do vocabulario -> multiplicador da nota, para um termo da busca."""
+        total = len(self._docs)
+        fatores = {}
+        for encontrado in self._expandir(termo):
+            frequencia = self._frequencia(encontrado)
+            idf = math.log(1 + total / frequencia)
+            fatores[encontrado] = idf if encontrado == termo else idf * _PESO_PREFIXO
+        return fatores
+
+    def _nota_no_doc(self, doc_id: int, fatores: dict[str, float]) -> float:
+        return max(
+            (peso * fatores[termo] for termo, peso in self._docs[doc_id].items() if termo in fatores),
+            default=0.0,
+        )
+
+    def buscar(self, storage, q: str, limit: int = 20) -> list[int]:
+        """Ids dos produtos que casam com q, do mais relevante para o menos."""
+        with self._lock:
+            self.preparar(storage)
+            consulta = [self._fatores(termo) for termo in dict.fromkeys(termos(q))]
+            if not consulta or not all(consulta):
+                return []
+
+            # Candidatos: produtos com todos os termos, por uniao/intersecao de conjuntos.
+            conjuntos = [
+                set().union(*(ids for termo in fatores for ids in self._postings[termo].values()))
+                for fatores in consulta
+            ]
+            ordem = sorted(range(len(consulta)), key=lambda i: len(conjuntos[i]))
+            candidatos = conjuntos[ordem[0]].intersection(*(conjuntos[i] for i in ordem[1:]))
+            if not candidatos:
+                return []
+
+            # Percorre os grupos (termo, peso) do termo mais seletivo da maior nota para a menor
+            # e para quando nenhum produto restante consegue entrar entre os limit melhores.
+            primeiro = consulta[ordem[0]]
+            resto = [consulta[i] for i in ordem[1:]]
+            niveis = sorted(
+                ((peso * fator, ids) for termo, fator in primeiro.items() for peso, ids in self._postings[termo].items()),
+                key=lambda nivel: -nivel[0],
+            )
+            resto_maximo = sum(
+                max(peso * fator for termo, fator in fatores.items() for peso in self._postings[termo])
+                for fatores in resto
+            )
+            melhores: list[tuple[float, int]] = []  # heap de (nota, -id): o pior resultado no topo
+            vistos: set[int] = set()
+            for nota, ids in niveis:
+                if len(melhores) == limit and melhores[0][0] > nota + resto_maximo:
+                    break
+                novos = (ids & candidatos) - vistos
+                if not novos:
+                    continue
+                vistos |= novos
+                if not resto:
+                    # Busca de um termo: todo o grupo tem a mesma nota, bastam os menores ids.
+                    novos = heapq.nsmallest(limit, novos)
+                for doc_id in novos:
+                    total = nota + sum(self._nota_no_doc(doc_id, fatores) for fatores in resto)
+                    item = (total, -doc_id)
+                    if len(melhores) < limit:
+                        heapq.heappush(melhores, item)
+                    elif item > melhores[0]:
+                        heapq.heapreplace(melhores, item)
+            return [-doc_id for _, doc_id in sorted(melhores, reverse=True)]
+
+
+def _agora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+indice = IndiceBusca()
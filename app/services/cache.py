@@ -0,0 +1,165 @@
+"""
+Caches em memoria da API: leituras de produtos, JWT ja verificados e
+estado dos usuarios autenticados.
+
+O backend padrao e um LRU em memoria com TTL; qualquer objeto que siga a
+interface CacheBackend (ex.: um cliente Redis adaptado) pode substitui-lo
+via set_cache_backend.
+
+Invalidacao por versao: cada produto, a listagem e o estado de cada
+usuario tem uma chave de versao.
+Escritas trocam a versao depois de gravar no banco, entao entradas montadas
+com dados antigos simplesmente deixam de ser encontradas.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+
+class CacheBackend:
+    """Interface minima de um backend de cache (ttl=0 significa sem expiracao)."""
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Backend que nunca guarda nada (cache desligado)."""
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class LRUCache(CacheBackend):
+    """LRU em memoria, thread-safe, com expiracao por entrada."""
+
+    def __init__(self, max_items: int = 1024, ttl: float | None = 60):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+def create_cache_backend(backend: str, max_items: int, ttl: float) -> CacheBackend:
+    if backend == "memory":
+        return LRUCache(max_items=max_items, ttl=ttl)
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Backend de cache desconhecido: {backend}")
+
+
+produtos_cache: CacheBackend = create_cache_backend(
+    settings.produtos_cache_backend,
+    settings.produtos_cache_max_itens,
+    settings.produtos_cache_ttl_seconds,
+)
+
+
+def set_cache_backend(backend: CacheBackend) -> None:
+    """Troca o backend do cache de produtos (ex.: cache compartilhado entre processos)."""
+    global produtos_cache
+    produtos_cache = backend
+
+
+# ---------- Chaves e invalidacao de produtos ----------
+def _versao(key: str, backend: CacheBackend | None = None) -> str:
+    backend = produtos_cache if backend is None else backend
+    versao = backend.get(key)
+    if versao is None:
+        # Versao ausente (inicio ou descartada pelo LRU) abre um espaco novo de chaves.
+        versao = secrets.token_hex(8)
+        backend.set(key, versao, ttl=0)
+    return versao
+
+
+def produto_cache_key(id: int) -> str:
+    return f"produtos:item:{id}:{_versao(f'produtos:item:{id}:versao')}"
+
+
+def produtos_lista_cache_key(params: tuple) -> str:
+    return f"produtos:lista:{_versao('produtos:lista:versao')}:{params!r}"
+
+
+def invalidate_produtos(ids: list[int] = ()) -> None:
+    """Invalida as listagens e, se informados, os produtos alterados."""
+    # A chave de versao nao expira junto com as entradas que ela protege.
+    for id in ids:
+        produtos_cache.set(f"produtos:item:{id}:versao", secrets.token_hex(8), ttl=0)
+    produtos_cache.set("produtos:lista:versao", secrets.token_hex(8), ttl=0)
+
+
+# ---------- Autenticacao ----------
+# JWT verificados: a entrada expira junto com o token (ttl calculado a partir do exp).
+tokens_cache: CacheBackend = LRUCache(max_items=settings.jwt_cache_max_itens, ttl=None)
+
+# Existencia/ativo dos usuarios autenticados por (tabela, email).
+usuarios_cache: CacheBackend = LRUCache(
+    max_items=settings.usuarios_cache_max_itens,
+    ttl=settings.usuarios_cache_ttl_seconds,
+)
+
+
+def usuario_cache_key(table: str, email: str) -> str:
+    """
+    Chave do estado do usuario, com a versao atual.
+
+    Calculada antes de ler o banco: se um update/delete trocar a versao no
+    meio da leitura, o estado lido fica numa chave que ninguem mais consulta.
+    """
+    base = f"usuarios:{table}:{email.lower().strip()}"
+    return f"{base}:{_versao(f'{base}:versao', usuarios_cache)}"
+
+
+def invalidate_usuario(table: str, email: str) -> None:
+    usuarios_cache.set(f"usuarios:{table}:{email.lower().strip()}:versao", secrets.token_hex(8), ttl=0)
@@ -0,0 +1,447 @@
+"""
+Catalogo de produtos em colunas (PRODUTOS_STORE=colunar).
+
+A listagem de produtos filtra por preco, categoria, fornecedor, tipo de
+venda e promocao. Em vez de percorrer um dict por produto, aqui cada campo
+filtravel vira uma coluna tipada:
+- id, fornecedor_id (-1 = sem fornecedor): inteiros de 64 bits
+- categoria: codigo inteiro; o texto fica uma unica vez no dicionario de
+  categorias (strings internadas)
+- vende_varejo, vende_atacado (2 = campo ausente, nao casa com nenhum
+  filtro, como no storage), ativo (linha removida = 0): bytes
+- preco_varejo, preco_atacado: float64 (NaN = sem preco)
+- inicio/fim da promocao: dia ordinal (sem data = fora de qualquer intervalo)
+
+Com numpy instalado os filtros viram operacoes vetorizadas sobre as colunas
+(poucos ms para 1M de produtos); sem numpy as colunas sao array.array e o
+filtro e um laco em Python, mais lento mas com o mesmo resultado. So os ids
+da pagina saem daqui: os documentos sao lidos do storage.
+
+As escritas de database.py (insert_produto(s), update_produto,
+delete_produto) atualizam as colunas na hora. Com varios workers (SQLite),
+produtos gravados por outros processos entram na proxima consulta depois de
+PRODUTOS_COLUNAR_SYNC_SEGUNDOS (busca por atualizado_em); um produto
+removido por outro processo sai quando a pagina nao o encontra no storage.
+"""
+
+import math
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timezone
+
+from app.config import settings
+
+try:
+    import numpy as np
+except ImportError:
+    # Sem numpy: mesmas colunas em array.array, filtradas em Python.
+    np = None
+
+# Campos de ordenacao atendidos pelas colunas; os demais ficam com o storage.
+ORDENACOES = ("id", "categoria", "preco_varejo", "preco_atacado")
+
+_SEM_FORNECEDOR = -1
+_SEM_CATEGORIA = -1
+_SEM_INICIO = 2**31 - 1
+_SEM_FIM = 0
+_SEM_VALOR = 2
+
+# nome da coluna -> typecode do array.array (o dtype do numpy equivalente abaixo)
+_COLUNAS = {
+    "id": "q",
+    "ativo": "B",
+    "categoria": "i",
+    "fornecedor_id": "q",
+    "vende_varejo": "B",
+    "vende_atacado": "B",
+    "preco_varejo": "d",
+    "preco_atacado": "d",
+    "promocao_inicio": "i",
+    "promocao_fim": "i",
+}
+_DTYPES = {"q": "int64", "B": "uint8", "i": "int32", "d": "float64"}
+
+
+def _dia(valor, ausente: int) -> int:
+    if not valor:
+        return ausente
+    try:
+        return date.fromisoformat(str(valor)[:10]).toordinal()
+    except ValueError:
+        return ausente
+
+
+def _booleano(valor) -> int:
+    # Mesma comparacao do storage (campo == True/False): ausente, None ou outro valor nao casa.
+    if isinstance(valor, (bool, int, float)) and valor in (0, 1):
+        return int(valor)
+    return _SEM_VALOR
+
+
+def _preco(valor) -> float:
+    return math.nan if valor is None else float(valor)
+
+
+class CatalogoColunar:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._carregado = False
+        self._n = 0
+        self._colunas: dict = {}
+        self._linha_do_id: dict[int, int] = {}
+        self._categorias: dict[str, int] = {}
+        self._ordem_categoria = None
+        self._ids_crescentes = True
+        self._removidos = 0
+        self._sincronizado_em = ""
+        self._ultima_sync = 0.0
+
+    # ---------- Carga e escrita ----------
+    def _vazio(self, capacidade: int) -> None:
+        self._n = 0
+        self._linha_do_id = {}
+        self._categorias = {}
+        self._ordem_categoria = None
+        self._ids_crescentes = True
+        self._removidos = 0
+        if np is not None:
+            self._colunas = {nome: np.zeros(capacidade, dtype=_DTYPES[tipo]) for nome, tipo in _COLUNAS.items()}
+        else:
+            self._colunas = {nome: array(tipo) for nome, tipo in _COLUNAS.items()}
+
+    def _crescer(self, minimo: int) -> None:
+        capacidade = len(self._colunas["id"])
+        if minimo <= capacidade:
+            return
+        nova = max(minimo, capacidade * 2, 1024)
+        for nome, coluna in self._colunas.items():
+            maior = np.zeros(nova, dtype=coluna.dtype)
+            maior[: self._n] = coluna[: self._n]
+            self._colunas[nome] = maior
+
+    def _codigo_categoria(self, categoria) -> int:
+        if categoria is None:
+            return _SEM_CATEGORIA
+        codigo = self._categorias.get(categoria)
+        if codigo is None:
+            codigo = self._categorias[sys.intern(categoria)] = len(self._categorias)
+            self._ordem_categoria = None
+        return codigo
+
+    def _valores(self, doc_id: int, doc: dict) -> dict:
+        fornecedor_id = doc.get("fornecedor_id")
+        return {
+            "id": doc_id,
+            "ativo": 1,
+            "categoria": self._codigo_categoria(doc.get("categoria")),
+            "fornecedor_id": _SEM_FORNECEDOR if fornecedor_id is None else int(fornecedor_id),
+            "vende_varejo": _booleano(doc.get("vende_varejo")),
+            "vende_atacado": _booleano(doc.get("vende_atacado")),
+            "preco_varejo": _preco(doc.get("preco_varejo")),
+            "preco_atacado": _preco(doc.get("preco_atacado")),
+            "promocao_inicio": _dia(doc.get("promocao_data_inicio"), _SEM_INICIO),
+            "promocao_fim": _dia(doc.get("promocao_data_fim"), _SEM_FIM),
+        }
+
+    def _gravar(self, doc_id: int, doc: dict) -> None:
+        valores = self._valores(doc_id, doc)
+        linha = self._linha_do_id.get(doc_id)
+        if linha is not None:
+            for nome, valor in valores.items():
+                self._colunas[nome][linha] = valor
+            return
+        if self._n and doc_id < self._colunas["id"][self._n - 1]:
+            self._ids_crescentes = False
+        if np is not None:
+            self._crescer(self._n + 1)
+            for nome, valor in valores.items():
+                self._colunas[nome][self._n] = valor
+        else:
+            for nome, valor in valores.items():
+                self._colunas[nome].append(valor)
+        self._linha_do_id[doc_id] = self._n
+        self._n += 1
+
+    def carregar(self, storage) -> None:
+        """Le a tabela produtos inteira para as colunas (primeira consulta ou recarga)."""
+        with self._lock:
+            self._vazio(0)
+            inicio_carga = _agora_iso()
+            # Junta cada coluna em uma lista e converte de uma vez (mais rapido que linha a linha).
+            listas = {nome: [] for nome in _COLUNAS}
+            for doc in storage.iter_select("produtos", batch_size=5000):
+                for nome, valor in self._valores(doc.doc_id, doc).items():
+                    listas[nome].append(valor)
+            ids = listas["id"]
+            self._ids_crescentes = all(anterior < atual for anterior, atual in zip(ids, ids[1:]))
+            self._linha_do_id = {doc_id: linha for linha, doc_id in enumerate(ids)}
+            self._n = len(ids)
+            for nome, tipo in _COLUNAS.items():
+                if np is not None:
+                    self._colunas[nome] = np.asarray(listas[nome], dtype=_DTYPES[tipo])
+                else:
+                    self._colunas[nome] = array(tipo, listas[nome])
+            self._sincronizado_em = inicio_carga
+            self._ultima_sync = time.monotonic()
+            self._carregado = True
+
+    def gravar(self, docs: list) -> None:
+        """Insere ou atualiza produtos (documentos com doc_id)."""
+        with self._lock:
+            if not self._carregado:
+                return
+            for doc in docs:
+                self._gravar(doc.doc_id, doc)
+
+    def remover(self, ids: list[int]) -> None:
+        with self._lock:
+            if not self._carregado:
+                return
+            for doc_id in ids:
+                linha = self._linha_do_id.pop(doc_id, None)
+                if linha is not None:
+                    self._colunas["ativo"][linha] = 0
+                    self._removidos += 1
+            # Muitas linhas removidas: compacta as colunas.
+            if self._removidos > 1024 and self._removidos > self._n // 4:
+                self._compactar()
+
+    def _compactar(self) -> None:
+        ativos = [linha for linha in range(self._n) if self._colunas["ativo"][linha]]
+        if np is not None:
+            posicoes = np.asarray(ativos, dtype="int64")
+            self._colunas = {nome: coluna[posicoes].copy() for nome, coluna in self._colunas.items()}
+        else:
+            self._colunas = {
+                nome: array(_COLUNAS[nome], (coluna[linha] for linha in ativos))
+                for nome, coluna in self._colunas.items()
+            }
+        self._n = len(ativos)
+        self._linha_do_id = {int(self._colunas["id"][linha]): linha for linha in range(self._n)}
+        self._removidos = 0
+
+    def _sincronizar(self, storage) -> None:
+        # Com SQLite outros workers tambem gravam: traz o que mudou desde a ultima busca.
+        if settings.storage_backend != "sqlite":
+            return
+        if time.monotonic() - self._ultima_sync < settings.produtos_colunar_sync_segundos:
+            return
+        desde = self._sincronizado_em
+        self._sincronizado_em = _agora_iso()
+        self._ultima_sync = time.monotonic()
+        for doc in storage.iter_select("produtos", [("atualizado_em", ">=", desde)], batch_size=5000):
+            self._gravar(doc.doc_id, doc)
+
+    def preparar(self, storage) -> None:
+        with self._lock:
+            if not self._carregado:
+                self.carregar(storage)
+            else:
+                self._sincronizar(storage)
+
+    # ---------- Consulta ----------
+    def _chave_ordem(self, order_by: str):
+        if order_by == "categoria":
+            if self._ordem_categoria is None:
+                ordem = sorted(self._categorias, key=self._categorias.get)
+                posicoes = sorted(range(len(ordem)), key=lambda codigo: ordem[codigo])
+                rank = [0] * len(ordem)
+                for posicao, codigo in enumerate(posicoes):
+                    rank[codigo] = posicao
+                self._ordem_categoria = rank
+            return self._ordem_categoria
+        return None
+
+    def _valor_na_linha(self, order_by: str, linha: int):
+        """Valor de order_by como no documento (None = sem valor)."""
+        if order_by == "id":
+            return int(self._colunas["id"][linha])
+        if order_by == "categoria":
+            codigo = self._colunas["categoria"][linha]
+            if codigo == _SEM_CATEGORIA:
+                return None
+            return next(nome for nome, valor in self._categorias.items() if valor == codigo)
+        valor = float(self._colunas[order_by][linha])
+        return None if math.isnan(valor) else valor
+
+    def _chave_cursor(self, order_by: str, descending: bool, cursor: tuple) -> tuple:
+        """(nulo, valor, id) do cursor na mesma escala das chaves das linhas."""
+        valor, cursor_id = cursor
+        sinal = -1 if descending else 1
+        if valor is None:
+            return True, 0.0, sinal * cursor_id
+        if order_by == "categoria":
+            # Categoria que saiu do catalogo: fica entre as vizinhas na ordem alfabetica.
+            codigo = self._categorias.get(valor)
+            if codigo is not None:
+                valor = self._chave_ordem("categoria")[codigo]
+            else:
+                valor = bisect_left(sorted(self._categorias), valor) - 0.5
+        return False, sinal * float(valor), sinal * cursor_id
+
+    def filtrar(
+        self,
+        storage,
+        limit: int | None = None,
+        after_id: int | None = None,
+        categoria: str | None = None,
+        fornecedor_id: int | None = None,
+        vende_varejo: bool | None = None,
+        vende_atacado: bool | None = None,
+        preco_min: float | None = None,
+        preco_max: float | None = None,
+        tipo_preco: str = "varejo",
+        promocao_ativa: bool = False,
+        order_by: str = "id",
+        descending: bool = False,
+        cursor: tuple | None = None,
+    ) -> list[int]:
+        """
+        Ids da pagina, com a mesma semantica de database.list_produtos no storage.
+
+        cursor = (valor de order_by, id) do ultimo produto da pagina anterior;
+        o produto nao precisa mais existir.
+        """
+        with self._lock:
+            self.preparar(storage)
+            codigo = None
+            if categoria is not None:
+                codigo = self._categorias.get(categoria)
+                if codigo is None:
+                    return []
+            if cursor is None and after_id is not None:
+                if order_by == "id":
+                    cursor = (after_id, after_id)
+                else:
+                    linha = self._linha_do_id.get(after_id)
+                    if linha is None:
+                        raise ValueError("Cursor after_id nao encontrado.")
+                    cursor = (self._valor_na_linha(order_by, linha), after_id)
+            after = None if cursor is None else self._chave_cursor(order_by, descending, cursor)
+            hoje = datetime.now(timezone.utc).date().toordinal() if promocao_ativa else None
+            filtro = (codigo, fornecedor_id, vende_varejo, vende_atacado, preco_min, preco_max, tipo_preco, hoje)
+            if np is not None:
+                return self._filtrar_numpy(filtro, after, limit, order_by, descending)
+            return self._filtrar_python(filtro, after, limit, order_by, descending)
+
+    def _filtrar_numpy(self, filtro, after, limit, order_by, descending) -> list[int]:
+        codigo, fornecedor_id, varejo, atacado, preco_min, preco_max, tipo_preco, hoje = filtro
+        n = self._n
+        c = {nome: coluna[:n] for nome, coluna in self._colunas.items()}
+        mask = c["ativo"] == 1
+        if codigo is not None:
+            mask &= c["categoria"] == codigo
+        if fornecedor_id is not None:
+            mask &= c["fornecedor_id"] == fornecedor_id
+        if varejo is not None:
+            mask &= c["vende_varejo"] == int(varejo)
+        if atacado is not None:
+            mask &= c["vende_atacado"] == int(atacado)
+        preco = c[f"preco_{tipo_preco}"]
+        # Comparacoes com NaN sao falsas: produto sem preco nao passa no filtro, como no storage.
+        if preco_min is not None:
+            mask &= preco >= preco_min
+        if preco_max is not None:
+            mask &= preco <= preco_max
+        if hoje is not None:
+            mask &= (c["promocao_inicio"] <= hoje) & (c["promocao_fim"] >= hoje)
+
+        ids = c["id"]
+        if order_by == "id" and not descending and self._ids_crescentes:
+            # As linhas ja estao na ordem de id: basta cortar depois do cursor.
+            if after is not None:
+                mask &= ids > after[2]
+            linhas = np.flatnonzero(mask)
+            return ids[linhas[:limit] if limit is not None else linhas].tolist()
+
+        def chaves(linhas):
+            # (nulos, valor, id) de cada linha, ja com o sinal da direcao da ordenacao.
+            linha_ids = ids[linhas]
+            if order_by == "id":
+                nulos = np.zeros(len(linha_ids), dtype=bool)
+                valores = linha_ids.astype("float64")
+            elif order_by == "categoria":
+                rank = np.asarray(self._chave_ordem("categoria") or [0], dtype="float64")
+                codigos = c["categoria"][linhas]
+                nulos = codigos == _SEM_CATEGORIA
+                valores = np.where(nulos, 0.0, rank[np.where(nulos, 0, codigos)])
+            else:
+                brutos = c[order_by][linhas]
+                nulos = np.isnan(brutos)
+                valores = np.where(nulos, 0.0, brutos)
+            if descending:
+                return nulos, -valores, -linha_ids
+            return nulos, valores, linha_ids
+
+        # Chaves calculadas so para as linhas que passaram nos filtros.
+        linhas = np.flatnonzero(mask)
+        # Sem linhas filtradas, a fatia e uma view: evita copiar as colunas inteiras.
+        nulos, valores, chave_id = chaves(slice(0, n) if len(linhas) == n else linhas)
+        if after is not None:
+            # Depois do cursor na ordem (nulos no fim, desempate por id), como o SQLite.
+            a_nulo, a_valor, a_id = after
+            if a_nulo:
+                depois = nulos & (chave_id > a_id)
+            else:
+                depois = nulos | (valores > a_valor) | ((valores == a_valor) & (chave_id > a_id))
+            linhas, nulos, valores, chave_id = linhas[depois], nulos[depois], valores[depois], chave_id[depois]
+        if limit is not None and len(linhas) > limit:
+            # So os limit primeiros (e os empatados com o ultimo) vao para a ordenacao completa.
+            chave = np.where(nulos, np.inf, valores)
+            manter = chave <= np.partition(chave, limit - 1)[limit - 1]
+            linhas, nulos, valores, chave_id = linhas[manter], nulos[manter], valores[manter], chave_id[manter]
+        escolhidas = linhas[np.lexsort((chave_id, valores, nulos))]
+        if limit is not None:
+            escolhidas = escolhidas[:limit]
+        return ids[escolhidas].tolist()
+
+    def _filtrar_python(self, filtro, after, limit, order_by, descending) -> list[int]:
+        codigo, fornecedor_id, varejo, atacado, preco_min, preco_max, tipo_preco, hoje = filtro
+        c = self._colunas
+        preco = c[f"preco_{tipo_preco}"]
+        linhas = [
+            linha
+            for linha in range(self._n)
+            if c["ativo"][linha]
+            and (codigo is None or c["categoria"][linha] == codigo)
+            and (fornecedor_id is None or c["fornecedor_id"][linha] == fornecedor_id)
+            and (varejo is None or c["vende_varejo"][linha] == varejo)
+            and (atacado is None or c["vende_atacado"][linha] == atacado)
+            and (preco_min is None or preco[linha] >= preco_min)
+            and (preco_max is None or preco[linha] <= preco_max)
+            and (hoje is None or c["promocao_inicio"][linha] <= hoje <= c["promocao_fim"][linha])
+        ]
+
+        ids = c["id"]
+        rank = self._chave_ordem("categoria") if order_by == "categoria" else None
+        sinal = -1 if descending else 1
+
+        def chave(linha):
+            if order_by == "id":
+                return (False, sinal * ids[linha], sinal * ids[linha])
+            if order_by == "categoria":
+                codigo_linha = c["categoria"][linha]
+                if codigo_linha == _SEM_CATEGORIA:
+                    return (True, 0, sinal * ids[linha])
+                return (False, sinal * rank[codigo_linha], sinal * ids[linha])
+            valor = c[order_by][linha]
+            if math.isnan(valor):
+                return (True, 0, sinal * ids[linha])
+            return (False, sinal * valor, sinal * ids[linha])
+
+        if after is not None:
+            linhas = [linha for linha in linhas if chave(linha) > after]
+        linhas.sort(key=chave)
+        if limit is not None:
+            linhas = linhas[:limit]
+        return [ids[linha] for linha in linhas]
+
+
+def _agora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+catalogo = CatalogoColunar()
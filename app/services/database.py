@@ -1,171 +1,680 @@
 """
-Camada de acesso ao TinyDB.
+Camada de acesso aos dados.
 
 Centraliza operacoes de leitura/escrita para usuarios, restaurantes,
-fornecedores, produtos, pedidos e metodos de pagamento.
+fornecedores, produtos, pedidos e metodos de pagamento. O armazenamento
+fisico (TinyDB ou SQLite) e escolhido por settings.storage_backend.
 """
 
-import os
+import time
+from datetime import date, datetime, timezone
 
-from tinydb import Query, TinyDB
+from tinydb.table import Document
 
 from app.config import settings
-
-# Garante que a pasta do arquivo JSON exista antes de abrir o banco.
-os.makedirs(os.path.dirname(settings.database_path), exist_ok=True)
-db = TinyDB(settings.database_path)
-
-# "Tabelas" logicas dentro do arquivo JSON do TinyDB.
-restaurantes_table = db.table("restaurantes")
-fornecedores_table = db.table("fornecedores")
-produtos_table = db.table("produtos")
-pedidos_table = db.table("pedidos")
-metodos_pagamento_table = db.table("metodos_pagamento")
+from app.services import agregados, cache, metricas, perfilador, rastreamento
+from app.services.busca_produtos import indice as indice_busca
+from app.services.cache import invalidate_produtos, invalidate_usuario
+from app.services.catalogo_colunar import ORDENACOES as ORDENACOES_COLUNARES, catalogo
+from app.services.storage import DuplicateKeyError, LazyStorage, set_rastreador
+
+# Backend unico usado por todas as funcoes abaixo (aberto no primeiro uso).
+storage = LazyStorage(settings)
+if settings.query_trace_enabled:
+    # Tabela, predicado, documentos examinados x devolvidos e tempo de cada consulta.
+    set_rastreador(rastreamento.registrar)
+if settings.profiling_enabled:
+    # Conta operacoes e bytes do storage nas requisicoes perfiladas.
+    storage = perfilador.StoragePerfilado(storage)
+
+# Nomes das "tabelas" logicas.
+USERS = "users"
+RESTAURANTES = "restaurantes"
+FORNECEDORES = "fornecedores"
+PRODUTOS = "produtos"
+PEDIDOS = "pedidos"
+METODOS_PAGAMENTO = "metodos_pagamento"
+TOKENS_REVOGADOS = "tokens_revogados"
+STRIPE_EVENTOS = "stripe_eventos"
+VENDAS = "vendas"
+VENDAS_RESUMO = agregados.VENDAS_RESUMO
 
 
 # ---------- Usuarios gerais ----------
 def find_user_by_email(email: str):
-    query = Query()
-    return users_table.get(query.email == email.lower().strip())
+    return storage.find_one(USERS, "email", email.lower().strip())
 
 
 def find_user_reset_token(token: str):
-    query = Query()
-    return users_table.get(query.reset_token == token)
+    return storage.find_one(USERS, "reset_token", token)
 
 
 def insert_user(user_data: dict):
-    return users_table.insert(user_data)
+    return storage.insert(USERS, user_data)
 
 
 def update_user(email: str, updates: dict):
-    query = Query()
-    users_table.update(updates, query.email == email.lower().strip())
+    storage.update_where(USERS, "email", email.lower().strip(), updates)
 
 
 # ---------- Restaurantes ----------
 def find_restaurante_by_email(email: str):
-    query = Query()
-    return restaurantes_table.get(query.email == email.lower().strip())
+    return storage.find_one(RESTAURANTES, "email", email.lower().strip())
 
 
 def insert_restaurante(data: dict):
-    return restaurantes_table.insert(data)
+    doc_id = storage.insert(RESTAURANTES, data)
+    invalidate_usuario(RESTAURANTES, data["email"])
+    return doc_id
 
 
 def update_restaurante(email: str, updates: dict):
-    query = Query()
-    restaurantes_table.update(updates, query.email == email.lower().strip())
+    storage.update_where(RESTAURANTES, "email", email.lower().strip(), updates)
+    invalidate_usuario(RESTAURANTES, email)
 
 
 def delete_restaurante(email: str):
-    query = Query()
-    restaurantes_table.remove(query.email == email.lower().strip())
+    storage.remove_where(RESTAURANTES, "email", email.lower().strip())
+    invalidate_usuario(RESTAURANTES, email)
 
 
 def find_restaurante_reset_token(token: str):
-    query = Query()
-    return restaurantes_table.get(query.reset_token == token)
+    return storage.find_one(RESTAURANTES, "reset_token", token)
 
 
 # ---------- Fornecedores ----------
 def find_fornecedor_by_email(email: str):
-    query = Query()
-    return fornecedores_table.get(query.email == email.lower().strip())
+    return storage.find_one(FORNECEDORES, "email", email.lower().strip())
 
 
 def insert_fornecedor(data: dict):
-    return fornecedores_table.insert(data)
+    doc_id = storage.insert(FORNECEDORES, data)
+    invalidate_usuario(FORNECEDORES, data["email"])
+    return doc_id
 
 
 def update_fornecedor(email: str, updates: dict):
-    query = Query()
-    fornecedores_table.update(updates, query.email == email.lower().strip())
+    storage.update_where(FORNECEDORES, "email", email.lower().strip(), updates)
+    invalidate_usuario(FORNECEDORES, email)
 
 
 def delete_fornecedor(email: str):
-    query = Query()
-    fornecedores_table.remove(query.email == email.lower().strip())
+    storage.remove_where(FORNECEDORES, "email", email.lower().strip())
+    invalidate_usuario(FORNECEDORES, email)
 
 
 def find_fornecedor_reset_token(token: str):
-    query = Query()
-    return fornecedores_table.get(query.reset_token == token)
+    return storage.find_one(FORNECEDORES, "reset_token", token)
+
+
+# ---------- Estado dos usuarios autenticados ----------
+def get_usuario_estado_em_cache(table: str, email: str) -> dict | None:
+    return cache.usuarios_cache.get(cache.usuario_cache_key(table, email))
+
+
+def get_usuario_estado(table: str, email: str) -> dict:
+    """Existencia e flag ativo do usuario, com cache invalidado por insert/update/delete."""
+    key = cache.usuario_cache_key(table, email)
+    estado = cache.usuarios_cache.get(key)
+    if estado is None:
+        user = storage.find_one(table, "email", email.lower().strip())
+        estado = {
+            "existe": user is not None,
+            "ativo": bool(user and user.get("ativo", True)),
+            # Refresh tokens emitidos antes disso (ex.: troca de senha) nao valem mais.
+            "tokens_revogados_em": (user or {}).get("tokens_revogados_em"),
+        }
+        cache.usuarios_cache.set(key, estado)
+    return estado
+
+
+# ---------- Refresh tokens revogados ----------
+# Guarda so o jti e o exp de cada token revogado; depois do exp a linha e descartada.
+_ultima_limpeza_tokens = 0.0
+
+
+def revoke_refresh_token(jti: str, exp: int) -> None:
+    """Revoga o jti; levanta DuplicateKeyError se ele ja estava revogado."""
+    storage.insert(TOKENS_REVOGADOS, {"jti": jti, "exp": int(exp)})
+    purge_tokens_revogados()
+
+
+def purge_tokens_revogados(intervalo: float = 3600) -> int:
+    """Remove revogacoes de tokens ja expirados (no maximo uma vez por intervalo)."""
+    global _ultima_limpeza_tokens
+    agora = time.time()
+    if agora - _ultima_limpeza_tokens < intervalo:
+        return 0
+    _ultima_limpeza_tokens = agora
+    expirados = [doc.doc_id for doc in storage.select(TOKENS_REVOGADOS, [("exp", "<=", int(agora))])]
+    if expirados:
+        storage.remove(TOKENS_REVOGADOS, expirados)
+    return len(expirados)
 
 
 # ---------- Produtos ----------
-def insert_produto(data: dict):
-    return produtos_table.insert(data)
+def _agora_iso() -> str:
+    # Formato fixo em UTC para que a comparacao como texto siga a ordem no tempo.
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+# Todo texto ISO e >= "". O filtro sempre presente na data deixa o backend
+# paginar pelo indice (campo, data) em vez de ordenar as linhas em memoria.
+_SEM_LIMITE_INFERIOR = ""
 
 
-def list_produtos():
+def _data_iso(valor: datetime) -> str:
+    if valor.tzinfo is None:
+        valor = valor.replace(tzinfo=timezone.utc)
+    return valor.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def insert_produto(data: dict):
+    data["atualizado_em"] = _agora_iso()
+    doc_id = storage.insert(PRODUTOS, data)
+    catalogo.gravar([Document(data, doc_id=doc_id)])
+    indice_busca.gravar([Document(data, doc_id=doc_id)])
+    invalidate_produtos()
+    return doc_id
+
+
+def insert_produtos(items: list[dict]) -> list[int]:
+    """Insere varios produtos com uma unica escrita no armazenamento."""
+    agora = _agora_iso()
+    for data in items:
+        data["atualizado_em"] = agora
+    ids = storage.insert_multiple(PRODUTOS, items)
+    docs = [Document(data, doc_id=doc_id) for data, doc_id in zip(items, ids)]
+    catalogo.gravar(docs)
+    indice_busca.gravar(docs)
+    invalidate_produtos()
+    return ids
+
+
+# Campos aceitos para ordenar a listagem de produtos.
+PRODUTO_ORDER_FIELDS = ("id", "nome_produto", "categoria", "preco_varejo", "preco_atacado")
+
+
+def list_produtos(
+    limit: int | None = None,
+    after_id: int | None = None,
+    categoria: str | None = None,
+    fornecedor_id: int | None = None,
+    vende_varejo: bool | None = None,
+    vende_atacado: bool | None = None,
+    preco_min: float | None = None,
+    preco_max: float | None = None,
+    tipo_preco: str = "varejo",
+    promocao_ativa: bool = False,
+    order_by: str = "id",
+    descending: bool = False,
+    cursor: tuple | None = None,
+):
+    """
+    Lista produtos com filtros, ordenacao e paginacao por cursor.
+
+    Os filtros sao executados pelo backend de armazenamento (ou pelo catalogo
+    colunar, com PRODUTOS_STORE=colunar). after_id e o id do ultimo produto
+    da pagina anterior; a posicao dele na ordenacao escolhida define onde a
+    proxima pagina comeca. cursor = (valor de order_by, id) do ultimo produto
+    substitui after_id sem reler o produto, entao a paginacao continua mesmo
+    se ele tiver sido removido. promocao_ativa deixa so os produtos com a data de
+    hoje (UTC) dentro do periodo de promocao.
+    """
+    if order_by not in PRODUTO_ORDER_FIELDS:
+        raise ValueError(f"Campo de ordenacao invalido: {order_by}")
+
+    if settings.produtos_store == "colunar" and order_by in ORDENACOES_COLUNARES:
+        while True:
+            ids = catalogo.filtrar(
+                storage,
+                limit=limit,
+                after_id=after_id,
+                categoria=categoria,
+                fornecedor_id=fornecedor_id,
+                vende_varejo=vende_varejo,
+                vende_atacado=vende_atacado,
+                preco_min=preco_min,
+                preco_max=preco_max,
+                tipo_preco=tipo_preco,
+                promocao_ativa=promocao_ativa,
+                order_by=order_by,
+                descending=descending,
+                cursor=cursor,
+            )
+            encontrados = get_produtos_por_id(ids)
+            removidos = [id for id in ids if id not in encontrados]
+            if not removidos:
+                return [encontrados[id] for id in ids]
+            # Removido por outro worker: sai das colunas e a pagina e montada de novo,
+            # para nao voltar incompleta (o cliente pararia de paginar).
+            catalogo.remover(removidos)
+
+    filters = []
+    if categoria is not None:
+        filters.append(("categoria", "==", categoria))
+    if fornecedor_id is not None:
+        filters.append(("fornecedor_id", "==", fornecedor_id))
+    if vende_varejo is not None:
+        filters.append(("vende_varejo", "==", vende_varejo))
+    if vende_atacado is not None:
+        filters.append(("vende_atacado", "==", vende_atacado))
+    preco_field = f"preco_{tipo_preco}"
+    if preco_min is not None:
+        filters.append((preco_field, ">=", preco_min))
+    if preco_max is not None:
+        filters.append((preco_field, "<=", preco_max))
+    if promocao_ativa:
+        hoje = datetime.now(timezone.utc).date().isoformat()
+        filters.append(("promocao_data_inicio", "<=", hoje))
+        filters.append(("promocao_data_fim", ">=", hoje))
+
+    after = cursor
+    if after is None and after_id is not None:
+        if order_by == "id":
+            after = (after_id, after_id)
+        else:
+            cursor = storage.get(PRODUTOS, after_id)
+            if cursor is None:
+                raise ValueError("Cursor after_id nao encontrado.")
+            after = (cursor.get(order_by), after_id)
+
     # Injeta doc_id como "id" para retorno consistente na API.
-    items = []
-    for item in produtos_table.all():
+    items = storage.select(PRODUTOS, filters, order_by=order_by, descending=descending, after=after, limit=limit)
+    for item in items:
         item["id"] = item.doc_id
-        items.append(item)
     return items
 
 
+def carregar_catalogo() -> None:
+    """
+    Monta o indice de busca e o catalogo colunar (PRODUTOS_STORE=colunar) na
+    subida da API, nao na primeira consulta.
+    """
+    indice_busca.preparar(storage)
+    if settings.produtos_store == "colunar":
+        catalogo.preparar(storage)
+
+
+def buscar_produtos(q: str, limit: int = 20) -> list[dict]:
+    """Produtos cujo nome/categoria casam com q, do mais relevante para o menos."""
+    ids = indice_busca.buscar(storage, q, limit=limit)
+    encontrados = get_produtos_por_id(ids)
+    # Removido por outro worker: sai do indice e do resultado.
+    indice_busca.remover([id for id in ids if id not in encontrados])
+    return [encontrados[id] for id in ids if id in encontrados]
+
+
 def get_produto(id: int):
-    item = produtos_table.get(doc_id=id)
+    item = storage.get(PRODUTOS, id)
     if item:
         item["id"] = item.doc_id
     return item
 
 
+def get_produtos_por_id(ids: list[int]) -> dict[int, dict]:
+    """Produtos existentes entre ids, em uma unica ida ao executor."""
+    encontrados = {}
+    for id in set(ids):
+        item = storage.get(PRODUTOS, id)
+        if item:
+            item["id"] = item.doc_id
+            encontrados[id] = item
+    return encontrados
+
+
 def update_produto(id: int, data: dict):
-    produtos_table.update(data, doc_ids=[id])
+    data["atualizado_em"] = _agora_iso()
+    storage.update(PRODUTOS, [id], data)
+    docs = [doc for doc in [storage.get(PRODUTOS, id)] if doc is not None]
+    catalogo.gravar(docs)
+    indice_busca.gravar(docs)
+    invalidate_produtos([id])
+
+
+def iter_produtos(updated_since: datetime | None = None):
+    """Gera todos os produtos em ordem de id, sem carregar o catalogo inteiro."""
+    filters = []
+    if updated_since is not None:
+        if updated_since.tzinfo is None:
+            updated_since = updated_since.replace(tzinfo=timezone.utc)
+        since = updated_since.astimezone(timezone.utc).isoformat(timespec="microseconds")
+        filters.append(("atualizado_em", ">=", since))
+    for item in storage.iter_select(PRODUTOS, filters):
+        item["id"] = item.doc_id
+        yield item
 
 
 def delete_produto(id: int):
-    produtos_table.remove(doc_ids=[id])
+    storage.remove(PRODUTOS, [id])
+    catalogo.remover([id])
+    indice_busca.remover([id])
+    invalidate_produtos([id])
 
 
 # ---------- Pedidos ----------
 def insert_pedido(data: dict):
-    return pedidos_table.insert(data)
+    data.setdefault("criado_em", _agora_iso())
+    if data.get("email"):
+        data["email"] = data["email"].lower().strip()
+    return storage.insert(PEDIDOS, data)
+
+
+def update_pedido(id: int, updates: dict):
+    storage.update(PEDIDOS, [id], updates)
 
 
 def update_pedido_status(session_id: str, status: str):
-    query = Query()
-    pedidos_table.update({"status": status}, query.session_id == session_id)
+    pedido = storage.find_one(PEDIDOS, "session_id", session_id)
+    if pedido is None:
+        return
+    storage.update(PEDIDOS, [pedido.doc_id], {"status": status})
+    if status == "pago" and pedido.get("status") != "pago":
+        registrar_vendas([pedido.doc_id])
 
 
 def get_pedido_by_session(session_id: str):
-    query = Query()
-    return pedidos_table.get(query.session_id == session_id)
+    return storage.find_one(PEDIDOS, "session_id", session_id)
+
+
+def list_pedidos_pendentes(criados_antes: datetime) -> list:
+    """Pedidos ainda pendentes criados ate criados_antes (pedidos sem criado_em ficam de fora)."""
+    limite = _data_iso(criados_antes)
+    return list(storage.iter_select(PEDIDOS, [("status", "==", "pendente"), ("criado_em", "<=", limite)]))
+
+
+def transicionar_pedidos(ids: list[int], status: str) -> list[int]:
+    """Muda para status os pedidos de ids que ainda estao pendentes; devolve os alterados."""
+    alterados = [id for id in ids if (storage.get(PEDIDOS, id) or {}).get("status") == "pendente"]
+    storage.update(PEDIDOS, alterados, {"status": status})
+    if status == "pago":
+        registrar_vendas(alterados)
+    return alterados
+
+
+def list_pedidos_by_email(
+    email: str,
+    limit: int | None = None,
+    after_id: int | None = None,
+    data_inicio: datetime | None = None,
+    data_fim: datetime | None = None,
+    status: str | None = None,
+):
+    """
+    Pedidos do cliente, do mais recente para o mais antigo (historico de compras).
+
+    Usa o indice (email, criado_em): cada pagina le so as linhas dela,
+    qualquer que seja o tamanho do historico. after_id e o id do ultimo
+    pedido da pagina anterior. Pedidos sem criado_em (anteriores ao campo)
+    ficam de fora.
+    """
+    filters = [
+        ("email", "==", email.lower().strip()),
+        ("criado_em", ">=", _data_iso(data_inicio) if data_inicio is not None else _SEM_LIMITE_INFERIOR),
+    ]
+    if data_fim is not None:
+        filters.append(("criado_em", "<=", _data_iso(data_fim)))
+    if status is not None:
+        filters.append(("status", "==", status))
+
+    after = None
+    if after_id is not None:
+        cursor = storage.get(PEDIDOS, after_id)
+        if cursor is None or cursor.get("email", "").lower().strip() != email.lower().strip():
+            raise ValueError("Cursor after_id nao encontrado.")
+        after = (cursor.get("criado_em"), after_id)
+
+    items = storage.select(PEDIDOS, filters, order_by="criado_em", descending=True, after=after, limit=limit)
+    for item in items:
+        item["id"] = item.doc_id
+    return items
+
+
+# ---------- Eventos de pagamento (webhooks da Stripe) ----------
+def _eventos_novos(eventos: list[dict]) -> list[dict]:
+    """Descarta eventos ja registrados e repeticoes dentro do proprio lote."""
+    novos, vistos = [], set()
+    for evento in eventos:
+        event_id = evento["event_id"]
+        if event_id in vistos or storage.find_one(STRIPE_EVENTOS, "event_id", event_id):
+            continue
+        vistos.add(event_id)
+        novos.append(evento)
+    return novos
+
+
+def _registrar_eventos(eventos: list[dict]) -> None:
+    registros = [{"event_id": e["event_id"], "tipo": e["tipo"], "recebido_em": int(time.time())} for e in eventos]
+    try:
+        storage.insert_multiple(STRIPE_EVENTOS, registros)
+    except DuplicateKeyError:
+        # Outro worker registrou algum deles ao mesmo tempo: grava um a um.
+        for registro in registros:
+            try:
+                storage.insert(STRIPE_EVENTOS, registro)
+            except DuplicateKeyError:
+                pass
+
+
+def aplicar_eventos_pagamento(eventos: list[dict]) -> dict[str, str]:
+    """
+    Aplica um lote de eventos {event_id, tipo, session_id, pedido_id, status}.
+
+    Os pedidos sao localizados pelo session_id (indexado), com pedido_id
+    como alternativa, e so mudam de status enquanto estao "pendente". As
+    mudancas sao agrupadas por status: uma escrita por status novo, qualquer
+    que seja o tamanho do lote. Os event_id so sao registrados depois das
+    mudancas; como elas partem sempre de "pendente", reaplicar um evento
+    (queda no meio do lote, dois workers) nao altera o resultado.
+    Devolve event_id -> "aplicado", "duplicado" ou "ignorado".
+    """
+    resultado = {evento["event_id"]: "duplicado" for evento in eventos}
+    novos = _eventos_novos(eventos)
+    por_status: dict[str, list[int]] = {}
+    alterados: set[int] = set()
+    for evento in novos:
+        resultado[evento["event_id"]] = "ignorado"
+        if not evento.get("status"):
+            continue
+        pedido = None
+        if evento.get("session_id"):
+            pedido = storage.find_one(PEDIDOS, "session_id", evento["session_id"])
+        if pedido is None and evento.get("pedido_id"):
+            pedido = storage.get(PEDIDOS, int(evento["pedido_id"]))
+        # Como na aplicacao um a um: depois da primeira mudanca o pedido deixa de estar pendente.
+        if pedido is None or pedido.get("status") != "pendente" or pedido.doc_id in alterados:
+            continue
+        alterados.add(pedido.doc_id)
+        por_status.setdefault(evento["status"], []).append(pedido.doc_id)
+        resultado[evento["event_id"]] = "aplicado"
+    for novo_status, ids in por_status.items():
+        storage.update(PEDIDOS, ids, {"status": novo_status})
+    registrar_vendas(por_status.get("pago", []))
+    if novos:
+        _registrar_eventos(novos)
+    return resultado
 
 
 # ---------- Metodos de pagamento (fornecedor) ----------
 def insert_metodo_pagamento(data: dict):
-    return metodos_pagamento_table.insert(data)
+    return storage.insert(METODOS_PAGAMENTO, data)
 
 
 def list_metodos_pagamento_by_email(email: str):
-    query = Query()
-    items = metodos_pagamento_table.search(query.fornecedor_email == email.lower().strip())
+    items = storage.search(METODOS_PAGAMENTO, "fornecedor_email", email.lower().strip())
     for item in items:
         item["id"] = item.doc_id
     return items
 
 
 def get_metodo_pagamento(id: int):
-    item = metodos_pagamento_table.get(doc_id=id)
+    item = storage.get(METODOS_PAGAMENTO, id)
     if item:
         item["id"] = item.doc_id
     return item
 
 
 def update_metodo_pagamento_db(id: int, data: dict):
-    metodos_pagamento_table.update(data, doc_ids=[id])
+    storage.update(METODOS_PAGAMENTO, [id], data)
 
 
 def delete_metodo_pagamento_db(id: int):
-    metodos_pagamento_table.remove(doc_ids=[id])
+    storage.remove(METODOS_PAGAMENTO, [id])
 
 
 # ---------- Historico de vendas ----------
-def list_vendas_by_fornecedor(email: str):
-    # Ainda depende do vinculo direto de pedidos ao fornecedor.
-    return []
+# Cada item pago com produto vinculado vira uma linha em "vendas", indexada por
+# (fornecedor_id, data_venda). O historico le so as linhas do fornecedor, sem
+# percorrer os pedidos.
+def registrar_vendas(pedido_ids: list[int]) -> int:
+    """
+    Grava as linhas de venda dos pedidos pagos (chamada na confirmacao do pagamento).
+
+    linha_id = "<pedido>:<posicao do item>" e unico: registrar o mesmo pedido
+    de novo (reconciliacao e webhook ao mesmo tempo) nao duplica linhas.
+    """
+    data_venda = _agora_iso()
+    linhas = []
+    for pedido_id in pedido_ids:
+        pedido = storage.get(PEDIDOS, pedido_id)
+        for posicao, item in enumerate((pedido or {}).get("itens", [])):
+            if item.get("fornecedor_id") is None or item.get("produto_id") is None:
+                continue
+            linhas.append(
+                {
+                    "linha_id": f"{pedido_id}:{posicao}",
+                    "pedido_id": pedido_id,
+                    "fornecedor_id": item["fornecedor_id"],
+                    "produto_id": item["produto_id"],
+                    "nome_produto": item.get("nome"),
+                    "quantidade": item["quantidade"],
+                    "preco_unitario": item["preco_unitario"],
+                    "valor_total": round(item["preco_unitario"] * item["quantidade"], 2),
+                    "data_venda": data_venda,
+                }
+            )
+    if not linhas:
+        return 0
+    # Linhas e resumos na mesma transacao: agregados.reconstruir ve as duas coisas ou nenhuma.
+    with storage.transaction():
+        try:
+            storage.insert_multiple(VENDAS, linhas)
+            gravadas = linhas
+        except DuplicateKeyError:
+            gravadas = []
+            for linha in linhas:
+                try:
+                    storage.insert(VENDAS, linha)
+                    gravadas.append(linha)
+                except DuplicateKeyError:
+                    continue
+        # So as linhas realmente gravadas entram nos agregados (sem contar duas vezes).
+        storage.upsert_increment(
+            VENDAS_RESUMO, "chave", [resumo for linha in gravadas for resumo in agregados.resumos_da_linha(linha)]
+        )
+    return len(gravadas)
+
+
+def list_vendas_by_fornecedor(
+    email: str,
+    limit: int | None = None,
+    after_id: int | None = None,
+    data_inicio: datetime | None = None,
+    data_fim: datetime | None = None,
+):
+    """
+    Vendas do fornecedor, da mais recente para a mais antiga.
+
+    after_id e o id da ultima linha da pagina anterior; data_inicio/data_fim
+    limitam data_venda (inclusive). Datas sem fuso sao tratadas como UTC.
+    """
+    fornecedor = storage.find_one(FORNECEDORES, "email", email.lower().strip())
+    if fornecedor is None:
+        return []
+
+    filters = [
+        ("fornecedor_id", "==", fornecedor.doc_id),
+        ("data_venda", ">=", _data_iso(data_inicio) if data_inicio is not None else _SEM_LIMITE_INFERIOR),
+    ]
+    if data_fim is not None:
+        filters.append(("data_venda", "<=", _data_iso(data_fim)))
+
+    after = None
+    if after_id is not None:
+        cursor = storage.get(VENDAS, after_id)
+        if cursor is None or cursor.get("fornecedor_id") != fornecedor.doc_id:
+            raise ValueError("Cursor after_id nao encontrado.")
+        after = (cursor.get("data_venda"), after_id)
+
+    items = storage.select(VENDAS, filters, order_by="data_venda", descending=True, after=after, limit=limit)
+    for item in items:
+        item["id"] = item.doc_id
+    return items
+
+
+# ---------- Dashboard do fornecedor ----------
+def dashboard_fornecedor(email: str, data_inicio: date, data_fim: date, periodo: str = "dia", top: int = 10) -> dict:
+    """
+    Resumo de vendas do fornecedor lido de vendas_resumo.
+
+    por_periodo e por_produto cobrem [data_inicio, data_fim] (por semana, a
+    semana que contem data_inicio entra inteira); mais_vendidos considera todo
+    o historico.
+    """
+    fornecedor = storage.find_one(FORNECEDORES, "email", email.lower().strip())
+    resultado = {
+        "data_inicio": data_inicio,
+        "data_fim": data_fim,
+        "periodo": periodo,
+        "receita_total": 0.0,
+        "quantidade_total": 0,
+        "por_periodo": [],
+        "por_produto": [],
+        "mais_vendidos": [],
+    }
+    if fornecedor is None:
+        return resultado
+
+    filters = [
+        ("fornecedor_id", "==", fornecedor.doc_id),
+        ("periodo", "==", periodo),
+        ("inicio", ">=", agregados.inicio_periodo(periodo, data_inicio)),
+        ("inicio", "<=", data_fim.isoformat()),
+    ]
+    por_periodo: dict[str, dict] = {}
+    por_produto: dict[int, dict] = {}
+    for doc in storage.select(VENDAS_RESUMO, filters, order_by="inicio"):
+        linha = por_periodo.setdefault(doc["inicio"], {"inicio": doc["inicio"], "quantidade": 0, "receita": 0.0})
+        linha["quantidade"] += doc["quantidade"]
+        linha["receita"] += doc["receita"]
+        produto = por_produto.setdefault(
+            doc["produto_id"],
+            {"produto_id": doc["produto_id"], "nome_produto": doc.get("nome_produto"), "quantidade": 0, "receita": 0.0},
+        )
+        produto["quantidade"] += doc["quantidade"]
+        produto["receita"] += doc["receita"]
+
+    totais = storage.select(VENDAS_RESUMO, [("fornecedor_id", "==", fornecedor.doc_id), ("periodo", "==", "total")])
+    mais_vendidos = [
+        {
+            "produto_id": doc["produto_id"],
+            "nome_produto": doc.get("nome_produto"),
+            "quantidade": doc["quantidade"],
+            "receita": doc["receita"],
+        }
+        for doc in totais
+    ]
+
+    for linha in [*por_periodo.values(), *por_produto.values(), *mais_vendidos]:
+        linha["receita"] = round(linha["receita"], 2)
+    resultado["por_periodo"] = list(por_periodo.values())
+    resultado["por_produto"] = sorted(por_produto.values(), key=lambda p: (-p["receita"], p["produto_id"]))[:top]
+    resultado["mais_vendidos"] = sorted(mais_vendidos, key=lambda p: (-p["quantidade"], p["produto_id"]))[:top]
+    resultado["receita_total"] = round(sum(linha["receita"] for linha in resultado["por_periodo"]), 2)
+    resultado["quantidade_total"] = sum(linha["quantidade"] for linha in resultado["por_periodo"])
+    return resultado
+
+
+# Cada funcao publica acima passa a registrar duracao e erros (GET /metrics).
+# Fica no fim do modulo para que async_database ja receba as versoes medidas.
+metricas.instrumentar_modulo(globals(), "database")
@@ -0,0 +1,48 @@
+"""
+Envio de emails da API (recuperacao de senha).
+
+Usa smtplib com as configuracoes SMTP_*. Sem SMTP_HOST (desenvolvimento)
+o email nao sai: apenas o destinatario e o assunto vao para o log. As
+funcoes sao bloqueantes e rodam dentro das tarefas em segundo plano
+(app/services/tarefas.py), nunca no caminho da requisicao.
+"""
+
+import logging
+import smtplib
+from email.message import EmailMessage
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def enviar_email(destinatario: str, assunto: str, corpo: str) -> None:
+    if not settings.smtp_host:
+        logger.info("SMTP nao configurado; email '%s' para %s nao enviado.", assunto, destinatario)
+        return
+
+    msg = EmailMessage()
+    msg["From"] = settings.smtp_from
+    msg["To"] = destinatario
+    msg["Subject"] = assunto
+    msg.set_content(corpo)
+
+    with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout_seconds) as smtp:
+        if settings.smtp_starttls:
+            smtp.starttls()
+        if settings.smtp_user:
+            smtp.login(settings.smtp_user, settings.smtp_password)
+        smtp.send_message(msg)
+
+
+def enviar_email_reset(destinatario: str, token: str) -> None:
+    if settings.password_reset_url:
+        instrucao = f"Acesse o link para criar uma nova senha:\n{settings.password_reset_url.format(token=token)}"
+    else:
+        instrucao = f"Use este codigo para criar uma nova senha:\n{token}"
+    corpo = (
+        "Recebemos um pedido de recuperacao de senha.\n\n"
+        f"{instrucao}\n\n"
+        "Se voce nao fez este pedido, ignore este email."
+    )
+    enviar_email(destinatario, "Recuperacao de senha", corpo)
@@ -0,0 +1,88 @@
+"""
+Hash e verificacao de senha, sem nada alem do passlib.
+
+E o modulo que os processos do pool de hash (password_hashing) importam:
+nao abre o banco, nao sobe threads e nao passa pelas metricas (os wrappers
+de metricas.instrumentar_modulo usam locks que um filho poderia herdar
+travados). security.py usa as mesmas funcoes no processo da API.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from passlib.context import CryptContext
+from passlib.hash import argon2
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def build_pwd_context(config=settings) -> CryptContext:
+    """
+    Monta o CryptContext a partir das configuracoes.
+
+    O primeiro esquema e o padrao; os outros ficam como obsoletos. O custo
+    e fixado (min = max = padrao), entao needs_update acusa hashes gerados
+    com outro custo e o login os refaz, para mais ou para menos.
+    """
+    # PBKDF2-SHA256 e o padrao para evitar incompatibilidade do bcrypt em alguns ambientes (ex.: Python 3.13).
+    schemes = list(config.password_schemes) or ["pbkdf2_sha256"]
+    if "argon2" in schemes and not argon2.has_backend():
+        logger.warning("argon2 configurado, mas argon2-cffi nao esta instalado; esquema ignorado.")
+        schemes.remove("argon2")
+        schemes = schemes or ["pbkdf2_sha256"]
+
+    options = {}
+    if "pbkdf2_sha256" in schemes:
+        for key in ("default_rounds", "min_rounds", "max_rounds"):
+            options[f"pbkdf2_sha256__{key}"] = config.pbkdf2_rounds
+    if "argon2" in schemes:
+        options["argon2__type"] = "ID"
+        options["argon2__memory_cost"] = config.argon2_memory_cost
+        options["argon2__time_cost"] = config.argon2_time_cost
+        options["argon2__parallelism"] = config.argon2_parallelism
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
+pwd_context = build_pwd_context()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    except Exception:
+        # Em caso de hash invalido/corrompido, trata como credencial incorreta.
+        return False
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception:
+        return False, None
+
+
+def get_password_hash(password: str) -> str:
+    if len(password.encode("utf-8")) > 128:
+        raise ValueError("A senha excede o tamanho maximo permitido.")
+    return pwd_context.hash(password)
+
+
+def pronto() -> int:
+    """Chamada vazia usada para subir os processos do pool na inicializacao."""
+    return os.getpid()
+
+
+def vigiar_pai() -> None:
+    """Initializer do pool: encerra o filho se o processo que o criou morrer."""
+    pai = os.getppid()
+
+    def vigiar():
+        while os.getppid() == pai:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=vigiar, name="hash-parent-watch", daemon=True).start()
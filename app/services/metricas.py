@@ -0,0 +1,241 @@
+"""
+Metricas da API no formato texto do Prometheus (GET /metrics).
+
+Registra, por processo:
+- http_requests_total{method,route,status}: requisicoes respondidas
+- http_request_duration_seconds{method,route}: histograma de latencia
+- http_requests_in_progress{method}: requisicoes em andamento
+- app_function_duration_seconds{module,function}: histograma de cada funcao
+  instrumentada (database.py e hash/JWT de security.py)
+- app_function_errors_total{module,function}: chamadas que levantaram excecao
+- storage_*: consultas ao storage por tabela, operacao e predicado
+  (app/services/rastreamento.py)
+
+route e o caminho declarado na rota (/produtos/{id}), nao a URL: o numero
+de series fica limitado ao numero de rotas. O custo por chamada e duas
+leituras de perf_counter, um bisect e um lock curto; nao ha dependencia
+externa (prometheus_client).
+
+Com varios workers do uvicorn cada processo tem os proprios numeros e
+/metrics mostra os do worker que respondeu.
+"""
+
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+from app.config import settings
+
+# Limites superiores (segundos) dos buckets dos histogramas.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """Histograma com buckets fixos, uma serie por combinacao de labels."""
+
+    def __init__(self, nome: str, ajuda: str, labels: tuple[str, ...]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valores: tuple, duracao: float) -> None:
+        posicao = bisect_left(BUCKETS, duracao)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # [contagem por bucket..., +Inf, soma]
+                serie = self._series[valores] = [0] * (len(BUCKETS) + 1) + [0.0]
+            serie[posicao] += 1
+            serie[-1] += duracao
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            series = {valores: list(serie) for valores, serie in self._series.items()}
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for valores, serie in sorted(series.items()):
+            labels = _labels(self.labels, valores)
+            acumulado = 0
+            for limite, contagem in zip((*BUCKETS, "+Inf"), serie[:-1]):
+                acumulado += contagem
+                linhas.append(f'{self.nome}_bucket{{{labels},le="{limite}"}} {acumulado}')
+            linhas.append(f"{self.nome}_sum{{{labels}}} {serie[-1]}")
+            linhas.append(f"{self.nome}_count{{{labels}}} {acumulado}")
+        return linhas
+
+
+class Contador:
+    """Contador (ou gauge, com valores negativos) por combinacao de labels."""
+
+    def __init__(self, nome: str, ajuda: str, labels: tuple[str, ...], tipo: str = "counter"):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.tipo = tipo
+        self._series: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def somar(self, valores: tuple, valor: float = 1) -> None:
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + valor
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            series = dict(self._series)
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        for valores, valor in sorted(series.items()):
+            linhas.append(f"{self.nome}{{{_labels(self.labels, valores)}}} {valor}")
+        return linhas
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(nomes: tuple[str, ...], valores: tuple) -> str:
+    return ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores))
+
+
+requisicoes = Contador("http_requests_total", "Requisicoes HTTP respondidas.", ("method", "route", "status"))
+latencia = Histograma("http_request_duration_seconds", "Latencia das requisicoes HTTP.", ("method", "route"))
+em_andamento = Contador(
+    "http_requests_in_progress", "Requisicoes HTTP em andamento.", ("method",), tipo="gauge"
+)
+duracao_funcoes = Histograma(
+    "app_function_duration_seconds", "Duracao das funcoes instrumentadas.", ("module", "function")
+)
+erros_funcoes = Contador(
+    "app_function_errors_total", "Chamadas de funcoes instrumentadas que levantaram excecao.", ("module", "function")
+)
+
+consultas = Contador(
+    "storage_queries_total", "Consultas ao storage.", ("table", "operation", "predicate")
+)
+documentos_examinados = Contador(
+    "storage_documents_scanned_total",
+    "Documentos examinados pelas consultas ao storage (estimado no SQLite).",
+    ("table", "operation", "predicate"),
+)
+documentos_retornados = Contador(
+    "storage_documents_returned_total",
+    "Documentos devolvidos (ou alterados) pelas consultas ao storage.",
+    ("table", "operation", "predicate"),
+)
+duracao_consultas = Histograma(
+    "storage_query_duration_seconds", "Duracao das consultas ao storage.", ("table", "operation")
+)
+
+METRICAS = (
+    requisicoes,
+    latencia,
+    em_andamento,
+    duracao_funcoes,
+    erros_funcoes,
+    consultas,
+    documentos_examinados,
+    documentos_retornados,
+    duracao_consultas,
+)
+
+
+def exportar() -> str:
+    """Todas as metricas no formato texto do Prometheus."""
+    linhas = []
+    for metrica in METRICAS:
+        linhas.extend(metrica.exportar())
+    return "\n".join(linhas) + "\n"
+
+
+def medir(modulo: str, funcao: str, duracao: float, erro: bool = False) -> None:
+    duracao_funcoes.observar((modulo, funcao), duracao)
+    if erro:
+        erros_funcoes.somar((modulo, funcao))
+
+
+def instrumentar(func, modulo: str):
+    """Envolve func registrando duracao e erros (funcoes sincronas e async)."""
+    if not settings.metrics_enabled:
+        return func
+    nome = func.__name__
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def wrapper_async(*args, **kwargs):
+            inicio = time.perf_counter()
+            erro = True
+            try:
+                resultado = await func(*args, **kwargs)
+                erro = False
+                return resultado
+            finally:
+                medir(modulo, nome, time.perf_counter() - inicio, erro)
+
+        return wrapper_async
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            resultado = func(*args, **kwargs)
+            erro = False
+            return resultado
+        finally:
+            medir(modulo, nome, time.perf_counter() - inicio, erro)
+
+    return wrapper
+
+
+def instrumentar_modulo(namespace: dict, modulo: str, nomes=None) -> None:
+    """
+    Troca, no namespace do modulo, as funcoes publicas definidas nele pela versao medida.
+
+    Chamado no fim do modulo, antes de outros modulos importarem as funcoes.
+    Geradores ficam de fora: o tempo incluiria as pausas de quem consome.
+    """
+    for nome, func in list(namespace.items()):
+        if nomes is not None and nome not in nomes:
+            continue
+        if nome.startswith("_") or not inspect.isfunction(func):
+            continue
+        if func.__module__ != namespace["__name__"] or inspect.isgeneratorfunction(func):
+            continue
+        namespace[nome] = instrumentar(func, modulo)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia, status e requisicoes em andamento por rota."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_com_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        em_andamento.somar((method,))
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_com_status)
+        finally:
+            duracao = time.perf_counter() - inicio
+            em_andamento.somar((method,), -1)
+            # O roteador grava a rota encontrada no scope; sem rota (404) nao ha caminho declarado.
+            rota = scope.get("route")
+            route = getattr(rota, "path", None) or "<sem rota>"
+            latencia.observar((method, route), duracao)
+            requisicoes.somar((method, route, status_code))
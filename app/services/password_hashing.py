@@ -0,0 +1,182 @@
+"""
+Servico de hash de senha fora do processo da API.
+
+PBKDF2 e puro CPU e segura o GIL: rodando em threads, uma rajada de logins
+deixa o processo sem folga para as outras rotas. Aqui o hash e a
+verificacao vao para um pool de processos de tamanho fixo
+(settings.password_hash_workers) e a fila tem limite
+(settings.password_hash_max_pending). Com a fila cheia a requisicao e
+recusada na hora com 429, em vez de esperar e acumular latencia.
+
+O pool sobe no lifespan de cada worker do uvicorn (start) e, fora da API
+(scripts), no primeiro uso. Os filhos nao sao copias do processo da API:
+"fork" levaria junto locks seguros naquele instante por outras threads
+(db-io, WAL, tarefas, metricas) e o filho travaria para sempre. Onde existe
+usa "forkserver", com app.services.hash_worker como unico modulo
+pre-carregado (sem o main.py, sem banco); senao "spawn". Os filhos chamam
+direto o CryptContext de hash_worker, sem as metricas, e saem sozinhos se
+o processo que os criou morrer. Se um filho morrer (OOM, segfault), o
+executor quebra (BrokenProcessPool): ele e trocado por um novo e a chamada
+e repetida uma vez.
+"""
+
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services import hash_worker, metricas
+
+logger = logging.getLogger(__name__)
+
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pending = 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            contexto = multiprocessing.get_context(_START_METHOD)
+            if _START_METHOD == "forkserver":
+                # Substitui o preload padrao (["__main__"]): o servidor nao importa o main.py.
+                contexto.set_forkserver_preload(["app.services.hash_worker"])
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.password_hash_workers,
+                mp_context=contexto,
+                initializer=hash_worker.vigiar_pai,
+            )
+        return _pool
+
+
+def _descartar_pool(quebrado: ProcessPoolExecutor) -> None:
+    """Tira de uso um executor quebrado; o proximo _get_pool cria outro."""
+    global _pool
+    with _pool_lock:
+        # Outra requisicao pode ja ter trocado o executor.
+        if _pool is not quebrado:
+            return
+        _pool = None
+    logger.warning("Pool de hash de senha quebrado (processo filho morreu); criando outro.")
+    quebrado.shutdown(wait=False, cancel_futures=True)
+
+
+@contextlib.contextmanager
+def _sem_script_principal():
+    """
+    Esconde o __main__ enquanto o executor cria filhos (dentro de submit).
+
+    Com forkserver/spawn, cada filho reimporta o script principal (python
+    main.py importaria as rotas e abriria o banco de novo). Sem __file__ e
+    __spec__ no __main__, o filho so importa o que a funcao enviada precisa.
+    """
+    principal = sys.modules["__main__"]
+    faltando = object()
+    salvos = {nome: getattr(principal, nome, faltando) for nome in ("__file__", "__spec__")}
+    principal.__spec__ = None
+    if salvos["__file__"] is not faltando:
+        del principal.__file__
+    try:
+        yield
+    finally:
+        for nome, valor in salvos.items():
+            if valor is not faltando:
+                setattr(principal, nome, valor)
+
+
+def start() -> None:
+    """Sobe o pool e seus processos antes de a API atender (chamado no lifespan)."""
+    if settings.password_hash_workers <= 0:
+        return
+    pool = _get_pool()
+    # O executor cria os filhos sob demanda: uma chamada por filho deixa todos prontos.
+    with _sem_script_principal():
+        futuros = [pool.submit(hash_worker.pronto) for _ in range(settings.password_hash_workers)]
+    for futuro in futuros:
+        futuro.result()
+
+
+def _reserve() -> None:
+    global _pending
+    with _pool_lock:
+        if _pending >= settings.password_hash_max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Servidor ocupado validando credenciais. Tente novamente em instantes.",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+
+
+def _release() -> None:
+    global _pending
+    with _pool_lock:
+        _pending -= 1
+
+
+async def _run(func, *args):
+    _reserve()
+    try:
+        if settings.password_hash_workers <= 0:
+            # Sem pool (ex.: ambiente sem multiprocessing): usa o threadpool.
+            return await run_in_threadpool(func, *args)
+        loop = asyncio.get_running_loop()
+        # Os filhos nao registram metricas: vale o tempo visto pela API (fila + hash + ida e volta).
+        inicio = time.perf_counter()
+        erro = True
+        try:
+            for tentativa in range(2):
+                pool = _get_pool()
+                try:
+                    # submit pode criar um filho (pool recriado ou fora da API, sem start).
+                    with _sem_script_principal():
+                        futuro = loop.run_in_executor(pool, func, *args)
+                    resultado = await futuro
+                    break
+                except BrokenProcessPool:
+                    # Hash e verificacao nao tem efeito colateral: repetir num pool novo e seguro.
+                    _descartar_pool(pool)
+                    if tentativa:
+                        raise
+            erro = False
+            return resultado
+        finally:
+            metricas.medir("password_hashing", func.__name__, time.perf_counter() - inicio, erro)
+    finally:
+        _release()
+
+
+async def hash_password(password: str) -> str:
+    """Versao assincrona de get_password_hash (ValueError para senha longa)."""
+    return await _run(hash_worker.get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Versao assincrona de verify_password."""
+    return await _run(hash_worker.verify_password, plain_password, hashed_password)
+
+
+async def check_password_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Versao assincrona de verify_and_update_password (hash novo ou None)."""
+    return await _run(hash_worker.verify_and_update_password, plain_password, hashed_password)
+
+
+def shutdown() -> None:
+    """Encerra o pool e espera os processos filhos sairem."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,306 @@
+"""
+Perfil sob demanda de requisicoes lentas (PROFILING_ENABLED).
+
+Uma requisicao e perfilada quando traz o cabecalho X-Profile com o
+PROFILING_TOKEN ou quando cai na amostragem (PROFILING_SAMPLE_RATE). Para
+ela sao registrados:
+- amostras de pilha a cada PROFILING_INTERVAL_MS, tiradas com
+  sys._current_frames da thread do event loop e das threads "db-io" que
+  estiverem trabalhando para a requisicao (run_io); as PROFILING_TOP_N
+  funcoes com mais amostras ficam no perfil (proprias = no topo da pilha,
+  acumuladas = em qualquer ponto da pilha); amostras do event loop parado
+  no select contam apenas como ociosas
+- chamadas ao storage por operacao e tabela, o tempo gasto nelas e os bytes
+  lidos/escritos (tamanho do JSON dos documentos)
+
+A amostragem estatistica nao instala hooks no interpretador (diferente do
+cProfile): o custo fica na thread amostradora e so existe enquanto houver
+requisicao perfilada. Como o event loop e compartilhado, as amostras dele
+incluem o que outras requisicoes executaram no mesmo intervalo.
+
+Os ultimos PROFILING_MAX_PERFIS perfis ficam em memoria, no processo, e
+sao lidos em GET /admin/perfis (Authorization: Bearer <PROFILING_TOKEN>).
+A resposta perfilada traz o id no cabecalho X-Profile-Id.
+"""
+
+import contextvars
+import functools
+import itertools
+import json
+import os
+import random
+import secrets
+import selectors
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from app.config import settings
+
+# Perfil da requisicao em andamento (copiado para as threads de I/O por run_io).
+_perfil_atual: contextvars.ContextVar["Perfil | None"] = contextvars.ContextVar("perfil_atual", default=None)
+
+_ids = itertools.count(1)
+_perfis: deque = deque(maxlen=settings.profiling_max_perfis)
+_ativos: set = set()
+_lock = threading.Lock()
+_amostrador: threading.Thread | None = None
+
+# Operacoes do StorageBackend que leem documentos; as demais escrevem.
+_LEITURAS = {"get", "find_one", "search", "all", "select", "iter_select"}
+_PROFUNDIDADE_MAXIMA = 128
+_SELECTORS = selectors.__file__
+
+
+class Perfil:
+    def __init__(self, metodo: str, caminho: str):
+        self.id = next(_ids)
+        self.metodo = metodo
+        self.caminho = caminho
+        self.inicio = datetime.now(timezone.utc)
+        self.threads: Counter = Counter()
+        self.amostras = 0
+        self.ociosas = 0
+        self.proprias: Counter = Counter()
+        self.acumuladas: Counter = Counter()
+        self.db_chamadas: Counter = Counter()
+        self.db_segundos = 0.0
+        self.bytes_lidos = 0
+        self.bytes_escritos = 0
+        self._lock = threading.Lock()
+
+    def entrar(self, ident: int) -> None:
+        with self._lock:
+            self.threads[ident] += 1
+
+    def sair(self, ident: int) -> None:
+        with self._lock:
+            self.threads[ident] -= 1
+            if self.threads[ident] <= 0:
+                del self.threads[ident]
+
+    def amostrar(self, frames: dict) -> None:
+        with self._lock:
+            pilhas = [frames[ident] for ident in self.threads if ident in frames]
+            for frame in pilhas:
+                self.amostras += 1
+                if frame.f_code.co_name == "select" and frame.f_code.co_filename == _SELECTORS:
+                    # Event loop parado esperando I/O: nao diz nada sobre o codigo da rota.
+                    self.ociosas += 1
+                    continue
+                vistas = set()
+                folha = True
+                profundidade = 0
+                while frame is not None and profundidade < _PROFUNDIDADE_MAXIMA:
+                    code = frame.f_code
+                    chave = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if folha:
+                        self.proprias[chave] += 1
+                        folha = False
+                    if chave not in vistas:
+                        vistas.add(chave)
+                        self.acumuladas[chave] += 1
+                    frame = frame.f_back
+                    profundidade += 1
+
+    def contar_storage(self, operacao: str, tabela, segundos: float, lidos: int, escritos: int) -> None:
+        with self._lock:
+            self.db_chamadas[f"{operacao}:{tabela}"] += 1
+            self.db_segundos += segundos
+            self.bytes_lidos += lidos
+            self.bytes_escritos += escritos
+
+    def resumo(self, rota: str | None, status_code: int, duracao: float) -> dict:
+        with self._lock:
+            # Primeiro quem mais aparece no topo da pilha, depois quem mais aparece nela.
+            chaves = sorted(self.acumuladas, key=lambda chave: (-self.proprias[chave], -self.acumuladas[chave]))
+            top = chaves[: settings.profiling_top_n]
+            return {
+                "id": self.id,
+                "metodo": self.metodo,
+                "caminho": self.caminho,
+                "rota": rota,
+                "status": status_code,
+                "inicio": self.inicio.isoformat(),
+                "duracao_ms": round(duracao * 1000, 3),
+                "amostras": self.amostras,
+                "amostras_ociosas": self.ociosas,
+                "intervalo_ms": settings.profiling_interval_ms,
+                "top_frames": [
+                    {
+                        "funcao": nome,
+                        "arquivo": _arquivo_relativo(arquivo),
+                        "linha": linha,
+                        "proprias": self.proprias[(arquivo, linha, nome)],
+                        "acumuladas": self.acumuladas[(arquivo, linha, nome)],
+                    }
+                    for arquivo, linha, nome in top
+                ],
+                "db": {
+                    "chamadas": sum(self.db_chamadas.values()),
+                    "por_operacao": dict(self.db_chamadas.most_common()),
+                    "tempo_ms": round(self.db_segundos * 1000, 3),
+                    "bytes_lidos": self.bytes_lidos,
+                    "bytes_escritos": self.bytes_escritos,
+                },
+            }
+
+
+def _arquivo_relativo(arquivo: str) -> str:
+    try:
+        return os.path.relpath(arquivo)
+    except ValueError:
+        return arquivo
+
+
+def _amostrar_loop() -> None:
+    global _amostrador
+    proprio = threading.get_ident()
+    while True:
+        with _lock:
+            if not _ativos:
+                _amostrador = None
+                return
+            ativos = list(_ativos)
+        frames = sys._current_frames()
+        frames.pop(proprio, None)
+        for perfil in ativos:
+            perfil.amostrar(frames)
+        time.sleep(settings.profiling_interval_ms / 1000)
+
+
+def _iniciar(perfil: Perfil) -> None:
+    global _amostrador
+    with _lock:
+        _ativos.add(perfil)
+        if _amostrador is None:
+            _amostrador = threading.Thread(target=_amostrar_loop, name="perfilador", daemon=True)
+            _amostrador.start()
+
+
+def _encerrar(perfil: Perfil) -> None:
+    with _lock:
+        _ativos.discard(perfil)
+
+
+def na_thread(func):
+    """Para run_io: marca a thread de I/O como parte do perfil enquanto func roda."""
+    perfil = _perfil_atual.get()
+    if perfil is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        ident = threading.get_ident()
+        perfil.entrar(ident)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            perfil.sair(ident)
+
+    return wrapper
+
+
+def _tamanho(valor) -> int:
+    if valor is None:
+        return 0
+    return len(json.dumps(valor, ensure_ascii=False, default=str))
+
+
+class StoragePerfilado:
+    """Repassa as chamadas ao backend, somando operacoes e bytes no perfil da requisicao."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._backend, nome)
+        if nome.startswith("_") or not callable(atributo):
+            return atributo
+
+        if nome == "iter_select":
+
+            @functools.wraps(atributo)
+            def chamada(table, *args, **kwargs):
+                perfil = _perfil_atual.get()
+                if perfil is None:
+                    yield from atributo(table, *args, **kwargs)
+                    return
+                for doc in atributo(table, *args, **kwargs):
+                    perfil.contar_storage(nome, table, 0, _tamanho(doc), 0)
+                    yield doc
+
+        else:
+
+            @functools.wraps(atributo)
+            def chamada(*args, **kwargs):
+                perfil = _perfil_atual.get()
+                if perfil is None:
+                    return atributo(*args, **kwargs)
+                inicio = time.perf_counter()
+                resultado = atributo(*args, **kwargs)
+                segundos = time.perf_counter() - inicio
+                if nome in _LEITURAS:
+                    lidos, escritos = _tamanho(resultado), 0
+                else:
+                    lidos, escritos = 0, _tamanho(args[1:])
+                perfil.contar_storage(nome, args[0] if args else None, segundos, lidos, escritos)
+                return resultado
+
+        # Guarda a funcao pronta: as proximas chamadas nao passam por __getattr__.
+        setattr(self, nome, chamada)
+        return chamada
+
+
+def listar() -> list[dict]:
+    """Perfis guardados, do mais recente para o mais antigo."""
+    return list(reversed(_perfis))
+
+
+def obter(perfil_id: int) -> dict | None:
+    return next((perfil for perfil in _perfis if perfil["id"] == perfil_id), None)
+
+
+def _selecionado(scope) -> bool:
+    if settings.profiling_token:
+        for nome, valor in scope.get("headers", []):
+            if nome == b"x-profile":
+                return secrets.compare_digest(valor.decode("latin-1"), settings.profiling_token)
+    return settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que perfila as requisicoes selecionadas."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _selecionado(scope):
+            await self.app(scope, receive, send)
+            return
+
+        perfil = Perfil(scope["method"], scope["path"])
+        status_code = 500
+
+        async def send_com_perfil(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", str(perfil.id).encode())]
+            await send(message)
+
+        token = _perfil_atual.set(perfil)
+        perfil.entrar(threading.get_ident())
+        _iniciar(perfil)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_com_perfil)
+        finally:
+            duracao = time.perf_counter() - inicio
+            _encerrar(perfil)
+            _perfil_atual.reset(token)
+            rota = getattr(scope.get("route"), "path", None)
+            _perfis.append(perfil.resumo(rota, status_code, duracao))
@@ -0,0 +1,55 @@
+"""
+Rastreamento das consultas ao storage e log de consultas lentas.
+
+Cada leitura (get, find_one, search, all, select) e cada update_where /
+remove_where dos backends chega em registrar com a tabela, o predicado
+(campos e operadores, sem os valores), os documentos examinados e os
+devolvidos e o tempo gasto. Os numeros vao para /metrics
+(storage_queries_total, storage_documents_scanned_total,
+storage_documents_returned_total, storage_query_duration_seconds).
+
+Uma razao examinados/devolvidos alta em um predicado indica busca sem
+indice: o custo cresce com a tabela. Consultas acima de SLOW_QUERY_MS vao
+para o log como aviso, com a funcao de app/services/database.py que as fez
+e, no SQLite, o plano da consulta.
+"""
+
+import logging
+import os
+import sys
+
+from app.config import settings
+from app.services import metricas
+
+logger = logging.getLogger(__name__)
+
+
+def _funcao_chamadora() -> str | None:
+    # Primeira funcao de database.py na pilha (so calculada para consultas lentas).
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.basename(frame.f_code.co_filename) == "database.py":
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+def registrar(consulta: dict) -> None:
+    labels = (consulta["tabela"], consulta["operacao"], consulta["predicado"])
+    metricas.consultas.somar(labels)
+    metricas.documentos_examinados.somar(labels, consulta["examinados"])
+    metricas.documentos_retornados.somar(labels, consulta["retornados"])
+    metricas.duracao_consultas.observar(labels[:2], consulta["segundos"])
+
+    if settings.slow_query_ms > 0 and consulta["segundos"] * 1000 >= settings.slow_query_ms:
+        logger.warning(
+            "Consulta lenta (%.1f ms) em %s: %s %s [%s] examinados=%s retornados=%s%s",
+            consulta["segundos"] * 1000,
+            _funcao_chamadora() or "?",
+            consulta["operacao"],
+            consulta["tabela"],
+            consulta["predicado"],
+            consulta["examinados"],
+            consulta["retornados"],
+            f" plano={consulta['plano']}" if consulta["plano"] else "",
+        )
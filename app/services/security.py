@@ -5,38 +5,53 @@ Responsavel por:
 - hash e validacao de senha
 - criacao e leitura de JWT
 - controle simples de autorizacao por papel (role)
+- refresh tokens com rotacao e lista compacta de revogados
+
+Tokens ja verificados ficam em cache (chave = sha256 do token) ate o exp,
+e o estado do usuario (existe/ativo) vem do cache de usuarios; chamadas
+repetidas da mesma sessao nao refazem a criptografia nem a busca no banco.
 """
 
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from app.config import settings
+from app.services import cache, hash_worker, metricas
+from app.services.async_database import get_usuario_estado, revoke_refresh_token
+from app.services.storage import DuplicateKeyError
 
-# Usa PBKDF2-SHA256 para evitar incompatibilidade do bcrypt em alguns ambientes (ex.: Python 3.13).
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 # Define de qual endpoint o Swagger obtira token.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/restaurantes/token")
+# Tabela de cada papel e mensagem quando o usuario do token nao existe mais.
+ROLE_TABLES = {
+    "restaurante": ("restaurantes", "Restaurante nao encontrado."),
+    "fornecedor": ("fornecedores", "Fornecedor não encontrado."),
+}
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Compara senha em texto puro com hash salvo."""
-    try:
-        return pwd_context.verify(plain_password, hashed_password)
-    except Exception:
-        # Em caso de hash invalido/corrompido, trata como credencial incorreta.
-        return False
+    """Compara senha em texto puro com hash salvo (hash invalido = credencial incorreta)."""
+    return hash_worker.verify_password(plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Como verify_password, mas tambem devolve um hash novo quando o salvo
+    usa esquema ou custo diferente da configuracao atual (senao None).
+    """
+    return hash_worker.verify_and_update_password(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Gera hash seguro para persistir senha no banco."""
-    if len(password.encode("utf-8")) > 128:
-        raise ValueError("A senha excede o tamanho maximo permitido.")
-    return pwd_context.hash(password)
+    """Gera hash seguro para persistir senha no banco (ValueError acima de 128 bytes)."""
+    return hash_worker.get_password_hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -49,7 +64,104 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 
-def get_current_user_email(token: str = Depends(oauth2_scheme)) -> str:
+def decode_token(token: str) -> dict:
+    """Decodifica e verifica o JWT, reaproveitando o resultado ate o exp."""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = cache.tokens_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        exp = payload.get("exp")
+        # Token sem exp nao e guardado: nao haveria quando descartar.
+        if exp is not None and exp - time.time() > 0:
+            cache.tokens_cache.set(key, payload, ttl=exp - time.time())
+    return dict(payload)
+
+
+def create_refresh_token(data: dict) -> str:
+    """
+    Cria refresh token (JWT com type=refresh e jti unico).
+
+    Renovar custa uma verificacao HMAC e um insert na lista de revogados,
+    em vez de um novo hash de senha.
+    """
+    emitido_em = time.time()
+    agora = int(emitido_em)
+    to_encode = {
+        **data,
+        "type": "refresh",
+        "jti": secrets.token_urlsafe(16),
+        "iat": agora,
+        # iat e em segundos inteiros; a revogacao por troca de senha compara com este.
+        "emitido_em": emitido_em,
+        "exp": agora + settings.refresh_token_expire_days * 86400,
+    }
+    return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+
+
+def create_token_pair(email: str, role: str, nome: str | None) -> dict:
+    """Resposta de login: access token curto + refresh token longo."""
+    claims = {"sub": email, "role": role, "nome": nome}
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+    }
+
+
+def _decode_refresh_token(token: str, expected_role: str) -> dict:
+    invalido = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Refresh token invalido ou expirado.",
+    )
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        raise invalido
+    if payload.get("type") != "refresh" or payload.get("role") != expected_role or not payload.get("jti"):
+        raise invalido
+    return payload
+
+
+async def rotate_refresh_token(token: str, expected_role: str) -> dict:
+    """
+    Troca um refresh token valido por um novo par de tokens.
+
+    O token usado e revogado na mesma operacao (indice unico no jti): se
+    ele for apresentado de novo, ou por duas requisicoes ao mesmo tempo,
+    so a primeira renova.
+    """
+    payload = _decode_refresh_token(token, expected_role)
+    invalido = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Refresh token invalido ou expirado.",
+    )
+
+    table, _ = ROLE_TABLES[expected_role]
+    estado = await get_usuario_estado(table, payload["sub"])
+    if not estado["existe"] or not estado["ativo"]:
+        raise invalido
+    revogados_em = estado.get("tokens_revogados_em")
+    # Tokens antigos so tem iat (segundos inteiros): os do mesmo segundo da revogacao caem tambem.
+    if revogados_em and payload.get("emitido_em", payload.get("iat", 0)) <= revogados_em:
+        raise invalido
+
+    try:
+        await revoke_refresh_token(payload["jti"], payload["exp"])
+    except DuplicateKeyError:
+        raise invalido
+    return create_token_pair(payload["sub"], expected_role, payload.get("nome"))
+
+
+async def revoke_refresh(token: str, expected_role: str) -> None:
+    """Revoga um refresh token (logout); revogar duas vezes nao e erro."""
+    payload = _decode_refresh_token(token, expected_role)
+    try:
+        await revoke_refresh_token(payload["jti"], payload["exp"])
+    except DuplicateKeyError:
+        pass
+
+
+async def get_current_user_email(token: str = Depends(oauth2_scheme)) -> str:
     """Extrai email (claim sub) de um token valido."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -58,16 +170,16 @@ def get_current_user_email(token: str = Depends(oauth2_scheme)) -> str:
     )
 
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        payload = decode_token(token)
         email: str | None = payload.get("sub")
-        if not email:
+        if not email or payload.get("type") == "refresh":
             raise credentials_exception
         return email
     except JWTError:
         raise credentials_exception
 
 
-def get_current_user_payload(token: str = Depends(oauth2_scheme)) -> dict:
+async def get_current_user_payload(token: str = Depends(oauth2_scheme)) -> dict:
     """Retorna payload completo do JWT para regras de autorizacao."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,8 +187,8 @@ def get_current_user_payload(token: str = Depends(oauth2_scheme)) -> dict:
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        if not payload.get("sub"):
+        payload = decode_token(token)
+        if not payload.get("sub") or payload.get("type") == "refresh":
             raise credentials_exception
         return payload
     except JWTError:
@@ -91,13 +203,35 @@ def require_role(expected_role: str):
     Depends(require_role("fornecedor"))
     """
 
-    def role_dependency(payload: dict = Depends(get_current_user_payload)) -> str:
+    async def role_dependency(payload: dict = Depends(get_current_user_payload)) -> str:
         if payload.get("role") != expected_role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Permissao insuficiente para acessar este recurso.",
             )
+        if expected_role in ROLE_TABLES:
+            table, nao_encontrado = ROLE_TABLES[expected_role]
+            estado = await get_usuario_estado(table, payload["sub"])
+            if not estado["existe"]:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=nao_encontrado)
+            if not estado["ativo"]:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario inativo.")
         # Retorna email autenticado para o endpoint consumir.
         return payload["sub"]
 
     return role_dependency
+
+
+# Hash de senha e JWT entram nas metricas (GET /metrics).
+metricas.instrumentar_modulo(
+    globals(),
+    "security",
+    nomes=(
+        "verify_password",
+        "verify_and_update_password",
+        "get_password_hash",
+        "create_access_token",
+        "decode_token",
+        "create_refresh_token",
+    ),
+)
@@ -0,0 +1,1069 @@
+"""
+Backends de armazenamento usados por app/services/database.py.
+
+Os dois backends expoem a mesma interface orientada a tabelas, entao as
+funcoes de database.py nao precisam saber onde os documentos ficam:
+- TinyDBBackend: arquivo JSON unico (comportamento original do projeto)
+- SQLiteBackend: uma tabela real por colecao, em modo WAL, onde cada
+  escrita altera apenas a linha afetada
+
+Todo documento retornado e um tinydb.table.Document (dict com doc_id).
+"""
+
+import atexit
+import heapq
+import json
+import logging
+import operator
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from tinydb import Query, TinyDB
+from tinydb.storages import JSONStorage
+from tinydb.table import Document
+
+from app.services.wal import WALMiddleware, WriteAheadLog, apply_record, fsync_adiado, read_log, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Campos com valor unico por tabela (garantido pelo backend, inclusive entre processos no SQLite).
+UNIQUE_FIELDS = {
+    "restaurantes": ["email"],
+    "fornecedores": ["email"],
+    "tokens_revogados": ["jti"],
+    "stripe_eventos": ["event_id"],
+    "vendas": ["linha_id"],
+    "vendas_resumo": ["chave"],
+}
+
+
+class DuplicateKeyError(Exception):
+    """Insercao violaria um campo de UNIQUE_FIELDS."""
+
+    def __init__(self, table: str, field: str):
+        super().__init__(f"Valor duplicado para {table}.{field}")
+        self.table = table
+        self.field = field
+
+
+# Recebe cada consulta rastreada (ver set_rastreador); None desliga o rastreamento.
+_rastreador = None
+
+
+def set_rastreador(func) -> None:
+    """
+    Define quem recebe o rastreamento das consultas (None desliga).
+
+    func(consulta) recebe um dict com operacao, tabela, predicado (campos e
+    operadores, sem valores), examinados, retornados, segundos e plano (SQL
+    do SQLite). No SQLite, examinados e estimado pelo plano: a tabela inteira
+    em varreduras, os retornados em buscas por indice.
+    """
+    global _rastreador
+    _rastreador = func
+
+
+def _rastrear(operacao, tabela, predicado, examinados, retornados, inicio, plano=None, fim=None) -> None:
+    if _rastreador is None:
+        return
+    fim = time.perf_counter() if fim is None else fim
+    _rastreador(
+        {
+            "operacao": operacao,
+            "tabela": tabela,
+            "predicado": predicado,
+            "examinados": int(examinados),
+            "retornados": int(retornados),
+            "segundos": fim - inicio,
+            "plano": plano,
+        }
+    )
+
+
+def _descrever_select(filters, order_by, descending, after, limit) -> str:
+    partes = [" AND ".join(f"{field} {op} ?" for field, op, _ in filters)]
+    partes.append(f"ORDER BY {order_by}{' DESC' if descending else ''}")
+    if after is not None:
+        partes.append("AFTER ?")
+    if limit is not None:
+        partes.append("LIMIT ?")
+    return " ".join(parte for parte in partes if parte)
+
+
+class StorageBackend:
+    """Interface comum dos backends de armazenamento."""
+
+    def insert(self, table: str, data: dict) -> int:
+        """Insere e devolve o id; levanta DuplicateKeyError se violar UNIQUE_FIELDS."""
+        raise NotImplementedError
+
+    def insert_multiple(self, table: str, items: list[dict]) -> list[int]:
+        raise NotImplementedError
+
+    def get(self, table: str, doc_id: int):
+        raise NotImplementedError
+
+    def find_one(self, table: str, field: str, value):
+        raise NotImplementedError
+
+    def search(self, table: str, field: str, value) -> list:
+        raise NotImplementedError
+
+    def all(self, table: str) -> list:
+        raise NotImplementedError
+
+    def select(
+        self,
+        table: str,
+        filters: list[tuple] = (),
+        order_by: str = "id",
+        descending: bool = False,
+        after: tuple | None = None,
+        limit: int | None = None,
+    ) -> list:
+        """
+        Consulta com filtros, ordenacao e paginacao por cursor (keyset).
+
+        filters: lista de (campo, operador, valor), operadores "==", ">=", "<=".
+        after: (valor_ordenacao, id) do ultimo item da pagina anterior.
+        Valores nulos do campo de ordenacao ficam sempre no fim.
+        """
+        raise NotImplementedError
+
+    def iter_select(self, table: str, filters: list[tuple] = (), batch_size: int = 500):
+        """
+        Percorre a tabela em ordem de id, em lotes buscados por cursor.
+
+        Cada lote e uma consulta independente, entao o gerador pode ser
+        consumido aos poucos (e ate de threads diferentes) com memoria constante.
+        """
+        after = None
+        while True:
+            batch = self.select(table, filters, after=after, limit=batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].doc_id, batch[-1].doc_id)
+
+    def update(self, table: str, doc_ids: list[int], updates: dict) -> None:
+        raise NotImplementedError
+
+    def update_where(self, table: str, field: str, value, updates: dict) -> None:
+        raise NotImplementedError
+
+    def remove(self, table: str, doc_ids: list[int]) -> None:
+        raise NotImplementedError
+
+    def remove_where(self, table: str, field: str, value) -> None:
+        raise NotImplementedError
+
+    def upsert_increment(self, table: str, key_field: str, rows: list[tuple[dict, dict]]) -> None:
+        """
+        Soma valores numericos a documentos identificados por key_field, criando os que faltam.
+
+        rows: lista de (base, incrementos). base traz key_field e os campos fixos
+        usados na criacao. key_field deve estar em UNIQUE_FIELDS. O lote inteiro
+        e aplicado de uma vez (uma transacao no SQLite, uma entrada no WAL).
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """
+        Bloco (with) em que nenhuma escrita de outra thread ou processo entra no meio.
+
+        Pode ser aninhado. No SQLite e uma transacao (as internas sao savepoints)
+        e uma excecao desfaz o que o bloco gravou; no TinyDB e o lock de escrita,
+        sem desfazer.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Grava o que estiver pendente e libera arquivos/conexoes."""
+
+
+# ---------- TinyDB ----------
+# Campos com indice hash em memoria no backend TinyDB.
+TINYDB_INDEXES = {
+    "users": ["email", "reset_token"],
+    "restaurantes": ["email", "reset_token"],
+    "fornecedores": ["email", "reset_token"],
+    "pedidos": ["session_id", "email", "status"],
+    "metodos_pagamento": ["fornecedor_email"],
+    "tokens_revogados": ["jti"],
+    "stripe_eventos": ["event_id"],
+    "vendas": ["linha_id", "fornecedor_id"],
+    "vendas_resumo": ["chave", "fornecedor_id"],
+}
+
+
+class HashIndex:
+    """Indice valor -> doc_ids de um campo, para buscas por igualdade em O(1)."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self._ids: dict = {}
+
+    def add(self, doc_id: int, doc: dict) -> None:
+        value = doc.get(self.field)
+        if value is not None:
+            self._ids.setdefault(value, set()).add(doc_id)
+
+    def discard(self, doc_id: int, doc: dict) -> None:
+        value = doc.get(self.field)
+        ids = self._ids.get(value)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self._ids[value]
+
+    def lookup(self, value) -> list[int]:
+        return sorted(self._ids.get(value, ()))
+
+
+class TinyDBBackend(StorageBackend):
+    """
+    Backend original: todas as tabelas dentro de um arquivo JSON.
+
+    Os campos de TINYDB_INDEXES ganham indices hash mantidos a cada
+    insert/update/remove, evitando varrer a tabela nas buscas por email,
+    reset_token e session_id.
+
+    Todas as operacoes passam por um lock, entao o backend pode ser usado
+    por varias threads. Com wal=True os dados ficam em memoria e cada
+    escrita vai para o write-ahead log (ver app/services/wal.py).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        wal: bool = False,
+        wal_flush_interval: float = 0.005,
+        wal_batch_size: int = 256,
+        wal_compact_every: int = 1000,
+        wal_wait_fsync: bool = True,
+    ):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock_file = _lock_exclusive(path + ".lock")
+        self._lock = threading.RLock()
+        self._indexes: dict[str, dict[str, HashIndex]] = {}
+        self.wal = None
+        if not wal:
+            self._absorver_wal()
+            self.db = TinyDB(path)
+            return
+
+        self._memory = WALMiddleware(JSONStorage)
+        self.db = TinyDB(path, storage=self._memory)
+        # Reaplica o que ficou no log desde a ultima compactacao.
+        replayed = 0
+        for log_path in (path + ".wal.old", path + ".wal"):
+            for record in read_log(log_path):
+                apply_record(self._memory.data, record)
+                replayed += 1
+        self.wal = WriteAheadLog(path + ".wal", wal_flush_interval, wal_batch_size)
+        self._wal_wait_fsync = wal_wait_fsync
+        self._wal_compact_every = wal_compact_every
+        if replayed:
+            self.compact()
+        threading.Thread(target=self._compact_loop, name="wal-compact", daemon=True).start()
+        atexit.register(self.close)
+
+    # ---------- WAL ----------
+    def _absorver_wal(self) -> None:
+        """WAL desligado depois de ter sido usado: aplica o log restante no database.json."""
+        logs = [log_path for log_path in (self.path + ".wal.old", self.path + ".wal") if os.path.exists(log_path)]
+        if not logs:
+            return
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as snapshot:
+                data = json.loads(snapshot.read() or "{}")
+        replayed = 0
+        for log_path in logs:
+            for record in read_log(log_path):
+                apply_record(data, record)
+                replayed += 1
+        if replayed:
+            write_snapshot(self.path, json.dumps(data, ensure_ascii=False))
+            logger.info("WAL do TinyDB aplicado no database.json (%s registros).", replayed)
+        for log_path in logs:
+            os.remove(log_path)
+
+    def _log(self, record: dict) -> int | None:
+        if self.wal is None:
+            return None
+        return self.wal.append(record)
+
+    def _sync(self, seq: int | None) -> None:
+        # Espera o fsync fora do lock: escritores do mesmo lote esperam juntos.
+        if seq is None or not self._wal_wait_fsync:
+            return
+        adiados = fsync_adiado.get()
+        if adiados is not None:
+            # Chamada via run_io: a espera fica para o event loop, a thread de I/O segue livre.
+            adiados.append((self.wal, seq))
+            return
+        self.wal.wait(seq)
+
+    def compact(self) -> None:
+        """Grava o estado em memoria no database.json e descarta o log aplicado."""
+        if self.wal is None:
+            return
+        old_log = self.path + ".wal.old"
+        with self._lock:
+            self.wal.rotate(old_log)
+            text = json.dumps(self._memory.data, ensure_ascii=False)
+        write_snapshot(self.path, text)
+        os.remove(old_log)
+
+    def _compact_loop(self) -> None:
+        while self.wal is not None:
+            time.sleep(1)
+            if self.wal.records_since_rotate >= self._wal_compact_every:
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception("Falha ao compactar o WAL do TinyDB")
+
+    def close(self) -> None:
+        if self.wal is not None:
+            try:
+                self.compact()
+            except Exception:
+                # O que nao entrou no snapshot continua no log e e reaplicado ao abrir.
+                logger.exception("Falha ao compactar o WAL do TinyDB no encerramento")
+            self.wal.close()
+            self.wal = None
+        self.db.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # ---------- Indices ----------
+    def _table(self, table: str):
+        return self.db.table(table)
+
+    def _table_indexes(self, table: str) -> dict[str, HashIndex]:
+        # Indices sao construidos na primeira utilizacao, com uma unica varredura.
+        indexes = self._indexes.get(table)
+        if indexes is None:
+            indexes = {field: HashIndex(field) for field in TINYDB_INDEXES.get(table, [])}
+            if indexes:
+                for doc in self._table(table).all():
+                    for index in indexes.values():
+                        index.add(doc.doc_id, doc)
+            self._indexes[table] = indexes
+        return indexes
+
+    def _index_add(self, table: str, docs) -> None:
+        for index in self._table_indexes(table).values():
+            for doc in docs:
+                index.add(doc.doc_id, doc)
+
+    def _index_discard(self, table: str, docs) -> None:
+        for index in self._table_indexes(table).values():
+            for doc in docs:
+                index.discard(doc.doc_id, doc)
+
+    def _ids_where(self, table: str, field: str, value) -> list[int] | None:
+        index = self._table_indexes(table).get(field)
+        if index is None:
+            return None
+        return index.lookup(value)
+
+    def _get_many(self, table: str, doc_ids: list[int]) -> list:
+        if not doc_ids:
+            return []
+        return self._table(table).get(doc_ids=doc_ids)
+
+    def _check_unique(self, table: str, items: list[dict]) -> None:
+        for field in UNIQUE_FIELDS.get(table, []):
+            index = self._table_indexes(table)[field]
+            seen = set()
+            for item in items:
+                value = item.get(field)
+                if value is None:
+                    continue
+                if value in seen or index.lookup(value):
+                    raise DuplicateKeyError(table, field)
+                seen.add(value)
+
+    # ---------- Operacoes ----------
+    def insert(self, table: str, data: dict) -> int:
+        with self._lock:
+            self._check_unique(table, [data])
+            doc_id = self._table(table).insert(data)
+            self._index_add(table, [Document(data, doc_id=doc_id)])
+            seq = self._log({"op": "insert", "table": table, "docs": {str(doc_id): data}})
+        self._sync(seq)
+        return doc_id
+
+    def insert_multiple(self, table: str, items: list[dict]) -> list[int]:
+        with self._lock:
+            self._check_unique(table, items)
+            ids = self._table(table).insert_multiple(items)
+            self._index_add(table, [Document(item, doc_id=doc_id) for item, doc_id in zip(items, ids)])
+            seq = self._log(
+                {"op": "insert", "table": table, "docs": {str(doc_id): item for doc_id, item in zip(ids, items)}}
+            )
+        self._sync(seq)
+        return ids
+
+    def get(self, table: str, doc_id: int):
+        inicio = time.perf_counter()
+        with self._lock:
+            doc = self._table(table).get(doc_id=doc_id)
+        _rastrear("get", table, "id == ?", 1, doc is not None, inicio)
+        return doc
+
+    def find_one(self, table: str, field: str, value):
+        inicio = time.perf_counter()
+        with self._lock:
+            ids = self._ids_where(table, field, value)
+            if ids is None:
+                # Sem indice a busca percorre a tabela (ate o primeiro encontrado).
+                doc = self._table(table).get(Query()[field] == value)
+                examinados = len(self._table(table))
+            else:
+                doc = next(iter(self._get_many(table, ids[:1])), None)
+                examinados = min(len(ids), 1)
+        _rastrear("find_one", table, f"{field} == ?", examinados, doc is not None, inicio)
+        return doc
+
+    def search(self, table: str, field: str, value) -> list:
+        inicio = time.perf_counter()
+        with self._lock:
+            ids = self._ids_where(table, field, value)
+            if ids is None:
+                docs = self._table(table).search(Query()[field] == value)
+                examinados = len(self._table(table))
+            else:
+                docs = self._get_many(table, ids)
+                examinados = len(ids)
+        _rastrear("search", table, f"{field} == ?", examinados, len(docs), inicio)
+        return docs
+
+    def all(self, table: str) -> list:
+        inicio = time.perf_counter()
+        with self._lock:
+            docs = self._table(table).all()
+        _rastrear("all", table, "", len(docs), len(docs), inicio)
+        return docs
+
+    def _select_docs(self, table: str, filters) -> tuple[list, int]:
+        # Um filtro "==" em campo indexado restringe os candidatos antes dos demais filtros.
+        for i, (field, op, value) in enumerate(filters):
+            ids = self._ids_where(table, field, value) if op == "==" else None
+            if ids is not None:
+                rest = _filters_to_query(filters[:i] + filters[i + 1 :])
+                docs = self._get_many(table, ids)
+                return ([doc for doc in docs if rest(doc)] if rest is not None else docs), len(ids)
+        docs = self._table(table).search(_filters_to_query(filters)) if filters else self._table(table).all()
+        return docs, len(self._table(table))
+
+    def select(self, table, filters=(), order_by="id", descending=False, after=None, limit=None) -> list:
+        inicio = time.perf_counter()
+        with self._lock:
+            docs, examinados = self._select_docs(table, list(filters))
+        key = _sort_key(order_by, descending)
+        if after is not None:
+            cursor = key(Document({order_by: after[0]}, doc_id=after[1]))
+            docs = [doc for doc in docs if key(doc) > cursor]
+        if limit is None:
+            docs = sorted(docs, key=key)
+        else:
+            docs = heapq.nsmallest(limit, docs, key=key)
+        predicado = _descrever_select(filters, order_by, descending, after, limit)
+        _rastrear("select", table, predicado, examinados, len(docs), inicio)
+        return docs
+
+    def iter_select(self, table, filters=(), batch_size=500):
+        # O arquivo JSON e lido inteiro de qualquer forma: uma leitura so.
+        yield from self.select(table, filters)
+
+    def _update_locked(self, table: str, doc_ids: list[int], updates: dict) -> int | None:
+        indexes = self._table_indexes(table)
+        touched = [field for field in indexes if field in updates]
+        before = self._get_many(table, doc_ids) if touched else []
+        self._table(table).update(updates, doc_ids=doc_ids)
+        for field in touched:
+            for doc in before:
+                indexes[field].discard(doc.doc_id, doc)
+                indexes[field].add(doc.doc_id, updates)
+        return self._log({"op": "update", "table": table, "ids": [str(i) for i in doc_ids], "fields": updates})
+
+    def _remove_locked(self, table: str, doc_ids: list[int]) -> int | None:
+        before = self._get_many(table, doc_ids)
+        self._table(table).remove(doc_ids=doc_ids)
+        self._index_discard(table, before)
+        return self._log({"op": "remove", "table": table, "ids": [str(i) for i in doc_ids]})
+
+    def _examinados(self, table: str, field: str) -> int | None:
+        # Sem indice no campo a busca percorre a tabela inteira; com indice, so os encontrados (None).
+        return None if field in self._table_indexes(table) else len(self._table(table))
+
+    def _ids_matching(self, table: str, field: str, value) -> list[int]:
+        ids = self._ids_where(table, field, value)
+        if ids is None:
+            ids = [doc.doc_id for doc in self._table(table).search(Query()[field] == value)]
+        return ids
+
+    def update(self, table: str, doc_ids: list[int], updates: dict) -> None:
+        with self._lock:
+            seq = self._update_locked(table, doc_ids, updates)
+        self._sync(seq)
+
+    def update_where(self, table: str, field: str, value, updates: dict) -> None:
+        inicio = time.perf_counter()
+        with self._lock:
+            examinados = self._examinados(table, field)
+            ids = self._ids_matching(table, field, value)
+            seq = self._update_locked(table, ids, updates) if ids else None
+        self._sync(seq)
+        _rastrear("update_where", table, f"{field} == ?", examinados or len(ids), len(ids), inicio)
+
+    def remove(self, table: str, doc_ids: list[int]) -> None:
+        with self._lock:
+            seq = self._remove_locked(table, doc_ids)
+        self._sync(seq)
+
+    def remove_where(self, table: str, field: str, value) -> None:
+        inicio = time.perf_counter()
+        with self._lock:
+            examinados = self._examinados(table, field)
+            ids = self._ids_matching(table, field, value)
+            seq = self._remove_locked(table, ids) if ids else None
+        self._sync(seq)
+        _rastrear("remove_where", table, f"{field} == ?", examinados or len(ids), len(ids), inicio)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield
+
+    def upsert_increment(self, table: str, key_field: str, rows: list[tuple[dict, dict]]) -> None:
+        rows = _merge_increments(key_field, rows)
+        if not rows:
+            return
+        with self._lock:
+            existing_ids = []
+            new_docs = []
+            for key, (base, increments) in rows.items():
+                ids = self._ids_matching(table, key_field, key)
+                if ids:
+                    existing_ids.append(ids[0])
+                else:
+                    new_docs.append({**base, **increments})
+
+            def apply(doc):
+                for field, value in rows[doc[key_field]][1].items():
+                    doc[field] = doc.get(field, 0) + value
+
+            # Um update e um insert para o lote todo.
+            if existing_ids:
+                self._table(table).update(apply, doc_ids=existing_ids)
+            new_ids = self._table(table).insert_multiple(new_docs) if new_docs else []
+            self._index_add(table, [Document(doc, doc_id=doc_id) for doc, doc_id in zip(new_docs, new_ids)])
+            # No WAL vai o documento final: reaplicar o log nao soma de novo.
+            docs = {str(doc.doc_id): dict(doc) for doc in self._get_many(table, existing_ids)}
+            docs.update({str(doc_id): doc for doc, doc_id in zip(new_docs, new_ids)})
+            seq = self._log({"op": "insert", "table": table, "docs": docs})
+        self._sync(seq)
+
+
+# ---------- SQLite ----------
+# Campos materializados em colunas reais (o documento completo fica em "data").
+# Sao os campos usados em buscas e filtros; os demais ficam apenas no JSON.
+SQLITE_TABLES = {
+    "restaurantes": {"email": "TEXT", "reset_token": "TEXT"},
+    "fornecedores": {"email": "TEXT", "reset_token": "TEXT"},
+    "produtos": {
+        "nome_produto": "TEXT",
+        "atualizado_em": "TEXT",
+        "categoria": "TEXT",
+        "fornecedor_id": "INTEGER",
+        "vende_varejo": "INTEGER",
+        "vende_atacado": "INTEGER",
+        "preco_varejo": "REAL",
+        "preco_atacado": "REAL",
+    },
+    "pedidos": {"email": "TEXT", "session_id": "TEXT", "status": "TEXT", "criado_em": "TEXT"},
+    "metodos_pagamento": {"fornecedor_email": "TEXT"},
+    "tokens_revogados": {"jti": "TEXT", "exp": "INTEGER"},
+    "stripe_eventos": {"event_id": "TEXT"},
+    "vendas": {"linha_id": "TEXT", "fornecedor_id": "INTEGER", "pedido_id": "INTEGER", "data_venda": "TEXT"},
+    "vendas_resumo": {"chave": "TEXT", "fornecedor_id": "INTEGER", "periodo": "TEXT", "inicio": "TEXT"},
+}
+
+# Indices secundarios criados junto com as tabelas (tupla = indice composto).
+SQLITE_INDEXES = {
+    "restaurantes": ["email", "reset_token"],
+    "fornecedores": ["email", "reset_token"],
+    "produtos": ["categoria", "fornecedor_id", "atualizado_em"],
+    "pedidos": ["session_id", ("email", "criado_em"), "criado_em", ("status", "criado_em")],
+    "metodos_pagamento": ["fornecedor_email"],
+    "tokens_revogados": ["exp"],
+    "vendas": [("fornecedor_id", "data_venda"), "pedido_id"],
+    "vendas_resumo": [("fornecedor_id", "periodo", "inicio")],
+}
+
+
+class SQLiteBackend(StorageBackend):
+    """Backend SQLite: uma tabela por colecao, com colunas indexadas."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._known_tables: set[str] = set()
+        self._schema_lock = threading.Lock()
+        self._planos: dict[str, str] = {}
+        self._contagens: dict[str, tuple[int, float]] = {}
+        for table in SQLITE_TABLES:
+            self._ensure_table(table)
+
+    # Cada thread usa a propria conexao (sqlite3 nao compartilha entre threads).
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_table(self, table: str) -> None:
+        if table in self._known_tables:
+            return
+        with self._schema_lock:
+            if table in self._known_tables:
+                return
+            # Transacao exclusiva: varios workers podem iniciar ao mesmo tempo.
+            with self.transaction():
+                self._migrate_table(self.conn, table)
+            self._known_tables.add(table)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.conn
+        nivel = getattr(self._local, "nivel", 0)
+        # A transacao de fora trava as escritas do banco; as de dentro viram savepoints.
+        conn.execute("BEGIN IMMEDIATE" if nivel == 0 else f"SAVEPOINT s{nivel}")
+        self._local.nivel = nivel + 1
+        try:
+            yield
+        except Exception:
+            conn.execute("ROLLBACK" if nivel == 0 else f"ROLLBACK TO s{nivel}")
+            if nivel:
+                conn.execute(f"RELEASE s{nivel}")
+            raise
+        else:
+            conn.execute("COMMIT" if nivel == 0 else f"RELEASE s{nivel}")
+        finally:
+            self._local.nivel = nivel
+
+    def _migrate_table(self, conn: sqlite3.Connection, table: str) -> None:
+        columns = SQLITE_TABLES.get(table, {})
+        column_sql = "".join(f', "{name}" {kind}' for name, kind in columns.items())
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{table}" '
+            f"(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL{column_sql})"
+        )
+        # Migra bancos antigos: adiciona colunas novas e preenche a partir do JSON.
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        for name, kind in columns.items():
+            if name not in existing:
+                conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {kind}')
+                conn.execute(f'UPDATE "{table}" SET "{name}" = json_extract(data, ?)', (_json_path(name),))
+        for fields in SQLITE_INDEXES.get(table, []):
+            fields = (fields,) if isinstance(fields, str) else fields
+            name = "_".join(fields)
+            column_list = ", ".join(f'"{field}"' for field in fields)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{name}" ON "{table}" ({column_list})')
+        for field in UNIQUE_FIELDS.get(table, []):
+            try:
+                conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table}_{field}" ON "{table}" ("{field}")')
+            except sqlite3.IntegrityError:
+                # Sem o indice dois workers gravariam o mesmo valor: nao sobe ate os dados serem corrigidos.
+                duplicados = conn.execute(
+                    f'SELECT "{field}", group_concat(id, \', \') FROM "{table}" WHERE "{field}" IS NOT NULL '
+                    f'GROUP BY "{field}" HAVING count(*) > 1 ORDER BY "{field}" LIMIT 20'
+                ).fetchall()
+                linhas = "; ".join(f"{valor!r}: ids {ids}" for valor, ids in duplicados)
+                raise RuntimeError(
+                    f"Tabela {table} tem valores duplicados em {field} ({linhas}). "
+                    f"Remova ou corrija as linhas repetidas antes de iniciar."
+                ) from None
+
+    def _expr(self, table: str, field: str) -> str:
+        # Usa a coluna real quando existir; senao consulta dentro do JSON.
+        if field == "id":
+            return "id"
+        if field in SQLITE_TABLES.get(table, {}):
+            return f'"{field}"'
+        return f"json_extract(data, '{_json_path(field)}')"
+
+    def _columns(self, table: str, data: dict) -> dict:
+        return {name: data[name] for name in SQLITE_TABLES.get(table, {}) if name in data}
+
+    def _row_to_doc(self, row):
+        if row is None:
+            return None
+        return Document(json.loads(row[1]), doc_id=row[0])
+
+    def _insert_row(self, table: str, data: dict, doc_id: int | None = None) -> int:
+        columns = self._columns(table, data)
+        if doc_id is not None:
+            columns = {"id": doc_id, **columns}
+        names = "".join(f', "{name}"' for name in columns)
+        marks = ", ?" * len(columns)
+        cursor = self.conn.execute(
+            f'INSERT INTO "{table}" (data{names}) VALUES (?{marks})',
+            (json.dumps(data, ensure_ascii=False), *columns.values()),
+        )
+        return cursor.lastrowid
+
+    def insert(self, table: str, data: dict) -> int:
+        self._ensure_table(table)
+        try:
+            return self._insert_row(table, data)
+        except sqlite3.IntegrityError as exc:
+            raise _duplicate_error(table, exc) from exc
+
+    def insert_multiple(self, table: str, items: list[dict]) -> list[int]:
+        self._ensure_table(table)
+        with self.transaction():
+            try:
+                return [self._insert_row(table, item) for item in items]
+            except sqlite3.IntegrityError as exc:
+                raise _duplicate_error(table, exc) from exc
+
+    # ---------- Rastreamento ----------
+    def _plano(self, sql: str, params) -> str:
+        # EXPLAIN QUERY PLAN uma vez por texto de SQL (o plano nao depende dos valores).
+        plano = self._planos.get(sql)
+        if plano is None:
+            rows = self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            plano = self._planos[sql] = "; ".join(row[3] for row in rows)
+        return plano
+
+    def _contar(self, table: str) -> int:
+        # Contagem da tabela guardada por alguns segundos: so entra no rastreamento de varreduras.
+        contagem, momento = self._contagens.get(table, (0, 0.0))
+        if time.monotonic() - momento > 5:
+            contagem = self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            self._contagens[table] = (contagem, time.monotonic())
+        return contagem
+
+    def _rastrear_sql(self, operacao, table, predicado, sql, params, retornados, inicio) -> None:
+        if _rastreador is None:
+            return
+        # O tempo da consulta nao inclui o EXPLAIN nem a contagem abaixo.
+        fim = time.perf_counter()
+        plano = self._plano(sql, params)
+        # Estimativa: varredura (SCAN sem indice) le a tabela toda; busca por indice, so o que devolve.
+        varredura = any(
+            parte.startswith("SCAN") and "INDEX" not in parte for parte in plano.split("; ")
+        )
+        examinados = self._contar(table) if varredura else retornados
+        _rastrear(operacao, table, predicado, examinados, retornados, inicio, plano, fim)
+
+    def get(self, table: str, doc_id: int):
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        row = self.conn.execute(f'SELECT id, data FROM "{table}" WHERE id = ?', (doc_id,)).fetchone()
+        _rastrear("get", table, "id == ?", 1, row is not None, inicio)
+        return self._row_to_doc(row)
+
+    def find_one(self, table: str, field: str, value):
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        sql = f'SELECT id, data FROM "{table}" WHERE {self._expr(table, field)} = ? ORDER BY id LIMIT 1'
+        row = self.conn.execute(sql, (value,)).fetchone()
+        self._rastrear_sql("find_one", table, f"{field} == ?", sql, (value,), int(row is not None), inicio)
+        return self._row_to_doc(row)
+
+    def search(self, table: str, field: str, value) -> list:
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        sql = f'SELECT id, data FROM "{table}" WHERE {self._expr(table, field)} = ? ORDER BY id'
+        docs = [self._row_to_doc(row) for row in self.conn.execute(sql, (value,))]
+        self._rastrear_sql("search", table, f"{field} == ?", sql, (value,), len(docs), inicio)
+        return docs
+
+    def all(self, table: str) -> list:
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        rows = self.conn.execute(f'SELECT id, data FROM "{table}" ORDER BY id')
+        docs = [self._row_to_doc(row) for row in rows]
+        _rastrear("all", table, "", len(docs), len(docs), inicio)
+        return docs
+
+    def select(self, table, filters=(), order_by="id", descending=False, after=None, limit=None) -> list:
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        where: list[str] = []
+        params: list = []
+        for field, op, value in filters:
+            if op not in _OPERATORS:
+                raise ValueError(f"Operador invalido: {op}")
+            where.append(f"{self._expr(table, field)} {op if op != '==' else '='} ?")
+            params.append(value)
+
+        direction = "DESC" if descending else "ASC"
+        cmp = "<" if descending else ">"
+        if order_by == "id":
+            order_sql = f"id {direction}"
+            if after is not None:
+                where.append(f"id {cmp} ?")
+                params.append(after[1])
+        elif any(field == order_by for field, _, _ in filters):
+            # Com filtro no campo de ordenacao nao ha nulos: ORDER BY e cursor seguem
+            # direto um indice (filtro, campo) sem ordenar as linhas em memoria.
+            col = self._expr(table, order_by)
+            order_sql = f"{col} {direction}, id {direction}"
+            if after is not None:
+                where.append(f"({col}, id) {cmp} (?, ?)")
+                params.extend([after[0], after[1]])
+        else:
+            col = self._expr(table, order_by)
+            order_sql = f"({col} IS NULL), {col} {direction}, id {direction}"
+            if after is not None and after[0] is None:
+                where.append(f"({col} IS NULL AND id {cmp} ?)")
+                params.append(after[1])
+            elif after is not None:
+                where.append(f"({col} {cmp} ? OR ({col} = ? AND id {cmp} ?) OR {col} IS NULL)")
+                params.extend([after[0], after[0], after[1]])
+
+        sql = f'SELECT id, data FROM "{table}"'
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order_sql}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        docs = [self._row_to_doc(row) for row in self.conn.execute(sql, params)]
+        predicado = _descrever_select(filters, order_by, descending, after, limit)
+        self._rastrear_sql("select", table, predicado, sql, params, len(docs), inicio)
+        return docs
+
+    def _update_sql(self, table: str, updates: dict) -> tuple[str, list]:
+        # json_set altera apenas as chaves enviadas, sem reler o documento.
+        paths = ", ".join("?, json(?)" for _ in updates)
+        params: list = []
+        for key, value in updates.items():
+            params.extend([_json_path(key), json.dumps(value, ensure_ascii=False)])
+        columns = self._columns(table, updates)
+        sets = "".join(f', "{name}" = ?' for name in columns)
+        params.extend(columns.values())
+        return f'UPDATE "{table}" SET data = json_set(data, {paths}){sets}', params
+
+    def update(self, table: str, doc_ids: list[int], updates: dict) -> None:
+        if not updates or not doc_ids:
+            return
+        self._ensure_table(table)
+        sql, params = self._update_sql(table, updates)
+        marks = ", ".join("?" for _ in doc_ids)
+        self.conn.execute(f"{sql} WHERE id IN ({marks})", (*params, *doc_ids))
+
+    def update_where(self, table: str, field: str, value, updates: dict) -> None:
+        if not updates:
+            return
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        sql, params = self._update_sql(table, updates)
+        sql = f"{sql} WHERE {self._expr(table, field)} = ?"
+        alterados = self.conn.execute(sql, (*params, value)).rowcount
+        self._rastrear_sql("update_where", table, f"{field} == ?", sql, (*params, value), alterados, inicio)
+
+    def remove(self, table: str, doc_ids: list[int]) -> None:
+        if not doc_ids:
+            return
+        self._ensure_table(table)
+        marks = ", ".join("?" for _ in doc_ids)
+        self.conn.execute(f'DELETE FROM "{table}" WHERE id IN ({marks})', tuple(doc_ids))
+
+    def remove_where(self, table: str, field: str, value) -> None:
+        inicio = time.perf_counter()
+        self._ensure_table(table)
+        sql = f'DELETE FROM "{table}" WHERE {self._expr(table, field)} = ?'
+        removidos = self.conn.execute(sql, (value,)).rowcount
+        self._rastrear_sql("remove_where", table, f"{field} == ?", sql, (value,), removidos, inicio)
+
+    def upsert_increment(self, table: str, key_field: str, rows: list[tuple[dict, dict]]) -> None:
+        rows = _merge_increments(key_field, rows)
+        if not rows:
+            return
+        self._ensure_table(table)
+        conn = self.conn
+        with self.transaction():
+            for base, increments in rows.values():
+                doc = {**base, **increments}
+                columns = self._columns(table, doc)
+                names = "".join(f', "{name}"' for name in columns)
+                marks = ", ?" * len(columns)
+                # Soma dentro do JSON e nas colunas materializadas, no proprio UPSERT (atomico entre processos).
+                paths = ", ".join("?, COALESCE(json_extract(data, ?), 0) + ?" for _ in increments)
+                params = []
+                for field, value in increments.items():
+                    params.extend([_json_path(field), _json_path(field), value])
+                sets = "".join(
+                    f', "{name}" = COALESCE("{name}", 0) + ?' for name in self._columns(table, increments)
+                )
+                params.extend(self._columns(table, increments).values())
+                conn.execute(
+                    f'INSERT INTO "{table}" (data{names}) VALUES (?{marks}) '
+                    f'ON CONFLICT("{key_field}") DO UPDATE SET data = json_set(data, {paths}){sets}',
+                    (json.dumps(doc, ensure_ascii=False), *columns.values(), *params),
+                )
+
+
+_OPERATORS = {"==": operator.eq, ">=": operator.ge, "<=": operator.le}
+
+
+def _filters_to_query(filters):
+    # Traduz a lista de filtros para uma Query do TinyDB.
+    query = None
+    for field, op, value in filters:
+        if op not in _OPERATORS:
+            raise ValueError(f"Operador invalido: {op}")
+        compare = _OPERATORS[op]
+        condition = Query()[field].test(lambda current, c=compare, v=value: current is not None and c(current, v))
+        query = condition if query is None else query & condition
+    return query
+
+
+class _Reversed:
+    """Inverte a comparacao de um valor, para ordenacao decrescente com chaves mistas."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(order_by: str, descending: bool):
+    # Mesma semantica do SQLite: nulos no fim, desempate por id.
+    def key(doc):
+        value = doc.doc_id if order_by == "id" else doc.get(order_by)
+        if descending:
+            return (value is None, _Reversed(value), _Reversed(doc.doc_id))
+        return (value is None, value, doc.doc_id)
+
+    return key
+
+
+def _merge_increments(key_field: str, rows: list[tuple[dict, dict]]) -> dict:
+    # Junta linhas com a mesma chave: chave -> (base, incrementos somados).
+    merged: dict = {}
+    for base, increments in rows:
+        key = base[key_field]
+        if key in merged:
+            total = merged[key][1]
+            for field, value in increments.items():
+                total[field] = total.get(field, 0) + value
+        else:
+            merged[key] = (base, dict(increments))
+    return merged
+
+
+def _duplicate_error(table: str, exc: sqlite3.IntegrityError) -> Exception:
+    for field in UNIQUE_FIELDS.get(table, []):
+        if f"{table}.{field}" in str(exc):
+            return DuplicateKeyError(table, field)
+    return exc
+
+
+def _lock_exclusive(path: str):
+    """
+    Trava o arquivo do TinyDB para um unico processo.
+
+    O TinyDB mantem estado em memoria (indices, WAL), entao dois processos
+    no mesmo database.json perderiam escritas. Em sistemas sem fcntl
+    (Windows) a verificacao e ignorada.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(
+            f"{path} ja esta em uso por outro processo. "
+            "Para rodar varios workers use STORAGE_BACKEND=sqlite."
+        )
+    return lock_file
+
+
+def _json_path(field: str) -> str:
+    return '$."' + field.replace('"', '""') + '"'
+
+
+def copy_tinydb_to_sqlite(json_path: str, sqlite_path: str) -> None:
+    """Copia um database.json existente para o SQLite, preservando os ids."""
+    source = TinyDB(json_path)
+    target = SQLiteBackend(sqlite_path)
+    for table in source.tables():
+        target._ensure_table(table)
+        with target.transaction():
+            for doc in source.table(table).all():
+                target._insert_row(table, dict(doc), doc_id=doc.doc_id)
+    source.close()
+
+
+def create_storage(settings) -> StorageBackend:
+    """Instancia o backend configurado em settings.storage_backend."""
+    if settings.storage_backend == "tinydb":
+        return TinyDBBackend(
+            settings.database_path,
+            wal=settings.tinydb_wal,
+            wal_flush_interval=settings.wal_flush_interval_ms / 1000,
+            wal_batch_size=settings.wal_batch_size,
+            wal_compact_every=settings.wal_compact_every,
+            wal_wait_fsync=settings.wal_wait_fsync,
+        )
+    if settings.storage_backend == "sqlite":
+        return SQLiteBackend(settings.sqlite_path)
+    raise ValueError(f"Backend de armazenamento desconhecido: {settings.storage_backend}")
+
+
+class LazyStorage:
+    """
+    Cria o backend no primeiro uso e repassa as chamadas a ele.
+
+    Importar database.py nao abre o banco: o processo pai de
+    `python main.py` (reload/workers do uvicorn) nao trava o database.json
+    que o processo filho vai abrir.
+    """
+
+    def __init__(self, settings):
+        self._settings = settings
+        self._backend: StorageBackend | None = None
+        self._lock = threading.Lock()
+
+    def backend(self) -> StorageBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = create_storage(self._settings)
+        return self._backend
+
+    def __getattr__(self, nome):
+        return getattr(self.backend(), nome)
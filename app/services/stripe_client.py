@@ -0,0 +1,104 @@
+"""
+Cliente Stripe compartilhado pela API.
+
+Em vez de configurar stripe.api_key global e chamar a API de forma
+bloqueante a cada requisicao, usa um StripeClient com HTTPXClient
+assincrono:
+- conexoes keep-alive reaproveitadas (pool limitado por stripe_max_connections)
+- timeouts de conexao e de leitura configuraveis
+- novas tentativas automaticas em falhas de rede (stripe_max_network_retries),
+  seguras porque cada pedido envia a propria chave de idempotencia
+- stripe_api_base permite apontar para o servidor local (bench/stripe_stub.py)
+
+O pool do httpx pertence ao event loop que o criou, entao existe um cliente
+por loop (na API ha um so).
+"""
+
+import asyncio
+import ssl
+import threading
+import weakref
+
+import httpx
+import stripe
+
+from app.config import settings
+
+# event loop -> (StripeClient, PooledHTTPXClient)
+_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """
+    HTTPXClient da Stripe com limites de pool e timeouts separados.
+
+    O HTTPXClient nao aceita um httpx.AsyncClient pronto: o cliente que ele
+    cria e trocado por um com limites, mantendo verify_ssl_certs e o proxy,
+    e fechado junto em close_async.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float,
+        read_timeout: float,
+        max_connections: int,
+        verify_ssl_certs: bool = True,
+        proxy: str | None = None,
+    ):
+        # O proxy vai no httpx.AsyncClient (o HTTPXClient o repassaria por requisicao).
+        super().__init__(timeout=httpx.Timeout(read_timeout, connect=connect_timeout), verify_ssl_certs=verify_ssl_certs)
+        self._client_async_original = self._client_async
+        self._client_async = httpx.AsyncClient(
+            verify=ssl.create_default_context(cafile=stripe.ca_bundle_path) if verify_ssl_certs else False,
+            proxy=proxy,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def close_async(self):
+        await super().close_async()
+        await self._client_async_original.aclose()
+
+
+def create_client() -> tuple[stripe.StripeClient, PooledHTTPXClient]:
+    http_client = PooledHTTPXClient(
+        connect_timeout=settings.stripe_connect_timeout_seconds,
+        read_timeout=settings.stripe_timeout_seconds,
+        max_connections=settings.stripe_max_connections,
+    )
+    base_addresses = {"api": settings.stripe_api_base} if settings.stripe_api_base else None
+    client = stripe.StripeClient(
+        settings.stripe_api_key,
+        base_addresses=base_addresses,
+        max_network_retries=settings.stripe_max_network_retries,
+        http_client=http_client,
+    )
+    return client, http_client
+
+
+def get_client() -> stripe.StripeClient:
+    """Cliente do event loop atual (criado no primeiro uso)."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        if loop not in _clients:
+            _clients[loop] = create_client()
+        return _clients[loop][0]
+
+
+async def close() -> None:
+    """Fecha as conexoes do cliente do event loop atual (desligamento da API)."""
+    with _clients_lock:
+        entry = _clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].close_async()
+
+
+async def create_checkout_session(params: dict, idempotency_key: str):
+    """Cria a Checkout Session sem bloquear o event loop."""
+    return await get_client().v1.checkout.sessions.create_async(
+        params, options={"idempotency_key": idempotency_key}
+    )
+
+
+async def retrieve_checkout_session(session_id: str):
+    return await get_client().v1.checkout.sessions.retrieve_async(session_id)
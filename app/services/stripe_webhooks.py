@@ -0,0 +1,123 @@
+"""
+Recepcao dos webhooks da Stripe.
+
+O status do pedido passa a vir dos eventos assinados pela Stripe, e nao do
+redirecionamento do navegador para /pagamento/sucesso. Fluxo:
+- a assinatura (Stripe-Signature) e verificada antes de qualquer leitura
+- eventos ja aplicados recentemente sao respondidos na hora (cache em memoria);
+  os demais sao deduplicados pelo id na tabela stripe_eventos
+- cada evento entra em uma fila do processo; um unico consumidor junta ate
+  stripe_webhook_batch_size eventos (esperando no maximo
+  stripe_webhook_flush_interval_ms) e aplica o lote de uma vez em
+  database.aplicar_eventos_pagamento
+
+A requisicao so responde depois que o lote do seu evento foi gravado: se a
+gravacao falhar a Stripe recebe 500 e reenvia o evento. Assim uma rajada de
+webhooks depois de uma venda vira poucas escritas em lote, em vez de uma
+escrita (e uma regravacao do JSON) por evento.
+"""
+
+import asyncio
+import logging
+import threading
+import weakref
+
+import stripe
+
+from app.config import settings
+from app.services.async_database import aplicar_eventos_pagamento
+from app.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Tipo do evento -> status do pedido. checkout.session.completed so paga
+# quando payment_status ja e "paid" (boleto/pix confirmam depois, em
+# checkout.session.async_payment_succeeded).
+STATUS_POR_EVENTO = {
+    "checkout.session.completed": "pago",
+    "checkout.session.async_payment_succeeded": "pago",
+    "checkout.session.async_payment_failed": "falhou",
+    "checkout.session.expired": "cancelado",
+}
+
+# Ids de eventos ja processados por este processo (reenvios da Stripe).
+eventos_processados = LRUCache(max_items=4096, ttl=None)
+
+# event loop -> _Fila
+_filas: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_filas_lock = threading.Lock()
+
+
+class _Fila:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._consumir(), name="stripe-webhooks")
+
+    async def _consumir(self) -> None:
+        while True:
+            lote = [await self.queue.get()]
+            # Espera um pouco para juntar os eventos que chegam em rajada.
+            await asyncio.sleep(settings.stripe_webhook_flush_interval_ms / 1000)
+            while len(lote) < settings.stripe_webhook_batch_size and not self.queue.empty():
+                lote.append(self.queue.get_nowait())
+            try:
+                resultado = await aplicar_eventos_pagamento([evento for evento, _ in lote])
+            except Exception as exc:
+                logger.exception("Falha ao aplicar lote de %s eventos da Stripe", len(lote))
+                for _, future in lote:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for evento, future in lote:
+                eventos_processados.set(evento["event_id"], True)
+                if not future.done():
+                    future.set_result(resultado[evento["event_id"]])
+
+
+def _get_fila() -> _Fila:
+    loop = asyncio.get_running_loop()
+    with _filas_lock:
+        if loop not in _filas:
+            _filas[loop] = _Fila()
+        return _filas[loop]
+
+
+def construct_event(payload: bytes, sig_header: str | None) -> dict:
+    """Valida a assinatura e devolve o evento (SignatureVerificationError/ValueError se invalido)."""
+    return stripe.Webhook.construct_event(payload, sig_header, settings.stripe_webhook_secret).to_dict()
+
+
+def _evento_para_pedido(event: dict) -> dict:
+    session = event["data"]["object"]
+    status = STATUS_POR_EVENTO.get(event["type"])
+    if event["type"] == "checkout.session.completed" and session.get("payment_status") != "paid":
+        status = None
+    pedido_id = (session.get("metadata") or {}).get("pedido_id")
+    return {
+        "event_id": event["id"],
+        "tipo": event["type"],
+        "session_id": session.get("id") if session.get("object") == "checkout.session" else None,
+        "pedido_id": int(pedido_id) if pedido_id and str(pedido_id).isdigit() else None,
+        "status": status,
+    }
+
+
+async def enqueue(event: dict) -> str:
+    """Enfileira o evento e espera o lote dele ser gravado ("aplicado", "duplicado" ou "ignorado")."""
+    if eventos_processados.get(event["id"]):
+        return "duplicado"
+    future = asyncio.get_running_loop().create_future()
+    await _get_fila().queue.put((_evento_para_pedido(event), future))
+    return await future
+
+
+async def close() -> None:
+    """Encerra o consumidor do event loop atual (desligamento da API)."""
+    with _filas_lock:
+        fila = _filas.pop(asyncio.get_running_loop(), None)
+    if fila is not None:
+        fila.task.cancel()
+        try:
+            await fila.task
+        except asyncio.CancelledError:
+            pass
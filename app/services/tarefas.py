@@ -0,0 +1,374 @@
+"""
+Tarefas em segundo plano executadas dentro do processo da API.
+
+Efeitos colaterais que nao precisam atrasar a resposta (email de
+recuperacao de senha, conferencia de pedidos na Stripe, expiracao de
+pedidos pendentes) viram tarefas: a rota so grava a tarefa na fila e
+responde. Cada processo da API roda settings.tarefas_workers consumidores
+(tarefas asyncio no mesmo event loop) e um agendador das rotinas periodicas.
+
+Filas (settings.tarefas_backend):
+- "memory": lista em memoria; o que estiver pendente se perde ao reiniciar
+- "sqlite": tabela em um arquivo proprio (tarefas_sqlite_path). Sobrevive a
+  reinicios e pode ser dividida entre varios workers do uvicorn: cada tarefa
+  e reservada por um prazo (lease) e, se o processo morrer no meio, volta
+  para a fila quando o prazo vence.
+
+Uma tarefa que falha e reagendada com espera exponencial, ate
+settings.tarefas_max_tentativas; depois fica com status "falhou" (no sqlite
+continua na tabela para inspecao).
+
+Novas tarefas sao registradas com o decorador @tarefa("nome") e recebem o
+payload (dict serializavel em JSON).
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import stripe
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services import email_service, stripe_client
+from app.services.async_database import list_pedidos_pendentes, run_io, transicionar_pedidos
+
+logger = logging.getLogger(__name__)
+
+# Prazo de uma tarefa reservada antes de voltar para a fila.
+LEASE_SEGUNDOS = 300
+# Intervalo maximo entre consultas a fila quando nao ha aviso de tarefa nova.
+ESPERA_MAXIMA_SEGUNDOS = 1.0
+# Tarefas concluidas ficam guardadas (para deduplicar pela chave) por este tempo.
+RETENCAO_CONCLUIDAS_SEGUNDOS = 86400
+
+# nome -> funcao async(payload)
+TAREFAS: dict = {}
+
+
+def tarefa(nome: str):
+    """Registra a funcao como tarefa executavel pelos workers."""
+
+    def registrar(func):
+        TAREFAS[nome] = func
+        return func
+
+    return registrar
+
+
+def _espera_retentativa(tentativas: int) -> float:
+    return float(min(2 ** tentativas, 300))
+
+
+# ---------- Filas ----------
+class FilaMemoria:
+    """Fila em memoria ordenada pelo horario de execucao."""
+
+    bloqueante = False
+
+    def __init__(self):
+        self._heap: list = []
+        self._tarefas: dict[int, dict] = {}
+        self._chaves: dict[str, float] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def inserir(self, nome: str, payload: dict, chave: str | None = None, executar_em: float | None = None) -> bool:
+        agora = time.time()
+        with self._lock:
+            for antiga in [c for c, criada in self._chaves.items() if criada < agora - RETENCAO_CONCLUIDAS_SEGUNDOS]:
+                del self._chaves[antiga]
+            if chave is not None:
+                if chave in self._chaves:
+                    return False
+                self._chaves[chave] = agora
+            id = next(self._ids)
+            executar_em = agora if executar_em is None else executar_em
+            self._tarefas[id] = {"id": id, "nome": nome, "payload": payload, "tentativas": 0}
+            heapq.heappush(self._heap, (executar_em, id))
+        return True
+
+    def reservar(self) -> dict | None:
+        with self._lock:
+            if not self._heap or self._heap[0][0] > time.time():
+                return None
+            _, id = heapq.heappop(self._heap)
+            item = self._tarefas[id]
+            item["tentativas"] += 1
+            return dict(item)
+
+    def concluir(self, id: int) -> None:
+        with self._lock:
+            self._tarefas.pop(id, None)
+
+    def reagendar(self, id: int, executar_em: float, erro: str) -> None:
+        with self._lock:
+            if id in self._tarefas:
+                heapq.heappush(self._heap, (executar_em, id))
+
+    def falhar(self, id: int, erro: str) -> None:
+        self.concluir(id)
+
+    def pendentes(self) -> int:
+        with self._lock:
+            return len(self._tarefas)
+
+    def close(self) -> None:
+        pass
+
+
+class FilaSQLite:
+    """Fila persistente em SQLite (modo WAL), segura entre processos."""
+
+    bloqueante = True
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tarefas ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL, payload TEXT NOT NULL, "
+            "chave TEXT UNIQUE, status TEXT NOT NULL, tentativas INTEGER NOT NULL DEFAULT 0, "
+            "executar_em REAL NOT NULL, atualizado_em REAL NOT NULL, erro TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_tarefas_fila ON tarefas (status, executar_em)")
+        conn.execute("COMMIT")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def inserir(self, nome: str, payload: dict, chave: str | None = None, executar_em: float | None = None) -> bool:
+        agora = time.time()
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO tarefas (nome, payload, chave, status, executar_em, atualizado_em) "
+            "VALUES (?, ?, ?, 'pendente', ?, ?)",
+            (nome, json.dumps(payload, ensure_ascii=False), chave, agora if executar_em is None else executar_em, agora),
+        )
+        return cursor.rowcount == 1
+
+    def reservar(self) -> dict | None:
+        # Tarefas "executando" com o lease vencido pertenciam a um processo que morreu.
+        agora = time.time()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, nome, payload, tentativas FROM tarefas "
+                "WHERE status IN ('pendente', 'executando') AND executar_em <= ? "
+                "ORDER BY executar_em LIMIT 1",
+                (agora,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE tarefas SET status = 'executando', tentativas = tentativas + 1, "
+                    "executar_em = ?, atualizado_em = ? WHERE id = ?",
+                    (agora + LEASE_SEGUNDOS, agora, row[0]),
+                )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if row is None:
+            return None
+        return {"id": row[0], "nome": row[1], "payload": json.loads(row[2]), "tentativas": row[3] + 1}
+
+    def concluir(self, id: int) -> None:
+        agora = time.time()
+        conn = self.conn
+        conn.execute("UPDATE tarefas SET status = 'concluida', atualizado_em = ?, erro = NULL WHERE id = ?", (agora, id))
+        conn.execute(
+            "DELETE FROM tarefas WHERE status = 'concluida' AND atualizado_em < ?",
+            (agora - RETENCAO_CONCLUIDAS_SEGUNDOS,),
+        )
+
+    def reagendar(self, id: int, executar_em: float, erro: str) -> None:
+        self.conn.execute(
+            "UPDATE tarefas SET status = 'pendente', executar_em = ?, atualizado_em = ?, erro = ? WHERE id = ?",
+            (executar_em, time.time(), erro, id),
+        )
+
+    def falhar(self, id: int, erro: str) -> None:
+        self.conn.execute(
+            "UPDATE tarefas SET status = 'falhou', atualizado_em = ?, erro = ? WHERE id = ?", (time.time(), erro, id)
+        )
+
+    def pendentes(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM tarefas WHERE status IN ('pendente', 'executando')"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_fila(config=settings):
+    if config.tarefas_backend == "sqlite":
+        return FilaSQLite(config.tarefas_sqlite_path)
+    if config.tarefas_backend == "memory":
+        return FilaMemoria()
+    raise ValueError(f"TAREFAS_BACKEND invalido: {config.tarefas_backend}")
+
+
+fila = create_fila()
+
+
+async def _chamar(func, *args):
+    # A fila SQLite faz I/O: roda no executor do banco, fora do event loop.
+    if fila.bloqueante:
+        return await run_io(func, *args)
+    return func(*args)
+
+
+# ---------- Execucao ----------
+_acordar: asyncio.Event | None = None
+_executando: list[asyncio.Task] = []
+
+
+async def enqueue(nome: str, payload: dict | None = None, chave: str | None = None, atraso: float = 0) -> bool:
+    """Grava a tarefa na fila; devolve False se a chave ja existia."""
+    if nome not in TAREFAS:
+        raise ValueError(f"Tarefa desconhecida: {nome}")
+    inserida = await _chamar(fila.inserir, nome, payload or {}, chave, time.time() + atraso if atraso else None)
+    if inserida and _acordar is not None:
+        _acordar.set()
+    return inserida
+
+
+async def executar(item: dict) -> None:
+    """Executa uma tarefa reservada e registra conclusao, nova tentativa ou falha."""
+    try:
+        await TAREFAS[item["nome"]](item["payload"])
+    except Exception as exc:
+        erro = f"{type(exc).__name__}: {exc}"
+        if item["tentativas"] >= settings.tarefas_max_tentativas:
+            logger.error("Tarefa %s (%s) falhou apos %s tentativas: %s", item["nome"], item["id"], item["tentativas"], erro)
+            await _chamar(fila.falhar, item["id"], erro)
+        else:
+            logger.warning("Tarefa %s (%s) falhou, nova tentativa: %s", item["nome"], item["id"], erro)
+            executar_em = time.time() + _espera_retentativa(item["tentativas"])
+            await _chamar(fila.reagendar, item["id"], executar_em, erro)
+        return
+    await _chamar(fila.concluir, item["id"])
+
+
+async def _consumir() -> None:
+    while True:
+        # Limpa o aviso antes de ler: uma tarefa inserida depois da leitura acorda o consumidor.
+        _acordar.clear()
+        try:
+            item = await _chamar(fila.reservar)
+        except Exception:
+            logger.exception("Falha ao ler a fila de tarefas")
+            item = None
+        if item is None:
+            aviso = asyncio.ensure_future(_acordar.wait())
+            try:
+                await asyncio.wait({aviso}, timeout=ESPERA_MAXIMA_SEGUNDOS)
+            finally:
+                aviso.cancel()
+            continue
+        await executar(item)
+
+
+async def _agendar_periodicas() -> None:
+    intervalo = settings.tarefas_intervalo_segundos
+    while True:
+        # A chave por janela de tempo evita que varios workers agendem a mesma rodada.
+        janela = int(time.time() // intervalo)
+        for nome in ROTINAS_PERIODICAS:
+            try:
+                await enqueue(nome, chave=f"{nome}:{janela}")
+            except Exception:
+                logger.exception("Falha ao agendar a rotina %s", nome)
+        await asyncio.sleep(intervalo - time.time() % intervalo)
+
+
+async def start() -> None:
+    """Sobe os consumidores e o agendador no event loop atual (inicio da API)."""
+    global _acordar
+    if _executando:
+        return
+    _acordar = asyncio.Event()
+    for i in range(settings.tarefas_workers):
+        _executando.append(asyncio.create_task(_consumir(), name=f"tarefas-{i}"))
+    if settings.tarefas_intervalo_segundos > 0:
+        _executando.append(asyncio.create_task(_agendar_periodicas(), name="tarefas-agendador"))
+
+
+async def stop() -> None:
+    """Para os consumidores; tarefas interrompidas voltam para a fila (sqlite) pelo lease."""
+    tasks = list(_executando)
+    _executando.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ---------- Tarefas registradas ----------
+@tarefa("enviar_email_reset")
+async def enviar_email_reset(payload: dict) -> None:
+    await run_in_threadpool(email_service.enviar_email_reset, payload["email"], payload["token"])
+
+
+def _stripe_configurada() -> bool:
+    key = settings.stripe_api_key
+    return bool(key) and "placeholder" not in key and not key.startswith("pk_")
+
+
+@tarefa("reconciliar_pedidos")
+async def reconciliar_pedidos(payload: dict) -> None:
+    """Confere na Stripe os pedidos pendentes ha algum tempo (webhook perdido ou atrasado)."""
+    if not _stripe_configurada():
+        return
+    limite = datetime.now(timezone.utc) - timedelta(minutes=settings.pedidos_reconciliar_apos_minutos)
+    por_status: dict[str, list[int]] = {}
+    for pedido in await list_pedidos_pendentes(limite):
+        if not pedido.get("session_id"):
+            continue
+        try:
+            session = await stripe_client.retrieve_checkout_session(pedido["session_id"])
+        except stripe.StripeError as exc:
+            logger.warning("Falha ao consultar a sessao do pedido %s na Stripe: %s", pedido.doc_id, exc)
+            continue
+        if session.payment_status == "paid":
+            por_status.setdefault("pago", []).append(pedido.doc_id)
+        elif session.status == "expired":
+            por_status.setdefault("cancelado", []).append(pedido.doc_id)
+    for novo_status, ids in por_status.items():
+        alterados = await transicionar_pedidos(ids, novo_status)
+        if alterados:
+            logger.info("Reconciliacao: %s pedidos marcados como %s.", len(alterados), novo_status)
+
+
+@tarefa("expirar_pedidos")
+async def expirar_pedidos(payload: dict) -> None:
+    """Cancela pedidos que continuam pendentes depois de settings.pedidos_pendentes_expiram_horas."""
+    limite = datetime.now(timezone.utc) - timedelta(hours=settings.pedidos_pendentes_expiram_horas)
+    ids = [pedido.doc_id for pedido in await list_pedidos_pendentes(limite)]
+    if ids:
+        alterados = await transicionar_pedidos(ids, "cancelado")
+        logger.info("Expiracao: %s pedidos pendentes cancelados.", len(alterados))
+
+
+# Enfileiradas pelo agendador a cada settings.tarefas_intervalo_segundos.
+ROTINAS_PERIODICAS = ("reconciliar_pedidos", "expirar_pedidos")
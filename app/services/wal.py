@@ -0,0 +1,306 @@
+"""
+Write-ahead log para o backend TinyDB.
+
+Em vez de regravar o database.json a cada escrita, o TinyDB passa a
+trabalhar em memoria (WALMiddleware) e cada mutacao vira uma linha JSON
+num log append-only (database.json.wal):
+- group commit: uma thread grava e faz fsync das linhas pendentes em lote,
+  a cada wal_flush_interval_ms ou quando wal_batch_size linhas acumulam;
+  todos os escritores daquele lote sao liberados pelo mesmo fsync
+- nas rotas (async_database.run_io) a espera pelo fsync acontece no event
+  loop (aguardar), nao numa thread "db-io": o lote nao fica limitado ao
+  numero de threads do executor e as leituras nao esperam atras do fsync
+- compactacao: em segundo plano o estado em memoria e gravado no
+  database.json (arquivo temporario + rename atomico) e o log e descartado
+- recuperacao: ao abrir, o database.json e carregado e o log reaplicado
+- falha de disco (ex.: disco cheio) no flush: quem espera recebe
+  WriteAheadLogError e novas escritas sao recusadas, em vez de travar
+
+Os registros sao idempotentes (insert leva o id, update leva os campos),
+entao reaplicar um log ja compactado nao altera o resultado.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from tinydb.middlewares import Middleware
+
+logger = logging.getLogger(__name__)
+
+# Com uma lista no contexto, as escritas nao esperam o fsync na thread: anotam
+# (wal, seq) aqui e quem chamou espera depois com aguardar (ver run_io).
+fsync_adiado: contextvars.ContextVar[list | None] = contextvars.ContextVar("fsync_adiado", default=None)
+
+
+class WriteAheadLogError(RuntimeError):
+    """O log nao conseguiu gravar no disco; as escritas nao estao confirmadas."""
+
+
+def apply_record(data: dict, record: dict) -> None:
+    """Aplica um registro do log sobre os dados brutos do TinyDB."""
+    table = data.setdefault(record["table"], {})
+    op = record["op"]
+    if op == "insert":
+        for doc_id, doc in record["docs"].items():
+            table[doc_id] = doc
+    elif op == "update":
+        for doc_id in record["ids"]:
+            if doc_id in table:
+                table[doc_id].update(record["fields"])
+    elif op == "remove":
+        for doc_id in record["ids"]:
+            table.pop(doc_id, None)
+    else:
+        raise ValueError(f"Operacao desconhecida no WAL: {op}")
+
+
+def read_log(path: str):
+    """Le os registros de um arquivo de log, ignorando uma ultima linha truncada."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Queda no meio de uma escrita: o restante nao foi confirmado.
+                logger.warning("Linha incompleta ignorada no WAL %s", path)
+                return
+
+
+class WriteAheadLog:
+    """Log append-only com fsync em lote (group commit)."""
+
+    def __init__(self, path: str, flush_interval: float = 0.005, batch_size: int = 256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        if os.path.exists(path):
+            # Sem isso o proximo registro emendaria na linha cortada e se perderia na leitura.
+            _cortar_linha_incompleta(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending: list[str] = []
+        self._appended_seq = 0
+        self._durable_seq = 0
+        self.records_since_rotate = 0
+        self._cond = threading.Condition()
+        # (seq, loop, future) de quem espera o fsync no event loop
+        self._aguardando: list[tuple] = []
+        self._io_lock = threading.Lock()
+        self._closed = False
+        self._erro: BaseException | None = None
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flush", daemon=True)
+        self._flusher.start()
+
+    def append(self, record: dict) -> int:
+        """Enfileira um registro e devolve o numero de sequencia dele."""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._cond:
+            self._verificar()
+            self._pending.append(line)
+            self._appended_seq += 1
+            self.records_since_rotate += 1
+            # Acorda a thread de flush no inicio de um lote e quando ele enche.
+            if len(self._pending) in (1, self.batch_size):
+                self._cond.notify_all()
+            return self._appended_seq
+
+    def wait(self, seq: int) -> None:
+        """Bloqueia ate o registro seq estar gravado com fsync."""
+        with self._cond:
+            while self._durable_seq < seq and not self._closed and self._erro is None:
+                self._cond.wait()
+            if self._durable_seq < seq:
+                self._verificar()
+
+    def aguardar(self, seq: int) -> asyncio.Future:
+        """Como wait, para o event loop: future resolvida pela thread de flush."""
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        with self._cond:
+            if self._erro is not None and self._durable_seq < seq:
+                futuro.set_exception(self._falha())
+            elif self._durable_seq >= seq or self._closed:
+                futuro.set_result(None)
+            else:
+                self._aguardando.append((seq, loop, futuro))
+        return futuro
+
+    def _falha(self) -> WriteAheadLogError:
+        erro = WriteAheadLogError(f"Falha ao gravar o WAL {self.path}: {self._erro}")
+        erro.__cause__ = self._erro
+        return erro
+
+    def _verificar(self) -> None:
+        # Chamado com self._cond: depois de uma falha de disco nada mais e confirmado.
+        if self._erro is not None:
+            raise self._falha()
+
+    def _liberar(self, liberados: list[tuple], erro: BaseException | None = None) -> None:
+        for _, loop, futuro in liberados:
+            try:
+                loop.call_soon_threadsafe(_resolver, futuro, erro)
+            except RuntimeError:
+                # Event loop ja encerrado: ninguem mais espera.
+                pass
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Espera o lote encher (ou o intervalo passar) antes do fsync.
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except WriteAheadLogError:
+                # flush ja registrou a falha e liberou quem esperava com o erro.
+                logger.exception("Thread de flush do WAL encerrada")
+                return
+
+    def flush(self) -> None:
+        """Grava e faz fsync de tudo que esta pendente."""
+        with self._io_lock:
+            with self._cond:
+                self._verificar()
+                if not self._pending:
+                    return
+                lines, self._pending = self._pending, []
+                seq = self._appended_seq
+            # Novos registros podem ser enfileirados enquanto o fsync acontece.
+            try:
+                self._file.write("".join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as exc:
+                with self._cond:
+                    self._erro = exc
+                    self._cond.notify_all()
+                    falhos, self._aguardando = self._aguardando, []
+                erro = self._falha()
+                self._liberar(falhos, erro)
+                raise erro from exc
+            with self._cond:
+                self._durable_seq = seq
+                self._cond.notify_all()
+                liberados = [item for item in self._aguardando if item[0] <= seq]
+                self._aguardando = [item for item in self._aguardando if item[0] > seq]
+            self._liberar(liberados)
+
+    def rotate(self, old_path: str) -> None:
+        """
+        Move o log atual para old_path e comeca um log vazio.
+
+        Se old_path ainda existe (compactacao anterior falhou ou foi
+        interrompida), o log atual e acrescentado a ele: os registros so saem
+        do disco quando o snapshot que os contem estiver gravado.
+
+        Deve ser chamado sem escritas em andamento (com o lock do backend).
+        """
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+            if os.path.exists(old_path):
+                _cortar_linha_incompleta(old_path)
+                _cortar_linha_incompleta(self.path)
+                with open(self.path, encoding="utf-8") as atual, open(old_path, "a", encoding="utf-8") as antigo:
+                    shutil.copyfileobj(atual, antigo)
+                    antigo.flush()
+                    os.fsync(antigo.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, old_path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self.records_since_rotate = 0
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        except WriteAheadLogError:
+            logger.exception("WAL fechado com registros nao gravados")
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            liberados, self._aguardando = self._aguardando, []
+        self._liberar(liberados)
+        with self._io_lock:
+            try:
+                self._file.close()
+            except OSError:
+                # Depois de uma falha de disco o buffer do arquivo pode nao sair.
+                logger.warning("Falha ao fechar o WAL %s", self.path, exc_info=True)
+
+
+def _resolver(futuro: asyncio.Future, erro: BaseException | None = None) -> None:
+    if futuro.done():
+        return
+    if erro is None:
+        futuro.set_result(None)
+    else:
+        futuro.set_exception(erro)
+
+
+def _cortar_linha_incompleta(path: str) -> None:
+    """Remove do fim do arquivo uma linha sem quebra (queda no meio de uma escrita)."""
+    with open(path, "rb+") as log_file:
+        tamanho = log_file.seek(0, os.SEEK_END)
+        if tamanho == 0:
+            return
+        log_file.seek(tamanho - 1)
+        if log_file.read(1) == b"\n":
+            return
+        log_file.seek(0)
+        fim = log_file.read().rfind(b"\n") + 1
+        log_file.truncate(fim)
+
+
+class WALMiddleware(Middleware):
+    """
+    Middleware TinyDB que mantem os dados em memoria.
+
+    read/write nao tocam o disco; a persistencia fica a cargo do
+    WriteAheadLog e da compactacao do backend.
+    """
+
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        self.data: dict = {}
+
+    def __call__(self, *args, **kwargs):
+        super().__call__(*args, **kwargs)
+        self.data = self.storage.read() or {}
+        # O arquivo so volta a ser gravado pela compactacao (write_snapshot).
+        self.storage.close()
+        return self
+
+    def read(self):
+        return self.data
+
+    def write(self, data):
+        self.data = data
+
+    def close(self):
+        self.storage.close()
+
+
+def write_snapshot(path: str, text: str) -> None:
+    """Grava o database.json de forma atomica (temporario + fsync + rename)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as snapshot:
+        snapshot.write(text)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,12 @@
+"""
+Benchmark de carga das rotas mais usadas da API.
+
+Roda offline: a Stripe e substituida por um servidor local (stripe_stub),
+o banco e criado em uma pasta temporaria e populado por seed.py, e a API
+sobe em um processo uvicorn separado. O resultado (vazao e latencias
+p50/p95/p99 por cenario) e impresso/gravado em JSON para comparar commits
+e tamanhos de base.
+
+Uso:
+    python -m bench --sizes 1000,10000 --requests 500 --output resultado.json
+"""
@@ -0,0 +1,55 @@
+"""
+Compara dois relatorios JSON do benchmark (ex.: antes/depois de um commit).
+
+Uso:
+    python -m bench.compare antes.json depois.json
+"""
+
+import argparse
+import json
+
+
+def _indexar(relatorio: dict) -> dict:
+    return {
+        (run["size"], nome): dados
+        for run in relatorio["runs"]
+        for nome, dados in run["scenarios"].items()
+    }
+
+
+def _delta(antes: float, depois: float) -> str:
+    if not antes:
+        return "-"
+    return f"{(depois - antes) / antes * 100:+.1f}%"
+
+
+def comparar(antes: dict, depois: dict) -> list[str]:
+    a, b = _indexar(antes), _indexar(depois)
+    linhas = [f"{'tamanho':>8} {'cenario':<26} {'req/s':>10} {'p50':>9} {'p95':>9} {'p99':>9}"]
+    for chave in sorted(a.keys() & b.keys()):
+        x, y = a[chave], b[chave]
+        linhas.append(
+            f"{chave[0]:>8} {chave[1]:<26} "
+            f"{_delta(x['throughput_rps'], y['throughput_rps']):>10} "
+            f"{_delta(x['latency_ms']['p50'], y['latency_ms']['p50']):>9} "
+            f"{_delta(x['latency_ms']['p95'], y['latency_ms']['p95']):>9} "
+            f"{_delta(x['latency_ms']['p99'], y['latency_ms']['p99']):>9}"
+        )
+    return linhas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compara dois relatorios do benchmark.")
+    parser.add_argument("antes")
+    parser.add_argument("depois")
+    args = parser.parse_args()
+    with open(args.antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(args.depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    for linha in comparar(antes, depois):
+        print(linha)
+
+
+if __name__ == "__main__":
+    main()
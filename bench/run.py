@@ -0,0 +1,347 @@
+"""
+Executa os cenarios de carga contra a API e gera o relatorio em JSON.
+
+Para cada tamanho de base: cria uma pasta temporaria, popula o banco
+(bench.seed, em outro processo), sobe o uvicorn apontando para ela e para a
+Stripe local, e dispara cada cenario com N requisicoes e C conexoes
+simultaneas.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from bench import stripe_stub
+from bench.seed import CATEGORIAS, SENHA, fornecedor_email, restaurante_email, session_id
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Usuarios com token pronto para os cenarios autenticados.
+POOL_USUARIOS = 20
+# Segredo do webhook usado pela API do benchmark.
+WEBHOOK_SECRET = "whsec_bench"
+
+
+# ---------- Cenarios ----------
+# Cada cenario recebe (client, ctx, rnd) e devolve a resposta; "ok" lista os status esperados.
+async def _login(client, ctx, rnd):
+    email = restaurante_email(rnd.randrange(ctx["size"]))
+    return await client.post("/restaurantes/login", json={"email": email, "senha": SENHA})
+
+
+async def _produtos_list(client, ctx, rnd):
+    after_id = rnd.randrange(ctx["produto_id_max"] or 1)
+    return await client.get("/produtos/", params={"limit": 50, "after_id": after_id})
+
+
+async def _produtos_list_filtro(client, ctx, rnd):
+    params = {"limit": 50, "categoria": rnd.choice(CATEGORIAS), "preco_max": 100}
+    return await client.get("/produtos/", params=params)
+
+
+async def _produtos_get(client, ctx, rnd):
+    produto_id = rnd.randint(ctx["produto_id_min"], ctx["produto_id_max"])
+    return await client.get(f"/produtos/{produto_id}")
+
+
+async def _perfil_update(client, ctx, rnd):
+    token = rnd.choice(ctx["tokens_restaurante"])
+    body = {"cidade": f"Cidade {rnd.randrange(1000)}", "estado": "SP"}
+    return await client.put("/restaurantes/perfil", json=body, headers=_auth(token))
+
+
+async def _historico_compras(client, ctx, rnd):
+    token = rnd.choice(ctx["tokens_restaurante"])
+    return await client.get("/restaurantes/historico-compras", params={"limit": 20}, headers=_auth(token))
+
+
+async def _metodo_create(client, ctx, rnd):
+    i = rnd.randrange(len(ctx["tokens_fornecedor"]))
+    body = {"metodo": "pix", "detalhes": f"chave-{rnd.randrange(10**6)}"}
+    resp = await client.post("/fornecedores/metodos-pagamento", json=body, headers=_auth(ctx["tokens_fornecedor"][i]))
+    if resp.status_code == 200:
+        ctx["metodos_criados"].append((i, resp.json()["id"]))
+    return resp
+
+
+async def _metodo_list(client, ctx, rnd):
+    token = rnd.choice(ctx["tokens_fornecedor"])
+    return await client.get("/fornecedores/metodos-pagamento", headers=_auth(token))
+
+
+async def _metodo_update(client, ctx, rnd):
+    i, metodo_id = rnd.choice(ctx["metodos_criados"])
+    body = {"metodo": "boleto", "detalhes": f"conta-{rnd.randrange(10**6)}"}
+    return await client.put(
+        f"/fornecedores/metodos-pagamento/{metodo_id}", json=body, headers=_auth(ctx["tokens_fornecedor"][i])
+    )
+
+
+async def _metodo_delete(client, ctx, rnd):
+    # Cada metodo criado e removido uma unica vez.
+    i, metodo_id = ctx["metodos_criados"].pop()
+    return await client.delete(f"/fornecedores/metodos-pagamento/{metodo_id}", headers=_auth(ctx["tokens_fornecedor"][i]))
+
+
+async def _checkout(client, ctx, rnd):
+    itens = [
+        {"nome": f"Produto {rnd.randrange(ctx['size'])}", "preco_unitario": round(rnd.uniform(1, 100), 2), "quantidade": rnd.randint(1, 5)}
+        for _ in range(rnd.randint(1, 4))
+    ]
+    body = {"itens": itens, "email_cliente": restaurante_email(rnd.randrange(ctx["size"]))}
+    return await client.post("/pagamento/checkout", json=body)
+
+
+async def _webhook(client, ctx, rnd):
+    tipo = rnd.choice(["checkout.session.completed", "checkout.session.expired"])
+    payload = json.dumps(stripe_stub.evento_checkout(session_id(rnd.randrange(ctx["pedidos"])), tipo)).encode()
+    headers = {"Content-Type": "application/json", "Stripe-Signature": stripe_stub.assinar_evento(payload, WEBHOOK_SECRET)}
+    return await client.post("/pagamento/webhook", content=payload, headers=headers)
+
+
+# Ordem importa: update/delete usam os metodos criados por metodos_pagamento_create.
+CENARIOS = {
+    "login": (_login, {200}),
+    "produtos_list": (_produtos_list, {200}),
+    "produtos_list_filtro": (_produtos_list_filtro, {200}),
+    "produtos_get": (_produtos_get, {200, 404}),
+    "perfil_update": (_perfil_update, {200}),
+    "historico_compras": (_historico_compras, {200}),
+    "metodos_pagamento_create": (_metodo_create, {200}),
+    "metodos_pagamento_list": (_metodo_list, {200}),
+    "metodos_pagamento_update": (_metodo_update, {200}),
+    "metodos_pagamento_delete": (_metodo_delete, {200}),
+    "checkout": (_checkout, {200}),
+    "webhook": (_webhook, {200}),
+}
+
+
+def _auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+# ---------- Medicao ----------
+def resumir(latencias: list[float], erros: int, duracao: float) -> dict:
+    """Vazao e percentis (em ms) de um cenario."""
+    ms = sorted(value * 1000 for value in latencias)
+    if len(ms) >= 2:
+        cortes = statistics.quantiles(ms, n=100, method="inclusive")
+        p50, p95, p99 = cortes[49], cortes[94], cortes[98]
+    else:
+        p50 = p95 = p99 = ms[0] if ms else 0.0
+    return {
+        "requests": len(ms),
+        "errors": erros,
+        "throughput_rps": round(len(ms) / duracao, 2) if duracao else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3) if ms else 0.0,
+            "p50": round(p50, 3),
+            "p95": round(p95, 3),
+            "p99": round(p99, 3),
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+
+async def _executar(client, ctx, func, ok, total: int, concorrencia: int, seed: int, registrar: bool):
+    latencias: list[float] = []
+    erros = 0
+    restantes = total
+
+    async def trabalhador(numero: int):
+        nonlocal restantes, erros
+        rnd = random.Random(seed * 1000 + numero)
+        while restantes > 0:
+            restantes -= 1
+            inicio = time.perf_counter()
+            try:
+                resp = await func(client, ctx, rnd)
+                falhou = resp.status_code not in ok
+            except (httpx.HTTPError, IndexError, KeyError):
+                falhou = True
+            decorrido = time.perf_counter() - inicio
+            if falhou:
+                erros += 1
+            elif registrar:
+                latencias.append(decorrido)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador(i) for i in range(concorrencia)))
+    return latencias, erros, time.perf_counter() - inicio
+
+
+async def _login_pool(client, path: str, emails: list[str]) -> list[str]:
+    tokens = []
+    for email in emails:
+        resp = await client.post(path, json={"email": email, "senha": SENHA})
+        resp.raise_for_status()
+        tokens.append(resp.json()["access_token"])
+    return tokens
+
+
+async def rodar_cenarios(base_url: str, ctx: dict, args) -> dict:
+    limites = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=60) as client:
+        pool = min(POOL_USUARIOS, ctx["size"])
+        ctx["tokens_restaurante"] = await _login_pool(client, "/restaurantes/login", [restaurante_email(i) for i in range(pool)])
+        ctx["tokens_fornecedor"] = await _login_pool(client, "/fornecedores/login", [fornecedor_email(i) for i in range(pool)])
+        ctx["metodos_criados"] = []
+
+        resultados = {}
+        for nome, (func, ok) in CENARIOS.items():
+            if args.scenarios and nome not in args.scenarios:
+                continue
+            if args.warmup and nome != "metodos_pagamento_delete":
+                await _executar(client, ctx, func, ok, args.warmup, args.concurrency, args.seed, registrar=False)
+            total = args.requests
+            if nome == "metodos_pagamento_delete":
+                total = min(total, len(ctx["metodos_criados"]))
+            latencias, erros, duracao = await _executar(
+                client, ctx, func, ok, total, args.concurrency, args.seed, registrar=True
+            )
+            resultados[nome] = resumir(latencias, erros, duracao)
+            print(f"  {nome:<26} {resultados[nome]['throughput_rps']:>9} req/s  p95 {resultados[nome]['latency_ms']['p95']} ms", file=sys.stderr)
+        return resultados
+
+
+# ---------- Processos ----------
+def _porta_livre() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _esperar_api(base_url: str, processo: subprocess.Popen, timeout: float = 120) -> None:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("O servidor da API encerrou durante a inicializacao.")
+        try:
+            if httpx.get(f"{base_url}/produtos/", params={"limit": 1}, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("A API nao respondeu dentro do tempo limite.")
+
+
+def rodar_tamanho(size: int, stripe_url: str, args) -> dict:
+    pasta = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND=args.backend,
+        DATABASE_PATH=os.path.join(pasta, "database.json"),
+        SQLITE_PATH=os.path.join(pasta, "database.sqlite3"),
+        STRIPE_API_KEY="sk_test_bench",
+        STRIPE_API_BASE=stripe_url,
+        STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+        # Sem reconciliacao/expiracao periodica durante a medicao.
+        TAREFAS_INTERVALO_SEGUNDOS="0",
+        PYTHONPATH=str(ROOT),
+    )
+    try:
+        print(f"[{size}] populando banco ({args.backend})...", file=sys.stderr)
+        inicio = time.perf_counter()
+        saida = subprocess.run(
+            [sys.executable, "-m", "bench.seed", str(size), "--seed", str(args.seed)],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+        )
+        seed_seconds = time.perf_counter() - inicio
+        ctx = json.loads(saida.stdout.strip().splitlines()[-1])
+        ctx["size"] = size
+
+        porta = _porta_livre()
+        base_url = f"http://127.0.0.1:{porta}"
+        servidor = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", "127.0.0.1", "--port", str(porta),
+                "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+            ],
+            cwd=ROOT, env=env,
+        )
+        try:
+            _esperar_api(base_url, servidor)
+            cenarios = asyncio.run(rodar_cenarios(base_url, ctx, args))
+        finally:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+
+        dados = {k: v for k, v in ctx.items() if k in ("restaurantes", "fornecedores", "produtos", "pedidos", "metodos_pagamento")}
+        return {"size": size, "seed_seconds": round(seed_seconds, 3), "seeded": dados, "scenarios": cenarios}
+    finally:
+        if args.keep:
+            print(f"[{size}] banco mantido em {pasta}", file=sys.stderr)
+        else:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+def _git_commit() -> dict:
+    def git(*cmd):
+        return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark de carga da API.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Tamanhos de base separados por virgula.")
+    parser.add_argument("--requests", type=int, default=500, help="Requisicoes medidas por cenario.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requisicoes simultaneas.")
+    parser.add_argument("--warmup", type=int, default=20, help="Requisicoes descartadas antes de medir.")
+    parser.add_argument("--backend", default=os.getenv("STORAGE_BACKEND", "tinydb"), choices=["tinydb", "sqlite"])
+    parser.add_argument("--workers", type=int, default=1, help="Processos uvicorn (mais de 1 exige sqlite).")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=None, help="Subconjunto de cenarios.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo JSON de saida (padrao: stdout).")
+    parser.add_argument("--keep", action="store_true", help="Nao apaga o banco temporario.")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and args.backend != "sqlite":
+        parser.error("--workers > 1 exige --backend sqlite")
+    if args.scenarios:
+        desconhecidos = set(args.scenarios) - set(CENARIOS)
+        if desconhecidos:
+            parser.error(f"Cenarios desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    stripe = stripe_stub.start_in_thread()
+    try:
+        runs = [rodar_tamanho(int(size), stripe.url, args) for size in args.sizes.split(",")]
+    finally:
+        stripe.shutdown()
+
+    relatorio = {
+        "meta": {
+            **_git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "backend": args.backend,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+        },
+        "runs": runs,
+    }
+    texto = json.dumps(relatorio, indent=2)
+    if args.output:
+        Path(args.output).write_text(texto + "\n", encoding="utf-8")
+        print(f"Resultado gravado em {args.output}", file=sys.stderr)
+    else:
+        print(texto)
@@ -0,0 +1,157 @@
+"""
+Popula o banco configurado pelas variaveis de ambiente com dados sinteticos.
+
+Deve rodar em um processo proprio, com DATABASE_PATH/SQLITE_PATH apontando
+para a pasta temporaria do benchmark (o backend e criado na importacao de
+app.services.database). Imprime um JSON com o que foi criado.
+
+Uso:
+    python -m bench.seed 10000
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+from app.services import database
+from app.services.security import get_password_hash
+
+SENHA = "bench-senha-123"
+CATEGORIAS = ["Legumes", "Frutas", "Verduras", "Graos", "Laticinios", "Carnes", "Bebidas", "Temperos"]
+STATUS_PEDIDO = ["pendente", "pago", "pago", "pago", "cancelado"]
+LOTE = 5000
+AGORA = datetime.now(timezone.utc)
+
+
+def restaurante_email(i: int) -> str:
+    return f"restaurante{i}@bench.example.com"
+
+
+def fornecedor_email(i: int) -> str:
+    return f"fornecedor{i}@bench.example.com"
+
+
+def session_id(i: int) -> str:
+    return f"cs_bench_{i}"
+
+
+def _em_lotes(table: str, rows) -> int:
+    total = 0
+    lote = []
+    for row in rows:
+        lote.append(row)
+        if len(lote) == LOTE:
+            total += len(database.storage.insert_multiple(table, lote))
+            lote = []
+    if lote:
+        total += len(database.storage.insert_multiple(table, lote))
+    return total
+
+
+def seed(n: int, seed_value: int = 42) -> dict:
+    rnd = random.Random(seed_value)
+    # PBKDF2 e caro: todos os usuarios compartilham o mesmo hash.
+    senha_hash = get_password_hash(SENHA)
+
+    restaurantes = _em_lotes(
+        database.RESTAURANTES,
+        (
+            {
+                "nome": f"Restaurante {i}",
+                "email": restaurante_email(i),
+                "senha": senha_hash,
+                "numero": 1000 + i,
+                "cnpj": f"{i:014d}",
+                "ativo": True,
+                "reset_token": None,
+            }
+            for i in range(n)
+        ),
+    )
+    fornecedores = _em_lotes(
+        database.FORNECEDORES,
+        (
+            {
+                "nome": f"Fornecedor {i}",
+                "email": fornecedor_email(i),
+                "senha": senha_hash,
+                "numero": 2000 + i,
+                "cnpj": f"{i:014d}",
+            }
+            for i in range(n)
+        ),
+    )
+
+    produto_ids = []
+    for inicio in range(0, n, LOTE):
+        lote = []
+        for i in range(inicio, min(n, inicio + LOTE)):
+            varejo = rnd.random() < 0.8
+            lote.append(
+                {
+                    "nome_produto": f"Produto {i}",
+                    "categoria": rnd.choice(CATEGORIAS),
+                    "fornecedor_id": rnd.randrange(1, n + 1),
+                    "vende_varejo": varejo,
+                    "vende_atacado": not varejo or rnd.random() < 0.3,
+                    "preco_varejo": round(rnd.uniform(1, 200), 2) if varejo else None,
+                    "preco_atacado": round(rnd.uniform(1, 150), 2),
+                    "estoque_inicial": rnd.randrange(0, 1000),
+                }
+            )
+        produto_ids.extend(database.insert_produtos(lote))
+
+    pedidos = _em_lotes(
+        database.PEDIDOS,
+        (
+            {
+                "email": restaurante_email(rnd.randrange(n)),
+                "total": round(rnd.uniform(10, 2000), 2),
+                "status": rnd.choice(STATUS_PEDIDO),
+                "session_id": session_id(i),
+                # Ate tres anos atras, no mesmo formato de database._agora_iso.
+                "criado_em": (AGORA - timedelta(seconds=rnd.randrange(3 * 365 * 86400))).isoformat(timespec="microseconds"),
+                "itens": [{"nome": f"Produto {rnd.randrange(n)}", "preco_unitario": 9.9, "quantidade": 2}],
+            }
+            for i in range(n)
+        ),
+    )
+    metodos = _em_lotes(
+        database.METODOS_PAGAMENTO,
+        (
+            {
+                "metodo": "pix",
+                "detalhes": f"chave-{i}",
+                "fornecedor_email": fornecedor_email(rnd.randrange(n)),
+                "data_criacao": "2024-01-01T00:00:00",
+            }
+            for i in range(n)
+        ),
+    )
+
+    return {
+        "senha": SENHA,
+        "restaurantes": restaurantes,
+        "fornecedores": fornecedores,
+        "produtos": len(produto_ids),
+        "produto_id_min": min(produto_ids, default=0),
+        "produto_id_max": max(produto_ids, default=0),
+        "pedidos": pedidos,
+        "metodos_pagamento": metodos,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Popula o banco com dados sinteticos.")
+    parser.add_argument("n", type=int, help="Quantidade de linhas por tabela.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    resultado = seed(args.n, args.seed)
+    # Garante que o WAL do TinyDB seja compactado antes de outro processo abrir o banco.
+    database.storage.close()
+    print(json.dumps(resultado))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Servidor local que imita o endpoint de Checkout Sessions da Stripe.
+
+Responde POST /v1/checkout/sessions e GET /v1/checkout/sessions/{id} com o
+mesmo formato JSON da API real, sem rede externa. Basta apontar
+STRIPE_API_BASE para ele. Como a Stripe, repetir um POST com o mesmo
+Idempotency-Key devolve a mesma sessao. assinar_evento gera o cabecalho
+Stripe-Signature para testar /pagamento/webhook.
+
+Uso isolado:
+    python -m bench.stripe_stub --port 12111
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+_SESSION_PATH = re.compile(r"^/v1/checkout/sessions/([\w-]+)$")
+_LINE_ITEM = re.compile(r"^line_items\[(\d+)\]\[(quantity|price_data\]\[unit_amount)\]$")
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Sem log por requisicao: atrapalharia a medicao.
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_{secrets.token_hex(8)}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, {"error": {"type": "invalid_request_error", "message": message}})
+
+    def do_POST(self):
+        if self.path != "/v1/checkout/sessions":
+            return self._send_error(404, f"Unrecognized request URL (POST: {self.path})")
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode(), keep_blank_values=True)
+        session = self.server.create_session(form, self.headers.get("Idempotency-Key"))
+        self._send_json(200, session)
+
+    def do_GET(self):
+        match = _SESSION_PATH.match(self.path.split("?", 1)[0])
+        session = self.server.sessions.get(match.group(1)) if match else None
+        if session is None:
+            return self._send_error(404, "No such checkout.session")
+        self._send_json(200, session)
+
+
+class StripeStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, StripeStubHandler)
+        self.sessions: dict[str, dict] = {}
+        self.idempotency: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def create_session(self, form: dict, idempotency_key: str | None = None) -> dict:
+        with self._lock:
+            if idempotency_key in self.idempotency:
+                return self.sessions[self.idempotency[idempotency_key]]
+        itens: dict[int, dict] = {}
+        for key, values in form.items():
+            match = _LINE_ITEM.match(key)
+            if match:
+                itens.setdefault(int(match.group(1)), {})[match.group(2)] = int(values[0])
+        amount = sum(item.get("quantity", 1) * item.get("price_data][unit_amount", 0) for item in itens.values())
+
+        session_id = f"cs_test_{secrets.token_hex(12)}"
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "amount_total": amount,
+            "currency": "brl",
+            "created": int(time.time()),
+            "customer_email": form.get("customer_email", [None])[0],
+            "mode": form.get("mode", ["payment"])[0],
+            "metadata": {key[9:-1]: values[0] for key, values in form.items() if key.startswith("metadata[")},
+            "payment_status": "unpaid",
+            "status": "open",
+            "success_url": form.get("success_url", [None])[0],
+            "cancel_url": form.get("cancel_url", [None])[0],
+            "url": f"{self.url}/pay/{session_id}",
+        }
+        with self._lock:
+            self.sessions[session_id] = session
+            if idempotency_key:
+                self.idempotency[idempotency_key] = session_id
+        return session
+
+
+def evento_checkout(session_id: str, tipo: str = "checkout.session.completed", pedido_id=None) -> dict:
+    """Evento no formato da Stripe para a sessao informada."""
+    return {
+        "id": f"evt_{secrets.token_hex(12)}",
+        "object": "event",
+        "type": tipo,
+        "created": int(time.time()),
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "payment_status": "paid" if tipo == "checkout.session.completed" else "unpaid",
+                "metadata": {"pedido_id": str(pedido_id)} if pedido_id is not None else {},
+            }
+        },
+    }
+
+
+def assinar_evento(payload: bytes, secret: str, timestamp: int | None = None) -> str:
+    """Valor do cabecalho Stripe-Signature para o payload (mesmo esquema v1 da Stripe)."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    assinatura = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={assinatura}"
+
+
+def start_in_thread(port: int = 0) -> StripeStubServer:
+    """Sobe o servidor em uma thread daemon e devolve a instancia (use .url)."""
+    server = StripeStubServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, name="stripe-stub", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor local que imita a Stripe.")
+    parser.add_argument("--port", type=int, default=12111)
+    args = parser.parse_args()
+    server = StripeStubServer(("127.0.0.1", args.port))
+    print(f"Stripe local em {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
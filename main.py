@@ -4,21 +4,46 @@ Ponto de entrada da API FastAPI.
 Este arquivo cria a aplicacao e registra todos os roteadores.
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 import uvicorn
 
+from app.config import settings
+
 # Importa cada grupo de rotas da aplicacao.
 
+from app.rotas.admin_routes import router as admin_router
 from app.rotas.fornecedor_routes import router as fornecedor_router
+from app.rotas.metricas_routes import router as metricas_router
 from app.rotas.payment_routes import router as payment_routes
 from app.rotas.produto_routes import router as produto_router
 from app.rotas.restaurante_routes import router as restaurante_router
+from app.services.async_database import carregar_catalogo
+from app.services import metricas, password_hashing, perfilador, stripe_client, stripe_webhooks, tarefas
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool de hash primeiro: os filhos sobem antes das threads de I/O e das tarefas.
+    password_hashing.start()
+    await carregar_catalogo()
+    await tarefas.start()
+    yield
+    # Para as tarefas em segundo plano e libera a fila de webhooks, conexoes da Stripe
+    # e os processos de hash ao desligar o servidor.
+    await tarefas.stop()
+    await stripe_webhooks.close()
+    await stripe_client.close()
+    password_hashing.shutdown()
+
 
 # Configuracao basica exibida na documentacao Swagger.
 app = FastAPI(
     title="Sistema de Autenticacao",
     description="API para gerenciamento de usuarios e autenticacao",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Registra os endpoints na aplicacao principal.
@@ -28,6 +53,37 @@ app.include_router(fornecedor_router)
 app.include_router(produto_router)
 app.include_router(payment_routes)
 
-# Executa servidor local quando este arquivo for chamado diretamente.
+# Latencia, status e requisicoes em andamento por rota, expostos em /metrics.
+if settings.metrics_enabled:
+    app.add_middleware(metricas.MetricsMiddleware)
+    app.include_router(metricas_router)
+
+# Perfil sob demanda (X-Profile ou amostragem), lido em /admin/perfis.
+if settings.profiling_enabled:
+    app.add_middleware(perfilador.ProfilingMiddleware)
+    app.include_router(admin_router)
+
+
+
+def run() -> None:
+    """
+    Sobe o uvicorn com as configuracoes de host/porta/workers.
+
+    Cada worker e um processo com sua propria conexao ao banco. O TinyDB
+    mantem o estado em memoria e trava o arquivo, entao so o SQLite
+    (WAL + transacoes + indice UNIQUE em email) aceita varios workers.
+    """
+    if settings.workers > 1 and settings.storage_backend != "sqlite":
+        raise SystemExit("WORKERS > 1 exige STORAGE_BACKEND=sqlite.")
+    uvicorn.run(
+        "main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        reload=settings.reload and settings.workers == 1,
+    )
+
+
+# Executa servidor quando este arquivo for chamado diretamente.
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    run()